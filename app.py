@@ -1,73 +1,855 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, Flask, Response, jsonify, make_response, render_template, request, redirect, url_for, flash, session, g
+from flask import current_app
+from flask import before_render_template, has_request_context, send_from_directory, template_rendered
+import os
+import random
+import re
+import shutil
 import sqlite3
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+import click
 import csv
 import io
-from functools import wraps 
+import json
+from functools import lru_cache, wraps 
 from operator import itemgetter 
+from types import SimpleNamespace
 import datetime
+import gzip
+import hashlib
+import mimetypes
+import hmac
+import threading
+import unicodedata
+import time
+import urllib.request
+import zlib
 from datetime import timedelta
 from dateutil import parser 
+from werkzeug.security import safe_join
 
 # --- CONFIGURACIÓN INICIAL ---
-app = Flask(__name__)
-app.secret_key = 'tu_clave_secreta_aqui_para_seguridad' 
+# Las rutas, ganchos y comandos se registran en el blueprint `bp`. La aplicación la crea create_app() (al
+# final del archivo) a partir de CONFIG_POR_DEFECTO y de la configuración que reciba.
+bp = Blueprint('sgs', __name__, cli_group=None)
+CONFIG_POR_DEFECTO = {'SECRET_KEY': 'tu_clave_secreta_aqui_para_seguridad'}
+RAIZ_APP = os.path.dirname(os.path.abspath(__file__))
+
+# Base de datos y ajustes de conexión SQLite (create_app toma SGS_DB del entorno si está definida)
+CONFIG_POR_DEFECTO.setdefault('DATABASE', 'demo.db')
+CONFIG_POR_DEFECTO.setdefault('SQLITE_BUSY_TIMEOUT_MS', 5000)
+CONFIG_POR_DEFECTO.setdefault('SQLITE_CACHE_KB', 16384)
+CONFIG_POR_DEFECTO.setdefault('SQLITE_MMAP_BYTES', 64 * 1024 * 1024)
+# Reintentos de BEGIN IMMEDIATE cuando otro proceso tiene el bloqueo de escritura (espera exponencial)
+CONFIG_POR_DEFECTO.setdefault('ESCRITURA_REINTENTOS', 5)
+CONFIG_POR_DEFECTO.setdefault('ESCRITURA_ESPERA_BASE', 0.05)
 
 # Lista de meses para ordenar
 MESES_ORDEN = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
 
+def sql_orden_mes(columna='mes'):
+    """Expresión SQL con el número de mes (1-12, 99 si no es un mes) de un nombre como "Marzo (2)"."""
+    base = f"substr({columna}, 1, instr({columna} || ' (', ' (') - 1)"
+    casos = ' '.join(f"WHEN '{m}' THEN {i}" for i, m in enumerate(MESES_ORDEN, start=1))
+    return f'CASE {base} {casos} ELSE 99 END'
+
+def sql_secuencia_mes(columna='mes'):
+    """Expresión SQL con el número de copia de un mes: "Marzo" -> 1, "Marzo (2)" -> 2."""
+    return f"CASE WHEN instr({columna}, ' (') > 0 THEN CAST(substr({columna}, instr({columna}, ' (') + 2) AS INTEGER) ELSE 1 END"
+
+def sql_insertar_periodo(anio, mes):
+    """INSERT OR IGNORE de la fila de `periodo` para las expresiones SQL `anio` y `mes`."""
+    return f"""
+        INSERT OR IGNORE INTO periodo (anio, mes, anio_num, mes_num, secuencia)
+        VALUES ({anio}, {mes}, CAST({anio} AS INTEGER), {sql_orden_mes(mes)}, {sql_secuencia_mes(mes)})
+    """
+
 # --- FUNCIONES AUXILIARES DE BASE DE DATOS ---
 
-def get_conn():
-    c = sqlite3.connect('demo.db') 
+def uri_solo_lectura(ruta):
+    return 'file:' + urllib.request.pathname2url(os.path.abspath(ruta)) + '?mode=ro'
+
+def abrir_conexion(ruta=None, solo_lectura=False):
+    """Abre una conexión nueva con los PRAGMA de rendimiento aplicados."""
+    medir = current_app.config['METRICAS_ACTIVAS']
+    ruta = ruta or current_app.config['DATABASE']
+    # uri=True: las rutas normales se abren igual y ATTACH acepta URIs file:...?mode=ro
+    c = sqlite3.connect(uri_solo_lectura(ruta) if solo_lectura else ruta, uri=True,
+                        timeout=current_app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+                        factory=ConexionMedida if medir else sqlite3.Connection)
     c.row_factory = sqlite3.Row
+    c.create_function('calcular_clave_nino', 3, clave_nino, deterministic=True)
+    if medir:
+        _anotar_sql('conexiones', 1)
+    if not solo_lectura:
+        # WAL permite que los lectores no se bloqueen mientras crear/editar escriben
+        c.execute('PRAGMA journal_mode=WAL')
+        c.execute('PRAGMA synchronous=NORMAL')
+    c.execute(f"PRAGMA busy_timeout={int(current_app.config['SQLITE_BUSY_TIMEOUT_MS'])}")
+    c.execute(f"PRAGMA cache_size=-{int(current_app.config['SQLITE_CACHE_KB'])}")
+    c.execute(f"PRAGMA mmap_size={int(current_app.config['SQLITE_MMAP_BYTES'])}")
+    c.execute('PRAGMA temp_store=MEMORY')
+    if not solo_lectura and os.path.abspath(ruta) == os.path.abspath(current_app.config['DATABASE']):
+        _inicializar_una_vez(c)
     return c
 
-def init_db():
-    with get_conn() as c:
-        # TABLA SUSCEPTIBLE
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS susceptible (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nombre_nino TEXT,
-                fecha_nacimiento TEXT, 
-                nombre_madre TEXT, 
-                comunidad TEXT,
-                vacuna_pendiente TEXT,
-                anio TEXT NOT NULL,
-                mes TEXT NOT NULL,
-                es_eliminado INTEGER DEFAULT 0,
-                fecha_eliminacion TEXT NULL
-            )
-        ''')
-        
-        # TABLA METADATOS
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS metadatos_tablas (
-                anio TEXT NOT NULL,
-                mes TEXT NOT NULL,
-                responsable TEXT DEFAULT 'PENDIENTE',
-                municipio TEXT DEFAULT 'PENDIENTE',
-                puesto_salud TEXT DEFAULT 'PENDIENTE',
-                es_eliminado INTEGER DEFAULT 0,
-                fecha_eliminacion TEXT NULL,
-                PRIMARY KEY (anio, mes)
-            )
-        ''')
-        
-        # Lógica de ALTER TABLE para asegurar que las columnas de Soft Delete existan
+_bases_inicializadas = set()
+_inicializacion_lock = threading.Lock()
+
+def _inicializar_una_vez(c):
+    """Aplica las migraciones la primera vez que el proceso abre la base principal. No se hace al
+    importar: con un servidor pre-fork cada worker migra (o comprueba) al atender su primera petición."""
+    ruta = os.path.abspath(current_app.config['DATABASE'])
+    if ruta in _bases_inicializadas:
+        return
+    with _inicializacion_lock:
+        if ruta not in _bases_inicializadas:
+            aplicar_migraciones(c)
+            _bases_inicializadas.add(ruta)
+
+def _es_bloqueo(e):
+    return 'locked' in str(e) or 'busy' in str(e)
+
+def comenzar_escritura(c):
+    """BEGIN IMMEDIATE con reintentos acotados. Tomar el bloqueo al principio evita el 'database is
+    locked' a mitad de transacción (al pasar de lectura a escritura), que busy_timeout no cubre."""
+    reintentos = current_app.config['ESCRITURA_REINTENTOS']
+    for intento in range(reintentos + 1):
         try:
-            c.execute("ALTER TABLE susceptible ADD COLUMN es_eliminado INTEGER DEFAULT 0")
-            c.execute("ALTER TABLE susceptible ADD COLUMN fecha_eliminacion TEXT NULL")
-        except sqlite3.OperationalError:
-            pass
+            c.execute('BEGIN IMMEDIATE')
+            return
+        except sqlite3.OperationalError as e:
+            if intento == reintentos or not _es_bloqueo(e):
+                raise
+            _sumar('sgs_escritura_reintentos_total', ())
+            time.sleep(current_app.config['ESCRITURA_ESPERA_BASE'] * 2 ** intento * random.uniform(0.5, 1.5))
+
+@contextmanager
+def escritura(c):
+    """Transacción de escritura: confirma al salir o deshace si hay una excepción.
+    Dentro de otra transacción ya abierta no hace nada: el que la abrió la confirma."""
+    if c.in_transaction:
+        yield c
+        return
+    comenzar_escritura(c)
+    try:
+        yield c
+    except BaseException:
+        c.rollback()
+        raise
+    c.commit()
+
+def estado_app():
+    """Estado en memoria de la aplicación en curso (cachés, cola de trabajos, purga); cada create_app() tiene el suyo."""
+    return current_app.extensions['sgs']
+
+def nombre_endpoint():
+    """Endpoint de la petición sin el prefijo del blueprint: 'sgs.home' -> 'home'."""
+    return (request.endpoint or '').rpartition('.')[2]
+
+def conexion_principal():
+    """Conexión a la base principal de la petición actual (una por contexto de aplicación)."""
+    if 'db' not in g:
+        g.db = abrir_conexion()
+    return g.db
+
+def get_conn():
+    """Devuelve la conexión de la petición actual. Si la petición es sobre un año archivado,
+    es una conexión de solo lectura a su archivo (mismo esquema), así las consultas no cambian."""
+    anio = _anio_de_la_peticion()
+    if anio and anio_archivado(anio):
+        if 'db_archivo' not in g:
+            g.db_archivo = abrir_conexion(ruta_archivo(anio), solo_lectura=True)
+        return g.db_archivo
+    return conexion_principal()
+
+def cerrar_conexion(exc):
+    for nombre in ('db', 'db_archivo'):
+        c = g.pop(nombre, None)
+        if c is not None:
+            c.close()
+
+# --- MÉTRICAS (formato Prometheus en /metrics) ---
+# Latencia por endpoint, consultas SQL, filas leídas, conexiones abiertas y tiempo de render_template.
+# Los valores se acumulan en memoria por proceso y se reinician al reiniciar el servidor.
+CONFIG_POR_DEFECTO.setdefault('METRICAS_ACTIVAS', True)
+# Consultas que tarden más de este umbral (ms) se registran en el log; 0 lo desactiva
+CONFIG_POR_DEFECTO.setdefault('CONSULTA_LENTA_MS', float(os.environ.get('SGS_CONSULTA_LENTA_MS', 0)))
+
+BUCKETS_SEGUNDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+CONTADORES_SQL = ('consultas', 'segundos', 'filas', 'conexiones')
+
+class Histograma:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.conteos = [0] * (len(buckets) + 1)
+        self.suma = 0.0
+
+    def observar(self, valor):
+        self.conteos[bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+
+_metricas_lock = threading.Lock()
+_histogramas = {}                  # (nombre, etiquetas) -> Histograma
+_contadores = defaultdict(float)   # (nombre, etiquetas) -> valor
+
+def _observar(nombre, etiquetas, valor, buckets=BUCKETS_SEGUNDOS):
+    with _metricas_lock:
+        histograma = _histogramas.get((nombre, etiquetas))
+        if histograma is None:
+            histograma = _histogramas[(nombre, etiquetas)] = Histograma(buckets)
+        histograma.observar(valor)
+
+def _sumar(nombre, etiquetas, valor=1):
+    with _metricas_lock:
+        _contadores[(nombre, etiquetas)] += valor
+
+def _anotar_sql(clave, valor):
+    """Suma al acumulado de la petición en curso; fuera de una petición va directo al contador global."""
+    acumulado = g.get('metricas_sql') if has_request_context() else None
+    if acumulado is not None:
+        acumulado[clave] += valor
+    else:
+        _sumar(f'sgs_sql_{clave}_total', (('endpoint', '(fuera de petición)'),), valor)
+
+def _registrar_consulta(sql, segundos):
+    _anotar_sql('consultas', 1)
+    _anotar_sql('segundos', segundos)
+    umbral = current_app.config['CONSULTA_LENTA_MS']
+    if umbral and segundos * 1000 >= umbral:
+        current_app.logger.warning('Consulta lenta (%.1f ms): %s', segundos * 1000, ' '.join(sql.split())[:500])
+
+class CursorMedido(sqlite3.Cursor):
+    """Cursor que mide cada execute y cuenta las filas leídas."""
+
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
         try:
-            c.execute("ALTER TABLE metadatos_tablas ADD COLUMN es_eliminado INTEGER DEFAULT 0")
-            c.execute("ALTER TABLE metadatos_tablas ADD COLUMN fecha_eliminacion TEXT NULL")
-        except sqlite3.OperationalError:
-            pass
-        
-init_db()
+            return super().execute(sql, parametros)
+        finally:
+            _registrar_consulta(sql, time.perf_counter() - inicio)
+
+    def executemany(self, sql, secuencia):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, secuencia)
+        finally:
+            _registrar_consulta(sql, time.perf_counter() - inicio)
+
+    def fetchone(self):
+        fila = super().fetchone()
+        if fila is not None:
+            _anotar_sql('filas', 1)
+        return fila
+
+    def fetchmany(self, size=None):
+        filas = super().fetchmany(self.arraysize if size is None else size)
+        _anotar_sql('filas', len(filas))
+        return filas
+
+    def fetchall(self):
+        filas = super().fetchall()
+        _anotar_sql('filas', len(filas))
+        return filas
+
+    def __next__(self):
+        fila = super().__next__()
+        _anotar_sql('filas', 1)
+        return fila
+
+class ConexionMedida(sqlite3.Connection):
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, secuencia):
+        return self.cursor().executemany(sql, secuencia)
+
+@bp.before_app_request
+def iniciar_medicion():
+    if current_app.config['METRICAS_ACTIVAS']:
+        g.metricas_inicio = time.perf_counter()
+        g.metricas_sql = dict.fromkeys(CONTADORES_SQL, 0)
+
+@bp.after_app_request
+def registrar_medicion(respuesta):
+    # En respuestas en streaming (exportación) la latencia cubre hasta el envío de cabeceras
+    inicio = g.pop('metricas_inicio', None)
+    if inicio is None:
+        return respuesta
+    endpoint = nombre_endpoint() or 'desconocido'
+    _observar('sgs_peticion_segundos', (('endpoint', endpoint), ('metodo', request.method)), time.perf_counter() - inicio)
+    _sumar('sgs_peticiones_total', (('endpoint', endpoint), ('estado', str(respuesta.status_code))))
+    sql = g.pop('metricas_sql')
+    _observar('sgs_peticion_consultas', (('endpoint', endpoint),), sql['consultas'], BUCKETS_CONSULTAS)
+    for clave in CONTADORES_SQL:
+        _sumar(f'sgs_sql_{clave}_total', (('endpoint', endpoint),), sql[clave])
+    return respuesta
+
+def _inicio_render(remitente, template, context, **extra):
+    g.setdefault('metricas_render', []).append(time.perf_counter())
+
+def _fin_render(remitente, template, context, **extra):
+    inicios = g.get('metricas_render')
+    if inicios:
+        _observar('sgs_render_segundos', (('plantilla', template.name),), time.perf_counter() - inicios.pop())
+
+AYUDA_METRICAS = {
+    'sgs_peticion_segundos': ('histogram', 'Latencia de las peticiones por endpoint'),
+    'sgs_peticion_consultas': ('histogram', 'Consultas SQL por petición'),
+    'sgs_render_segundos': ('histogram', 'Tiempo de render_template por plantilla'),
+    'sgs_peticiones_total': ('counter', 'Peticiones atendidas por endpoint y estado HTTP'),
+    'sgs_sql_consultas_total': ('counter', 'Sentencias SQL ejecutadas'),
+    'sgs_sql_segundos_total': ('counter', 'Tiempo en execute de las sentencias SQL'),
+    'sgs_sql_filas_total': ('counter', 'Filas leídas de SQLite'),
+    'sgs_sql_conexiones_total': ('counter', 'Conexiones SQLite abiertas'),
+    'sgs_purga_revision_segundos_total': ('counter', 'Tiempo de la revisión de purga antes de cada petición'),
+    'sgs_escritura_reintentos_total': ('counter', 'Reintentos de BEGIN IMMEDIATE por base ocupada'),
+}
+
+def _etiquetas_prometheus(etiquetas):
+    if not etiquetas:
+        return ''
+    partes = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in etiquetas)
+    return '{' + ','.join(partes) + '}'
+
+def texto_metricas():
+    """Serializa las métricas acumuladas en el formato de texto de Prometheus."""
+    with _metricas_lock:
+        histogramas = {clave: (h.buckets, list(h.conteos), h.suma) for clave, h in _histogramas.items()}
+        contadores = dict(_contadores)
+
+    por_nombre = defaultdict(list)
+    for (nombre, etiquetas), valor in list(histogramas.items()) + list(contadores.items()):
+        por_nombre[nombre].append((etiquetas, valor))
+
+    lineas = []
+    for nombre in sorted(por_nombre):
+        tipo, ayuda = AYUDA_METRICAS.get(nombre, ('untyped', nombre))
+        lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} {tipo}']
+        for etiquetas, valor in sorted(por_nombre[nombre]):
+            if tipo != 'histogram':
+                lineas.append(f'{nombre}{_etiquetas_prometheus(etiquetas)} {valor:g}')
+                continue
+            buckets, conteos, suma = valor
+            acumulado = 0
+            for limite, conteo in zip(buckets + ('+Inf',), conteos):
+                acumulado += conteo
+                lineas.append(f'{nombre}_bucket{_etiquetas_prometheus(etiquetas + (("le", limite),))} {acumulado}')
+            lineas.append(f'{nombre}_sum{_etiquetas_prometheus(etiquetas)} {suma:g}')
+            lineas.append(f'{nombre}_count{_etiquetas_prometheus(etiquetas)} {acumulado}')
+    return '\n'.join(lineas) + '\n'
+
+# --- MIGRACIONES DE ESQUEMA ---
+# La versión aplicada se guarda en PRAGMA user_version. Cada migración corre una sola vez,
+# en su propia transacción; para cambiar el esquema se agrega una función al final de MIGRACIONES.
 
+def _agregar_columna_si_falta(c, tabla, columna, definicion):
+    columnas = {fila['name'] for fila in c.execute(f'PRAGMA table_info({tabla})')}
+    if columna not in columnas:
+        c.execute(f'ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}')
+
+def _migracion_001_tablas_base(c):
+    # TABLA SUSCEPTIBLE
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS susceptible (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre_nino TEXT,
+            fecha_nacimiento TEXT, 
+            nombre_madre TEXT, 
+            comunidad TEXT,
+            vacuna_pendiente TEXT,
+            anio TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            es_eliminado INTEGER DEFAULT 0,
+            fecha_eliminacion TEXT NULL
+        )
+    ''')
+    
+    # TABLA METADATOS
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS metadatos_tablas (
+            anio TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            responsable TEXT DEFAULT 'PENDIENTE',
+            municipio TEXT DEFAULT 'PENDIENTE',
+            puesto_salud TEXT DEFAULT 'PENDIENTE',
+            es_eliminado INTEGER DEFAULT 0,
+            fecha_eliminacion TEXT NULL,
+            PRIMARY KEY (anio, mes)
+        )
+    ''')
+    
+    # Bases anteriores al Soft Delete: asegurar que las columnas existan
+    for tabla in ('susceptible', 'metadatos_tablas'):
+        _agregar_columna_si_falta(c, tabla, 'es_eliminado', 'INTEGER DEFAULT 0')
+        _agregar_columna_si_falta(c, tabla, 'fecha_eliminacion', 'TEXT NULL')
+
+def _migracion_002_indices_periodo(c):
+    # Listados, conteos y borrados por período: filtran por anio, mes y es_eliminado y ordenan por id DESC
+    c.execute('CREATE INDEX IF NOT EXISTS idx_susceptible_periodo ON susceptible (anio, mes, es_eliminado, id DESC)')
+    # Papelera y purga: solo recorren las filas eliminadas, ordenadas por fecha de eliminación
+    c.execute('CREATE INDEX IF NOT EXISTS idx_susceptible_papelera ON susceptible (fecha_eliminacion) WHERE es_eliminado = 1')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_metadatos_papelera ON metadatos_tablas (fecha_eliminacion) WHERE es_eliminado = 1')
+    c.execute('ANALYZE')
+
+def _migracion_003_busqueda_fts(c):
+    # Índice de texto completo sin acentos ni mayúsculas ("Jose" encuentra "José").
+    # Solo contiene las filas activas (su contenido es la vista susceptible_activo): los triggers
+    # quitan las que van a la papelera y reponen las recuperadas.
+    c.execute("""
+        CREATE VIEW IF NOT EXISTS susceptible_activo AS
+        SELECT id, nombre_nino, nombre_madre, comunidad FROM susceptible WHERE es_eliminado = 0
+    """)
+    c.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS susceptible_fts USING fts5(
+            nombre_nino, nombre_madre, comunidad,
+            content='susceptible_activo', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS susceptible_fts_insertar AFTER INSERT ON susceptible
+        WHEN new.es_eliminado = 0 BEGIN
+            INSERT INTO susceptible_fts (rowid, nombre_nino, nombre_madre, comunidad)
+            VALUES (new.id, new.nombre_nino, new.nombre_madre, new.comunidad);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS susceptible_fts_borrar AFTER DELETE ON susceptible
+        WHEN old.es_eliminado = 0 BEGIN
+            INSERT INTO susceptible_fts (susceptible_fts, rowid, nombre_nino, nombre_madre, comunidad)
+            VALUES ('delete', old.id, old.nombre_nino, old.nombre_madre, old.comunidad);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS susceptible_fts_actualizar
+        AFTER UPDATE OF nombre_nino, nombre_madre, comunidad, es_eliminado ON susceptible BEGIN
+            INSERT INTO susceptible_fts (susceptible_fts, rowid, nombre_nino, nombre_madre, comunidad)
+            SELECT 'delete', old.id, old.nombre_nino, old.nombre_madre, old.comunidad WHERE old.es_eliminado = 0;
+            INSERT INTO susceptible_fts (rowid, nombre_nino, nombre_madre, comunidad)
+            SELECT new.id, new.nombre_nino, new.nombre_madre, new.comunidad WHERE new.es_eliminado = 0;
+        END
+    """)
+    c.execute("INSERT INTO susceptible_fts (susceptible_fts) VALUES ('rebuild')")
+
+# Aporte de una fila de susceptible a los contadores de period_stats (r = new u old en los triggers)
+def _aportes_stats(r):
+    activo = f"({r}.es_eliminado IS 0)"
+    pendiente = (f"({r}.es_eliminado IS 0 AND {r}.vacuna_pendiente IS NOT NULL "
+                 f"AND {r}.vacuna_pendiente != '' AND {r}.vacuna_pendiente != 'NINGUNA')")
+    eliminado = f"({r}.es_eliminado IS 1)"
+    return activo, pendiente, eliminado
+
+def _sql_sumar_stats(r):
+    activo, pendiente, eliminado = _aportes_stats(r)
+    return f"""
+        INSERT INTO period_stats (anio, mes, activos, pendientes, eliminados)
+        VALUES ({r}.anio, {r}.mes, {activo}, {pendiente}, {eliminado})
+        ON CONFLICT (anio, mes) DO UPDATE SET
+            activos = activos + excluded.activos,
+            pendientes = pendientes + excluded.pendientes,
+            eliminados = eliminados + excluded.eliminados;
+    """
+
+def _sql_restar_stats(r):
+    activo, pendiente, eliminado = _aportes_stats(r)
+    return f"""
+        UPDATE period_stats SET
+            activos = activos - {activo},
+            pendientes = pendientes - {pendiente},
+            eliminados = eliminados - {eliminado}
+        WHERE anio = {r}.anio AND mes = {r}.mes;
+    """
+
+# Conteo completo desde susceptible; lo usan la migración y el comando de reparación
+SQL_CONTEO_STATS = """
+    SELECT anio, mes,
+           SUM(es_eliminado IS 0) AS activos,
+           SUM(es_eliminado IS 0 AND vacuna_pendiente IS NOT NULL AND vacuna_pendiente != '' AND vacuna_pendiente != 'NINGUNA') AS pendientes,
+           SUM(es_eliminado IS 1) AS eliminados
+    FROM susceptible
+    GROUP BY anio, mes
+"""
+
+# Aporte de un susceptible (r = new u old) a comunidad_stats y, por cada vacuna pendiente, a vacuna_stats
+def _sql_sumar_comunidad(r):
+    return f"""
+        INSERT INTO comunidad_stats (anio, mes, comunidad, activos)
+        VALUES ({r}.anio, {r}.mes, COALESCE({r}.comunidad, ''), ({r}.es_eliminado IS 0))
+        ON CONFLICT (anio, mes, comunidad) DO UPDATE SET activos = activos + excluded.activos;
+    """
+
+def _sql_restar_comunidad(r):
+    return f"""
+        UPDATE comunidad_stats SET activos = activos - ({r}.es_eliminado IS 0)
+        WHERE anio = {r}.anio AND mes = {r}.mes AND comunidad = COALESCE({r}.comunidad, '');
+    """
+
+def _sql_sumar_vacunas(r):
+    return f"""
+        INSERT INTO vacuna_stats (anio, mes, comunidad, vacuna_id, pendientes)
+        SELECT {r}.anio, {r}.mes, COALESCE({r}.comunidad, ''), vacuna_id, 1
+        FROM susceptible_vacuna WHERE susceptible_id = {r}.id AND {r}.es_eliminado IS 0
+        ON CONFLICT (anio, vacuna_id, comunidad, mes) DO UPDATE SET pendientes = pendientes + 1;
+    """
+
+def _sql_restar_vacunas(r):
+    return f"""
+        UPDATE vacuna_stats SET pendientes = pendientes - 1
+        WHERE {r}.es_eliminado IS 0 AND anio = {r}.anio AND mes = {r}.mes AND comunidad = COALESCE({r}.comunidad, '')
+          AND vacuna_id IN (SELECT vacuna_id FROM susceptible_vacuna WHERE susceptible_id = {r}.id);
+    """
+
+SQL_CONTEO_COMUNIDAD = """
+    SELECT anio, mes, COALESCE(comunidad, ''), COUNT(*)
+    FROM susceptible WHERE es_eliminado = 0
+    GROUP BY 1, 2, 3
+"""
+
+SQL_CONTEO_VACUNAS = """
+    SELECT s.anio, s.mes, COALESCE(s.comunidad, ''), sv.vacuna_id, COUNT(*)
+    FROM susceptible_vacuna sv JOIN susceptible s ON s.id = sv.susceptible_id
+    WHERE s.es_eliminado = 0
+    GROUP BY 1, 2, 3, 4
+"""
+
+def _migracion_004_period_stats(c):
+    # Contadores materializados por período: home() lee los totales con una búsqueda por clave primaria.
+    # Los triggers los mantienen en cualquier ruta de escritura (crear, editar, papelera, recuperar, purga).
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS period_stats (
+            anio TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            activos INTEGER NOT NULL DEFAULT 0,
+            pendientes INTEGER NOT NULL DEFAULT 0,
+            eliminados INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (anio, mes)
+        ) WITHOUT ROWID
+    """)
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS period_stats_insertar AFTER INSERT ON susceptible BEGIN {_sql_sumar_stats('new')} END")
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS period_stats_borrar AFTER DELETE ON susceptible BEGIN {_sql_restar_stats('old')} END")
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS period_stats_actualizar
+        AFTER UPDATE OF anio, mes, es_eliminado, vacuna_pendiente ON susceptible BEGIN
+            {_sql_restar_stats('old')}
+            {_sql_sumar_stats('new')}
+        END
+    """)
+    c.execute('DELETE FROM period_stats')
+    c.execute(f'INSERT INTO period_stats (anio, mes, activos, pendientes, eliminados) {SQL_CONTEO_STATS}')
+
+def _migracion_005_indice_papelera_periodo(c):
+    # Resumen de la papelera por año/mes: recorre solo el índice de las filas eliminadas
+    c.execute('CREATE INDEX IF NOT EXISTS idx_susceptible_papelera_periodo ON susceptible (anio, mes, fecha_eliminacion) WHERE es_eliminado = 1')
+
+def _migracion_006_periodo(c):
+    # Clave entera por período: año y mes numéricos y número de copia ("Marzo (2)" -> mes 3, secuencia 2).
+    # Ordenar, filtrar por rango y unir se hace sobre enteros indexados en lugar de textos.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS periodo (
+            id INTEGER PRIMARY KEY,
+            anio TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            anio_num INTEGER NOT NULL,
+            mes_num INTEGER NOT NULL,
+            secuencia INTEGER NOT NULL,
+            UNIQUE (anio, mes)
+        )
+    """)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_periodo_orden ON periodo (anio_num, mes_num, secuencia)')
+    c.execute(f"""
+        INSERT OR IGNORE INTO periodo (anio, mes, anio_num, mes_num, secuencia)
+        SELECT anio, mes, CAST(anio AS INTEGER), {sql_orden_mes()}, {sql_secuencia_mes()}
+        FROM (SELECT anio, mes FROM metadatos_tablas UNION SELECT anio, mes FROM susceptible)
+    """)
+
+    _agregar_columna_si_falta(c, 'susceptible', 'periodo_id', 'INTEGER REFERENCES periodo (id)')
+    c.execute('UPDATE susceptible SET periodo_id = (SELECT p.id FROM periodo p WHERE p.anio = susceptible.anio AND p.mes = susceptible.mes)')
+    c.execute('DROP INDEX IF EXISTS idx_susceptible_periodo')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_susceptible_periodo_id ON susceptible (periodo_id, es_eliminado, id DESC)')
+
+    # Todo mes nuevo recibe su fila en periodo; las inserciones sin periodo_id (scripts externos) se completan
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS periodo_desde_metadatos AFTER INSERT ON metadatos_tablas BEGIN
+            {sql_insertar_periodo('new.anio', 'new.mes')};
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS susceptible_asignar_periodo AFTER INSERT ON susceptible
+        WHEN new.periodo_id IS NULL BEGIN
+            {sql_insertar_periodo('new.anio', 'new.mes')};
+            UPDATE susceptible SET periodo_id = (SELECT id FROM periodo WHERE anio = new.anio AND mes = new.mes)
+            WHERE id = new.id;
+        END
+    """)
+    c.execute('ANALYZE')
+
+def _sql_subir_version_anio(anio):
+    return f"""
+        INSERT INTO version_anio (anio, version) VALUES ({anio}, 1)
+        ON CONFLICT (anio) DO UPDATE SET version = version + 1;
+    """
+
+def _migracion_007_version_anio(c):
+    # Sello de versión por año: cualquier escritura sobre susceptible o metadatos_tablas lo incrementa.
+    # Las cachés por año (resumen_anio) comparan este número para saber si siguen vigentes.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS version_anio (
+            anio TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    for tabla in ('susceptible', 'metadatos_tablas'):
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS version_anio_{tabla}_insertar AFTER INSERT ON {tabla} BEGIN {_sql_subir_version_anio('new.anio')} END")
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS version_anio_{tabla}_borrar AFTER DELETE ON {tabla} BEGIN {_sql_subir_version_anio('old.anio')} END")
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS version_anio_{tabla}_actualizar AFTER UPDATE ON {tabla} BEGIN
+                {_sql_subir_version_anio('new.anio')}
+                UPDATE version_anio SET version = version + 1 WHERE anio = old.anio AND old.anio IS NOT new.anio;
+            END
+        """)
+
+# Columnas cuyo cambio se registra en el historial (no incluye las derivadas: periodo_id, row_version, updated_at)
+COLUMNAS_SEGUIDAS = {
+    'susceptible': ('nombre_nino', 'fecha_nacimiento', 'nombre_madre', 'comunidad', 'vacuna_pendiente',
+                    'anio', 'mes', 'es_eliminado', 'fecha_eliminacion'),
+    'metadatos_tablas': ('anio', 'mes', 'responsable', 'municipio', 'puesto_salud', 'es_eliminado', 'fecha_eliminacion'),
+}
+SQL_AHORA = "strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')"
+
+def _sql_registrar_cambio(tabla, r, operacion):
+    registro_id = f'{r}.id' if tabla == 'susceptible' else 'NULL'
+    return f"""
+        INSERT INTO cambios (tabla, registro_id, anio, mes, operacion, fecha)
+        VALUES ('{tabla}', {registro_id}, {r}.anio, {r}.mes, {operacion}, {SQL_AHORA});
+    """
+
+def _migracion_008_historial_cambios(c):
+    # Historial de cambios con secuencia creciente (seq) para la sincronización incremental (/api/v1/cambios).
+    # Cada fila guarda en row_version el seq de su último cambio y en updated_at la fecha.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS cambios (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabla TEXT NOT NULL,
+            registro_id INTEGER,
+            anio TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            operacion TEXT NOT NULL,
+            fecha TEXT NOT NULL
+        )
+    """)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_cambios_periodo ON cambios (anio, mes, seq)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_cambios_fecha ON cambios (fecha)')
+
+    for tabla, columnas in COLUMNAS_SEGUIDAS.items():
+        _agregar_columna_si_falta(c, tabla, 'row_version', 'INTEGER NOT NULL DEFAULT 0')
+        _agregar_columna_si_falta(c, tabla, 'updated_at', 'TEXT NULL')
+        clave = 'id' if tabla == 'susceptible' else 'rowid'
+        sellar = f"UPDATE {tabla} SET row_version = last_insert_rowid(), updated_at = {SQL_AHORA} WHERE {clave} = new.{clave};"
+        operacion_update = ("CASE WHEN old.es_eliminado IS NOT 1 AND new.es_eliminado IS 1 THEN 'eliminar' "
+                            "WHEN old.es_eliminado IS 1 AND new.es_eliminado IS NOT 1 THEN 'recuperar' ELSE 'actualizar' END")
+
+        # El sello de row_version/updated_at no debe volver a subir version_anio: se limita a las columnas seguidas
+        c.execute(f'DROP TRIGGER IF EXISTS version_anio_{tabla}_actualizar')
+        c.execute(f"""
+            CREATE TRIGGER version_anio_{tabla}_actualizar AFTER UPDATE OF {', '.join(columnas)} ON {tabla} BEGIN
+                {_sql_subir_version_anio('new.anio')}
+                UPDATE version_anio SET version = version + 1 WHERE anio = old.anio AND old.anio IS NOT new.anio;
+            END
+        """)
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS cambios_{tabla}_insertar AFTER INSERT ON {tabla} BEGIN
+                {_sql_registrar_cambio(tabla, 'new', "'insertar'")}
+                {sellar}
+            END
+        """)
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS cambios_{tabla}_actualizar AFTER UPDATE OF {', '.join(columnas)} ON {tabla} BEGIN
+                {_sql_registrar_cambio(tabla, 'new', operacion_update)}
+                {sellar}
+            END
+        """)
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS cambios_{tabla}_borrar AFTER DELETE ON {tabla} BEGIN
+                {_sql_registrar_cambio(tabla, 'old', "'purgar'")}
+            END
+        """)
+
+    # Punto de partida del historial: una entrada por cada fila existente
+    c.execute(f"""
+        INSERT INTO cambios (tabla, registro_id, anio, mes, operacion, fecha)
+        SELECT 'metadatos_tablas', NULL, anio, mes, CASE es_eliminado WHEN 1 THEN 'eliminar' ELSE 'insertar' END, {SQL_AHORA}
+        FROM metadatos_tablas
+    """)
+    c.execute(f"""
+        INSERT INTO cambios (tabla, registro_id, anio, mes, operacion, fecha)
+        SELECT 'susceptible', id, anio, mes, CASE es_eliminado WHEN 1 THEN 'eliminar' ELSE 'insertar' END, {SQL_AHORA}
+        FROM susceptible ORDER BY id
+    """)
+
+def _migracion_009_anios_archivados(c):
+    # Años movidos a archive_<anio>.db (ver `flask archivar-anio`); se listan junto a los años activos
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS anio_archivado (
+            anio TEXT PRIMARY KEY,
+            responsable TEXT,
+            municipio TEXT,
+            susceptibles INTEGER NOT NULL,
+            fecha_archivo TEXT NOT NULL
+        )
+    """)
+
+def _migracion_010_trabajos(c):
+    # Cola de trabajos largos (papelera de un año o período, purga): los toma el hilo de trabajos
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS trabajos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            parametros TEXT NOT NULL,
+            clave TEXT NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'pendiente',
+            total INTEGER,
+            procesados INTEGER NOT NULL DEFAULT 0,
+            cancelar INTEGER NOT NULL DEFAULT 0,
+            mensaje TEXT,
+            creado TEXT NOT NULL,
+            iniciado TEXT,
+            latido TEXT,
+            terminado TEXT
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_trabajos_activos ON trabajos (clave, id) WHERE estado IN ('pendiente', 'en_curso')")
+
+def _migracion_011_clave_nino(c):
+    # Identidad del niño entre períodos (ver clave_nino): se calcula al escribir, no con un trigger,
+    # para que la base se pueda seguir editando desde fuera de la app sin la función registrada
+    _agregar_columna_si_falta(c, 'susceptible', 'clave_nino', 'TEXT')
+    c.execute('UPDATE susceptible SET clave_nino = calcular_clave_nino(nombre_nino, nombre_madre, fecha_nacimiento) WHERE clave_nino IS NULL')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_susceptible_clave_nino ON susceptible (clave_nino, periodo_id)')
+
+def _migracion_012_vacunas(c):
+    # Catálogo de vacunas y relación con los susceptibles (a partir del texto libre vacuna_pendiente),
+    # más los agregados de cobertura por período y comunidad que mantienen los triggers
+    c.execute('CREATE TABLE IF NOT EXISTS vacuna (id INTEGER PRIMARY KEY, codigo TEXT NOT NULL UNIQUE, nombre TEXT NOT NULL, catalogada INTEGER NOT NULL DEFAULT 0)')
+    c.executemany('INSERT OR IGNORE INTO vacuna (codigo, nombre, catalogada) VALUES (?, ?, 1)',
+                  [(codigo, nombre) for codigo, (nombre, _) in CATALOGO_VACUNAS.items()])
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS susceptible_vacuna (
+            susceptible_id INTEGER NOT NULL,
+            vacuna_id INTEGER NOT NULL REFERENCES vacuna (id),
+            PRIMARY KEY (susceptible_id, vacuna_id)
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS comunidad_stats (
+            anio TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            comunidad TEXT NOT NULL,
+            activos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (anio, mes, comunidad)
+        ) WITHOUT ROWID
+    """)
+    # Clave (anio, vacuna_id, ...): "SPR pendiente por comunidad en 2025" es un rango del índice primario
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS vacuna_stats (
+            anio TEXT NOT NULL,
+            vacuna_id INTEGER NOT NULL,
+            comunidad TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            pendientes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (anio, vacuna_id, comunidad, mes)
+        ) WITHOUT ROWID
+    """)
+
+    # Carga inicial antes de los triggers: los agregados se calculan de una vez con GROUP BY
+    actualizar_vacunas(c, '1')
+    c.execute(f'INSERT INTO comunidad_stats (anio, mes, comunidad, activos) {SQL_CONTEO_COMUNIDAD}')
+    c.execute(f'INSERT INTO vacuna_stats (anio, mes, comunidad, vacuna_id, pendientes) {SQL_CONTEO_VACUNAS}')
+
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS comunidad_stats_insertar AFTER INSERT ON susceptible BEGIN
+            {_sql_sumar_comunidad('new')}
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS cobertura_borrar AFTER DELETE ON susceptible BEGIN
+            {_sql_restar_comunidad('old')}
+            {_sql_restar_vacunas('old')}
+            DELETE FROM susceptible_vacuna WHERE susceptible_id = old.id;
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS cobertura_actualizar
+        AFTER UPDATE OF anio, mes, comunidad, es_eliminado ON susceptible BEGIN
+            {_sql_restar_comunidad('old')}
+            {_sql_sumar_comunidad('new')}
+            {_sql_restar_vacunas('old')}
+            {_sql_sumar_vacunas('new')}
+        END
+    """)
+    # Cambios en la lista de vacunas de un susceptible (actualizar_vacunas borra y vuelve a insertar)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS vacuna_stats_insertar AFTER INSERT ON susceptible_vacuna BEGIN
+            INSERT INTO vacuna_stats (anio, mes, comunidad, vacuna_id, pendientes)
+            SELECT s.anio, s.mes, COALESCE(s.comunidad, ''), new.vacuna_id, 1
+            FROM susceptible s WHERE s.id = new.susceptible_id AND s.es_eliminado IS 0
+            ON CONFLICT (anio, vacuna_id, comunidad, mes) DO UPDATE SET pendientes = pendientes + 1;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS vacuna_stats_borrar AFTER DELETE ON susceptible_vacuna BEGIN
+            UPDATE vacuna_stats SET pendientes = pendientes - 1
+            WHERE (anio, mes, comunidad, vacuna_id) = (
+                SELECT s.anio, s.mes, COALESCE(s.comunidad, ''), old.vacuna_id
+                FROM susceptible s WHERE s.id = old.susceptible_id AND s.es_eliminado IS 0
+            );
+        END
+    """)
+
+MIGRACIONES = [
+    _migracion_001_tablas_base,
+    _migracion_002_indices_periodo,
+    _migracion_003_busqueda_fts,
+    _migracion_004_period_stats,
+    _migracion_005_indice_papelera_periodo,
+    _migracion_006_periodo,
+    _migracion_007_version_anio,
+    _migracion_008_historial_cambios,
+    _migracion_009_anios_archivados,
+    _migracion_010_trabajos,
+    _migracion_011_clave_nino,
+    _migracion_012_vacunas,
+]
+
+def init_db():
+    """Aplica las migraciones pendientes. Si el esquema está al día no ejecuta ningún DDL."""
+    aplicar_migraciones(conexion_principal())
+
+def aplicar_migraciones(c):
+    if c.execute('PRAGMA user_version').fetchone()[0] >= len(MIGRACIONES):
+        return
+
+    for numero, migracion in enumerate(MIGRACIONES, start=1):
+        # BEGIN IMMEDIATE + relectura: si otro proceso ya migró, no se repite
+        comenzar_escritura(c)
+        try:
+            if c.execute('PRAGMA user_version').fetchone()[0] >= numero:
+                c.rollback()
+                continue
+            migracion(c)
+            c.execute(f'PRAGMA user_version = {numero}')
+            c.commit()
+        except Exception:
+            c.rollback()
+            raise
+        current_app.logger.info('Migración %d aplicada: %s', numero, migracion.__name__)
+        
 # --- DECORADOR Y AUXILIARES ---
 
 def login_required(f):
@@ -75,7 +857,7 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if 'logged_in' not in session or not session['logged_in']:
             flash('Debes iniciar sesión para acceder a esta página.', 'warning')
-            return redirect(url_for('login', next=request.url))
+            return redirect(url_for('sgs.login', next=request.url))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -85,29 +867,1256 @@ def get_current_period():
     mes = session.get('mes_activo') 
     return anio, mes
 
+def obtener_periodo_id(c, anio, mes, crear=False):
+    """Devuelve el id entero del período (None si no existe). Con `crear` lo registra si hace falta."""
+    if crear:
+        c.execute(sql_insertar_periodo(':anio', ':mes'), {'anio': anio, 'mes': mes})
+    fila = c.execute('SELECT id FROM periodo WHERE anio=? AND mes=?', (anio, mes)).fetchone()
+    return fila['id'] if fila else None
+
+def periodos_del_anio(c, anio, mes_desde=1, mes_hasta=12, solo_activos=True):
+    """Meses de un año en orden cronológico (mes y copia), opcionalmente en un rango: (1, 3) es el primer trimestre."""
+    filtro = ' AND m.es_eliminado = 0' if solo_activos else ''
+    return c.execute(f"""
+        SELECT p.id, m.anio, m.mes, m.responsable, m.municipio, m.puesto_salud
+        FROM periodo p
+        JOIN metadatos_tablas m ON m.anio = p.anio AND m.mes = p.mes
+        WHERE p.anio = ? AND p.mes_num BETWEEN ? AND ?{filtro}
+        ORDER BY p.mes_num, p.secuencia, p.mes
+    """, (anio, mes_desde, mes_hasta)).fetchall()
+
+CONFIG_POR_DEFECTO.setdefault('PAGINA_TAMANO', 50)
+
+def paginar_por_id(c, sql_base, params, antes=None, despues=None, tamano=None):
+    """Paginación por cursor sobre `id DESC` (keyset): el costo no depende del tamaño del período.
+
+    `sql_base` es un SELECT con cláusula WHERE y sin ORDER BY. `antes` pide la página siguiente
+    (ids menores) y `despues` la anterior (ids mayores). Devuelve (filas, cursor_anterior,
+    cursor_siguiente); un cursor en None significa que no hay más páginas en esa dirección.
+    """
+    tamano = tamano or current_app.config['PAGINA_TAMANO']
+    if despues is not None:
+        filas = c.execute(f'{sql_base} AND id > ? ORDER BY id ASC LIMIT ?', (*params, despues, tamano + 1)).fetchall()
+        hay_mas = len(filas) > tamano
+        filas = filas[:tamano][::-1]
+        hay_anterior, hay_siguiente = hay_mas, True
+    else:
+        if antes is not None:
+            filas = c.execute(f'{sql_base} AND id < ? ORDER BY id DESC LIMIT ?', (*params, antes, tamano + 1)).fetchall()
+        else:
+            filas = c.execute(f'{sql_base} ORDER BY id DESC LIMIT ?', (*params, tamano + 1)).fetchall()
+        hay_siguiente = len(filas) > tamano
+        filas = filas[:tamano]
+        hay_anterior = antes is not None
+
+    if not filas:
+        return filas, None, None
+    return filas, (filas[0]['id'] if hay_anterior else None), (filas[-1]['id'] if hay_siguiente else None)
+
+def totales_periodo(c, anio, mes):
+    """Devuelve (activos, pendientes) del período desde period_stats (una lectura por clave primaria)."""
+    fila = c.execute('SELECT activos, pendientes FROM period_stats WHERE anio=? AND mes=?', (anio, mes)).fetchone()
+    return (fila['activos'], fila['pendientes']) if fila else (0, 0)
+
+def recalcular_period_stats(c, reparar=True):
+    """Compara period_stats con un conteo completo de susceptible y, si `reparar`, corrige las diferencias.
+
+    Devuelve la lista de períodos con diferencias como (anio, mes, guardado, real).
+    """
+    reales = {(f['anio'], f['mes']): (f['activos'], f['pendientes'], f['eliminados']) for f in c.execute(SQL_CONTEO_STATS)}
+    guardados = {(f['anio'], f['mes']): (f['activos'], f['pendientes'], f['eliminados'])
+                 for f in c.execute('SELECT anio, mes, activos, pendientes, eliminados FROM period_stats')}
+
+    diferencias = []
+    for clave in sorted(reales.keys() | guardados.keys()):
+        real = reales.get(clave, (0, 0, 0))
+        guardado = guardados.get(clave, (0, 0, 0))
+        if real != guardado:
+            diferencias.append((*clave, guardado, real))
+
+    if reparar and diferencias:
+        with escritura(c):
+            c.execute('DELETE FROM period_stats')
+            c.execute(f'INSERT INTO period_stats (anio, mes, activos, pendientes, eliminados) {SQL_CONTEO_STATS}')
+    return diferencias
+
+@bp.cli.command('recalcular-estadisticas')
+@click.option('--solo-verificar', is_flag=True, help='Informa las diferencias sin corregirlas.')
+def recalcular_estadisticas_cmd(solo_verificar):
+    """Verifica y repara los contadores por período (period_stats) y reconstruye los de cobertura de vacunas."""
+    diferencias = recalcular_period_stats(get_conn(), reparar=not solo_verificar)
+    if not solo_verificar:
+        recalcular_cobertura(get_conn())
+    for anio, mes, guardado, real in diferencias:
+        print(f'{anio}-{mes}: guardado {guardado} / real {real} (activos, pendientes, eliminados)')
+    estado = 'sin corregir' if solo_verificar else 'corregidos'
+    print(f'{len(diferencias)} períodos con diferencias ({estado}).' if diferencias else 'Contadores al día.')
+
+CONFIG_POR_DEFECTO.setdefault('BUSQUEDA_LIMITE', 100)
+
+def consulta_fts(texto):
+    """Convierte lo escrito por el usuario en una consulta FTS5 por prefijo ("jos mar" -> "jos"* "mar"*)."""
+    palabras = re.findall(r'\w+', texto or '')
+    return ' '.join(f'"{p}"*' for p in palabras)
+
+def buscar_susceptibles(c, texto, anio=None, mes=None, limite=None, esquema='main'):
+    """Búsqueda ordenada por relevancia. Con anio/mes se limita a ese período; sin ellos busca en todos.
+    `esquema` permite buscar en una base adjunta (ATTACH) con el mismo esquema."""
+    consulta = consulta_fts(texto)
+    if not consulta:
+        return []
+    sql = """
+        SELECT s.id, s.anio, s.mes, s.nombre_nino, s.fecha_nacimiento, s.nombre_madre, s.comunidad, s.vacuna_pendiente, f.rank
+        FROM {esquema}.susceptible_fts f
+        JOIN {esquema}.susceptible s ON s.id = f.rowid
+        WHERE f.susceptible_fts MATCH ? AND s.es_eliminado = 0
+    """.format(esquema=esquema)
+    params = [consulta]
+    if anio is not None:
+        sql += ' AND s.anio = ?'
+        params.append(anio)
+    if mes is not None:
+        sql += ' AND s.mes = ?'
+        params.append(mes)
+    sql += ' ORDER BY rank LIMIT ?'
+    params.append(limite or current_app.config['BUSQUEDA_LIMITE'])
+    return c.execute(sql, params).fetchall()
+
+# Identidad del niño entre períodos: el mismo niño se vuelve a registrar en cada mes en que sigue
+# debiendo una vacuna. clave_nino une esos registros y su historial se lee con el índice idx_susceptible_clave_nino.
+
+def _plegar_texto(texto):
+    """Minúsculas, sin tildes ni signos, un espacio entre palabras: "  José  Ñáñez" -> "jose nanez"."""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    sin_tildes = ''.join(ch for ch in descompuesto if not unicodedata.combining(ch))
+    return ' '.join(re.findall(r'\w+', sin_tildes.casefold()))
+
+def clave_nino(nombre_nino, nombre_madre, fecha_nacimiento):
+    """Clave de identidad: nombres del niño y de la madre plegados + fecha de nacimiento en AAAA-MM-DD."""
+    try:
+        fecha = normalizar_fecha(fecha_nacimiento)
+    except ValueError:
+        fecha = (fecha_nacimiento or '').strip()
+    return f'{_plegar_texto(nombre_nino)}|{_plegar_texto(nombre_madre)}|{fecha}'
+
+def _sql_clave_nino(c, esquema='main'):
+    """Columna clave_nino, o su cálculo si `esquema` es un archivo creado antes de que existiera."""
+    if any(col['name'] == 'clave_nino' for col in c.execute(f'PRAGMA {esquema}.table_info(susceptible)')):
+        return 's.clave_nino'
+    return 'calcular_clave_nino(s.nombre_nino, s.nombre_madre, s.fecha_nacimiento)'
+
+def historial_nino(clave):
+    """Registros activos de un niño en todos los períodos (incluidos los años archivados), en orden cronológico."""
+    c = conexion_principal()
+    sql = """
+        SELECT s.id, s.anio, s.mes, s.nombre_nino, s.fecha_nacimiento, s.nombre_madre, s.comunidad, s.vacuna_pendiente,
+               {pendiente} AS pendiente, p.anio_num, p.mes_num, p.secuencia
+        FROM {esquema}.susceptible s
+        JOIN {esquema}.periodo p ON p.id = s.periodo_id
+        WHERE {clave} = ? AND s.es_eliminado = 0
+    """
+    filas = c.execute(sql.format(pendiente=SQL_VACUNA_PENDIENTE, esquema='main', clave='s.clave_nino'), (clave,)).fetchall()
+    for _ in adjuntar_archivos(c):
+        filas += c.execute(sql.format(pendiente=SQL_VACUNA_PENDIENTE, esquema='archivo', clave=_sql_clave_nino(c, 'archivo')), (clave,)).fetchall()
+    return sorted(filas, key=itemgetter('anio_num', 'mes_num', 'secuencia', 'id'))
+
+def duplicados_del_anio(c, anio):
+    """Niños registrados más de una vez en un mismo período del año (misma clave_nino).
+    Las filas sin clave (escritas por SQL directo, sin calcular_clave_nino) no forman grupo entre sí."""
+    clave = _sql_clave_nino(c)
+    return c.execute(f"""
+        SELECT s.anio, s.mes, COUNT(*) AS registros, MIN(s.id) AS id, group_concat(s.id, ', ') AS ids,
+               group_concat(DISTINCT s.nombre_nino) AS nombres, MIN(s.nombre_madre) AS nombre_madre,
+               MIN(s.fecha_nacimiento) AS fecha_nacimiento
+        FROM periodo p
+        JOIN susceptible s ON s.periodo_id = p.id
+        WHERE p.anio = ? AND s.es_eliminado = 0 AND {clave} IS NOT NULL
+        GROUP BY p.id, {clave}
+        HAVING COUNT(*) > 1
+        ORDER BY p.mes_num, p.secuencia, registros DESC
+    """, (anio,)).fetchall()
+
+# --- VACUNAS: CATÁLOGO Y COBERTURA ---
+# vacuna_pendiente sigue siendo texto libre en los formularios, el CSV y la API; al escribir se traduce
+# a filas de susceptible_vacuna y los triggers mantienen comunidad_stats y vacuna_stats.
+
+CATALOGO_VACUNAS = {
+    'BCG': ('BCG', ('bcg',)),
+    'HEPB': ('Hepatitis B', ('hepb', 'hep b', 'hepatitis b', 'hb', 'hvb')),
+    'PENTA': ('Pentavalente', ('penta', 'pentavalente')),
+    'POLIO': ('Polio (IPV/OPV)', ('polio', 'antipolio', 'ipv', 'opv', 'bopv', 'vpi', 'vop')),
+    'ROTA': ('Rotavirus', ('rota', 'rotavirus')),
+    'NEUMO': ('Neumococo', ('neumo', 'neumococo', 'neumococica', 'pcv', 'pcv10', 'pcv13')),
+    'SPR': ('SPR (sarampión, paperas, rubéola)', ('spr', 'srp', 'mmr', 'triple viral', 'sarampion')),
+    'DPT': ('DPT', ('dpt', 'dtp', 'dtap')),
+    'TD': ('Td', ('td',)),
+    'INFLUENZA': ('Influenza', ('influenza', 'flu', 'gripe')),
+    'VARICELA': ('Varicela', ('varicela',)),
+    'HEPA': ('Hepatitis A', ('hepa', 'hep a', 'hepatitis a', 'ha')),
+    'VPH': ('VPH', ('vph', 'hpv', 'papiloma')),
+    'FA': ('Fiebre amarilla', ('fa', 'fiebre amarilla')),
+}
+ALIAS_VACUNAS = {alias: codigo for codigo, (_, alias_) in CATALOGO_VACUNAS.items() for alias in alias_}
+SIN_VACUNA = {'', 'ninguna', 'ninguno', 'no', 'na', 'n a', 'nada'}
+_SEPARADORES_VACUNAS = re.compile(r'[,;/+\n]|\by\b', re.IGNORECASE)
+_DOSIS = re.compile(r'\b(?:\d+(?:ra|da|ta|ro|do|er|to|a|o)?|primera|segunda|tercera|cuarta|quinta|dosis|refuerzo|ref)\b')
+
+@lru_cache(maxsize=4096)
+def parsear_vacunas(texto):
+    """Códigos del catálogo en un texto libre: "SPR, Penta 3ra dosis y polio" -> ('SPR', 'PENTA', 'POLIO').
+    Lo que no se reconoce se devuelve plegado y en mayúsculas (entra al catálogo como no catalogada)."""
+    codigos = []
+    for parte in _SEPARADORES_VACUNAS.split(texto or ''):
+        plegado = _plegar_texto(parte)
+        if plegado in SIN_VACUNA:
+            continue
+        sin_dosis = ' '.join(_DOSIS.sub(' ', plegado).split())
+        if not sin_dosis:
+            continue
+        codigo = ALIAS_VACUNAS.get(plegado) or ALIAS_VACUNAS.get(sin_dosis) or ALIAS_VACUNAS.get(sin_dosis.split()[0])
+        codigo = codigo or sin_dosis.upper()
+        if codigo not in codigos:
+            codigos.append(codigo)
+    return tuple(codigos)
+
+def actualizar_vacunas(c, filtro, params=()):
+    """Recalcula susceptible_vacuna desde vacuna_pendiente para los susceptibles que cumplen `filtro` (SQL).
+    Se llama en la misma transacción que la escritura del texto."""
+    filas = [(f['id'], parsear_vacunas(f['vacuna_pendiente']))
+             for f in c.execute(f'SELECT id, vacuna_pendiente FROM susceptible WHERE {filtro}', params)]
+    nuevos = {codigo for _, codigos in filas for codigo in codigos}
+    c.executemany('INSERT OR IGNORE INTO vacuna (codigo, nombre) VALUES (?, ?)', [(codigo, codigo) for codigo in nuevos])
+    ids = {f['codigo']: f['id'] for f in c.execute('SELECT id, codigo FROM vacuna')}
+    c.execute(f'DELETE FROM susceptible_vacuna WHERE susceptible_id IN (SELECT id FROM susceptible WHERE {filtro})', params)
+    c.executemany('INSERT INTO susceptible_vacuna (susceptible_id, vacuna_id) VALUES (?, ?)',
+                  [(id_, ids[codigo]) for id_, codigos in filas for codigo in codigos])
+
+def recalcular_cobertura(c):
+    """Reconstruye comunidad_stats y vacuna_stats con un conteo completo."""
+    with escritura(c):
+        c.execute('DELETE FROM comunidad_stats')
+        c.execute('DELETE FROM vacuna_stats')
+        c.execute(f'INSERT INTO comunidad_stats (anio, mes, comunidad, activos) {SQL_CONTEO_COMUNIDAD}')
+        c.execute(f'INSERT INTO vacuna_stats (anio, mes, comunidad, vacuna_id, pendientes) {SQL_CONTEO_VACUNAS}')
+
+def reporte_cobertura(c, anio, vacuna_id, mes=None):
+    """Activos y pendientes de una vacuna por período y comunidad, leídos de los agregados (sin recorrer susceptible)."""
+    filtro_mes = ' AND cs.mes = :mes' if mes else ''
+    return c.execute(f"""
+        SELECT cs.mes, cs.comunidad, cs.activos, COALESCE(vs.pendientes, 0) AS pendientes
+        FROM comunidad_stats cs
+        LEFT JOIN vacuna_stats vs
+               ON vs.anio = cs.anio AND vs.vacuna_id = :vacuna AND vs.comunidad = cs.comunidad AND vs.mes = cs.mes
+        WHERE cs.anio = :anio AND cs.activos > 0{filtro_mes}
+        ORDER BY {sql_orden_mes('cs.mes')}, {sql_secuencia_mes('cs.mes')}, cs.comunidad
+    """, {'anio': anio, 'vacuna': vacuna_id, 'mes': mes}).fetchall()
+
 # ⭐️ FUNCIÓN DE LIMPIEZA PERIÓDICA (Eliminación Definitiva) ⭐️
-def limpiar_papelera_definitiva():
-    """Elimina permanentemente los registros de la papelera con más de 30 días."""
-    
-    fecha_limite = (datetime.datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+# La purga ya no corre en cada petición: se ejecuta como máximo una vez por
+# intervalo (PURGA_INTERVALO_SEGUNDOS), desde un hilo en segundo plano
+# (PURGA_EN_SEGUNDO_PLANO) o con el comando `flask purgar-papelera`.
+CONFIG_POR_DEFECTO.setdefault('PAPELERA_DIAS', 30)
+CONFIG_POR_DEFECTO.setdefault('PURGA_INTERVALO_SEGUNDOS', 3600)
+CONFIG_POR_DEFECTO.setdefault('PURGA_LOTE', 500)
+CONFIG_POR_DEFECTO.setdefault('PURGA_EN_SEGUNDO_PLANO', False)
+CONFIG_POR_DEFECTO.setdefault('CAMBIOS_DIAS', 90)
 
-    with get_conn() as c:
-        # 1. Eliminar Susceptibles individuales
-        c.execute('DELETE FROM susceptible WHERE es_eliminado = 1 AND fecha_eliminacion < ?', (fecha_limite,))
-        
-        # 2. Eliminar Metadatos (Meses/Años)
-        c.execute('DELETE FROM metadatos_tablas WHERE es_eliminado = 1 AND fecha_eliminacion < ?', (fecha_limite,))
-        
-        c.commit()
+def _fecha_limite_papelera():
+    dias = current_app.config['PAPELERA_DIAS']
+    return (datetime.datetime.now() - timedelta(days=dias)).strftime('%Y-%m-%d %H:%M:%S')
+
+def _hay_elementos_caducados(c, fecha_limite):
+    """Consulta de solo lectura: evita tomar el bloqueo de escritura si no hay nada que purgar."""
+    fila = c.execute("""
+        SELECT 1 FROM susceptible WHERE es_eliminado = 1 AND fecha_eliminacion < ?
+        UNION ALL
+        SELECT 1 FROM metadatos_tablas WHERE es_eliminado = 1 AND fecha_eliminacion < ?
+        LIMIT 1
+    """, (fecha_limite, fecha_limite)).fetchone()
+    return fila is not None
+
+def _borrar_en_lotes(c, tabla, clave, fecha_limite, lote, avance=None):
+    """Borra los registros caducados de `tabla` en lotes acotados, confirmando cada lote.
+    `avance(borrados)` se llama después de confirmar cada lote."""
+    sql = f"""
+        DELETE FROM {tabla} WHERE {clave} IN (
+            SELECT {clave} FROM {tabla}
+            WHERE es_eliminado = 1 AND fecha_eliminacion < ?
+            LIMIT ?
+        )
+    """
+    total = 0
+    while True:
+        with escritura(c):
+            borrados = c.execute(sql, (fecha_limite, lote)).rowcount
+        total += borrados
+        if avance:
+            avance(borrados)
+        if borrados < lote:
+            return total
+
+def _recortar_historial(c, lote):
+    fecha_limite = (datetime.datetime.now() - timedelta(days=current_app.config['CAMBIOS_DIAS'])).strftime('%Y-%m-%d %H:%M:%S')
+    if c.execute('SELECT 1 FROM cambios WHERE fecha < ? LIMIT 1', (fecha_limite,)).fetchone() is None:
+        return 0
+    total = 0
+    while True:
+        with escritura(c):
+            borrados = c.execute('DELETE FROM cambios WHERE seq IN (SELECT seq FROM cambios WHERE fecha < ? ORDER BY seq LIMIT ?)', (fecha_limite, lote)).rowcount
+        total += borrados
+        if borrados < lote:
+            return total
+
+def limpiar_papelera_definitiva(lote=None, c=None, fecha_limite=None, avance=None):
+    """Elimina permanentemente los registros de la papelera con más de PAPELERA_DIAS días.
+
+    Devuelve un resumen con la cantidad de filas purgadas por tabla y la duración. La cola de trabajos
+    pasa su conexión y un `avance` que anota el progreso después de cada lote.
+    """
+    lote = lote or current_app.config['PURGA_LOTE']
+    fecha_limite = fecha_limite or _fecha_limite_papelera()
+    inicio = time.perf_counter()
+    resumen = {'susceptibles': 0, 'metadatos': 0, 'cambios': 0}
+
+    with (c or conexion_principal()) as c:
+        if _hay_elementos_caducados(c, fecha_limite):
+            # 1. Eliminar Susceptibles individuales
+            resumen['susceptibles'] = _borrar_en_lotes(c, 'susceptible', 'id', fecha_limite, lote, avance)
 
-@app.before_request
+            # 2. Eliminar Metadatos (Meses/Años)
+            resumen['metadatos'] = _borrar_en_lotes(c, 'metadatos_tablas', 'rowid', fecha_limite, lote, avance)
+
+        # 3. Recortar el historial de cambios (los clientes más atrasados deberán resincronizar)
+        resumen['cambios'] = _recortar_historial(c, lote)
+
+    resumen['segundos'] = round(time.perf_counter() - inicio, 4)
+    if resumen['susceptibles'] or resumen['metadatos']:
+        current_app.logger.info('Papelera purgada: %(susceptibles)d susceptibles, %(metadatos)d metadatos en %(segundos)ss', resumen)
+    return resumen
+
+def purgar_si_corresponde(forzar=False):
+    """Ejecuta la purga solo si pasó el intervalo configurado desde la última. Devuelve el resumen o None."""
+    estado = estado_app()
+    ahora = time.monotonic()
+    # time.monotonic() parte de un origen arbitrario (a menudo el arranque del equipo): no se compara con 0
+    if not forzar and estado.ultima_purga is not None and ahora - estado.ultima_purga < current_app.config['PURGA_INTERVALO_SEGUNDOS']:
+        return None
+    if not estado.purga_lock.acquire(blocking=False):
+        return None  # Otro hilo ya está purgando
+    try:
+        estado.ultima_purga = ahora
+        return limpiar_papelera_definitiva()
+    finally:
+        estado.purga_lock.release()
+
+def iniciar_purga_en_segundo_plano():
+    """Lanza un hilo daemon que purga la papelera de la aplicación en curso cada PURGA_INTERVALO_SEGUNDOS."""
+    app = current_app._get_current_object()
+    def ciclo():
+        while True:
+            try:
+                with app.app_context():
+                    purgar_si_corresponde(forzar=True)
+            except Exception:
+                app.logger.exception('Error al purgar la papelera')
+            time.sleep(app.config['PURGA_INTERVALO_SEGUNDOS'])
+
+    hilo = threading.Thread(target=ciclo, name='purga-papelera', daemon=True)
+    hilo.start()
+    return hilo
+
+@bp.before_app_request
 def cleanup_papelera():
-    limpiar_papelera_definitiva()
+    # Los archivos estáticos nunca disparan la purga; con el hilo activo tampoco las peticiones.
+    if request.endpoint == 'static' or current_app.config['PURGA_EN_SEGUNDO_PLANO']:
+        return
+    inicio = time.perf_counter()
+    purgar_si_corresponde()
+    if current_app.config['METRICAS_ACTIVAS']:
+        _sumar('sgs_purga_revision_segundos_total', (), time.perf_counter() - inicio)
+
+@bp.cli.command('purgar-papelera')
+def purgar_papelera_cmd():
+    """Purga la papelera ahora e informa cuántas filas se eliminaron."""
+    resumen = purgar_si_corresponde(forzar=True)
+    if resumen is None:
+        print('Ya hay una purga en curso.')
+        return
+    print(f"Purgados {resumen['susceptibles']} susceptibles y {resumen['metadatos']} metadatos en {resumen['segundos']}s")
+
+# --- COLA DE TRABAJOS (operaciones largas sobre un año o período) ---
+# La petición solo encola el trabajo y redirige a su página de progreso. Un hilo por proceso los ejecuta
+# en transacciones de TRABAJOS_LOTE filas, así el bloqueo de escritura se libera entre lotes y las demás
+# peticiones siguen atendiéndose. Los trabajos de un mismo año (clave) se ejecutan en orden, uno a la vez.
+CONFIG_POR_DEFECTO.setdefault('TRABAJOS_LOTE', 1000)
+CONFIG_POR_DEFECTO.setdefault('TRABAJOS_EN_HILO', True)
+CONFIG_POR_DEFECTO.setdefault('TRABAJOS_ESPERA_SEGUNDOS', 2)
+# Un trabajo 'en_curso' sin avances en este tiempo se considera abandonado (proceso caído) y se retoma
+CONFIG_POR_DEFECTO.setdefault('TRABAJOS_VENCIMIENTO_SEGUNDOS', 300)
+
+DESCRIPCION_TRABAJOS = {
+    'eliminar_anio': 'Enviar el año {anio} a la papelera',
+    'recuperar_anio': 'Recuperar el año {anio}',
+    'eliminar_periodo': 'Enviar el período {mes} {anio} a la papelera',
+    'vaciar_mes': 'Enviar los registros de {mes} {anio} a la papelera',
+    'recuperar_periodo': 'Recuperar el período {mes} {anio}',
+    'purgar_papelera': 'Purgar la papelera',
+    'respaldar': 'Copia de seguridad de la base',
+}
+
+class TrabajoCancelado(Exception):
+    pass
+
+def _ahora():
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def encolar_trabajo(tipo, **parametros):
+    """Registra un trabajo pendiente y avisa al hilo de trabajos. Devuelve su id."""
+    with escritura(conexion_principal()) as c:
+        id_trabajo = c.execute('INSERT INTO trabajos (tipo, parametros, clave, creado) VALUES (?, ?, ?, ?)',
+                               (tipo, json.dumps(parametros), parametros.get('anio') or tipo, _ahora())).lastrowid
+    if current_app.config['TRABAJOS_EN_HILO']:
+        iniciar_trabajador()
+        estado_app().trabajos_evento.set()
+    return id_trabajo
+
+def _avanzar(c, id_trabajo, procesados):
+    """Anota el progreso (dentro de la transacción del lote) y devuelve si se pidió cancelar."""
+    return c.execute('UPDATE trabajos SET procesados = ?, latido = ? WHERE id = ? RETURNING cancelar',
+                     (procesados, _ahora(), id_trabajo)).fetchone()['cancelar']
+
+def _cambiar_estado_en_lotes(c, id_trabajo, anio, mes=None, eliminar=True, metadatos=True):
+    """Envía a la papelera (o recupera) los susceptibles de un año o período, un lote por transacción.
+
+    Con `metadatos`, también los meses: al recuperar van primero y al eliminar al final, para que un
+    trabajo cancelado deje los registros ya procesados visibles en la papelera o en su mes.
+    """
+    # Las rutas ya lo rechazan; el año pudo archivarse mientras el trabajo esperaba en la cola
+    if anio_archivado(anio):
+        raise ValueError(f'El año {anio} está archivado: solo se puede consultar y exportar.')
+    p = {'anio': anio, 'mes': mes, 'fecha': _ahora(), 'origen': 0 if eliminar else 1, 'lote': current_app.config['TRABAJOS_LOTE']}
+    if mes is None:
+        filtro, filtro_meta = 'periodo_id IN (SELECT id FROM periodo WHERE anio = :anio)', 'anio = :anio'
+    else:
+        filtro, filtro_meta = 'periodo_id = (SELECT id FROM periodo WHERE anio = :anio AND mes = :mes)', 'anio = :anio AND mes = :mes'
+    asignacion = 'es_eliminado = 1, fecha_eliminacion = :fecha' if eliminar else 'es_eliminado = 0, fecha_eliminacion = NULL'
+    sql_meta = f'UPDATE metadatos_tablas SET {asignacion} WHERE {filtro_meta} AND es_eliminado = :origen'
+
+    with escritura(c):
+        total = c.execute(f'SELECT COUNT(*) FROM susceptible WHERE {filtro} AND es_eliminado = :origen', p).fetchone()[0]
+        c.execute('UPDATE trabajos SET total = ? WHERE id = ?', (total, id_trabajo))
+        if metadatos and not eliminar:
+            c.execute(sql_meta, p)
+
+    procesados = 0
+    while True:
+        with escritura(c):
+            n = c.execute(f"""UPDATE susceptible SET {asignacion}
+                              WHERE id IN (SELECT id FROM susceptible WHERE {filtro} AND es_eliminado = :origen LIMIT :lote)""", p).rowcount
+            procesados += n
+            cancelar = _avanzar(c, id_trabajo, procesados)
+        if n < p['lote']:
+            break
+        if cancelar:
+            raise TrabajoCancelado(f'Cancelado después de procesar {procesados} de {total} registros.')
+
+    if metadatos and eliminar:
+        with escritura(c):
+            c.execute(sql_meta, p)
+    return f'{procesados} registros procesados.'
+
+def _purgar_papelera_trabajo(c, id_trabajo):
+    fecha_limite = _fecha_limite_papelera()
+    with escritura(c):
+        total = c.execute("""
+            SELECT (SELECT COUNT(*) FROM susceptible WHERE es_eliminado = 1 AND fecha_eliminacion < :limite)
+                 + (SELECT COUNT(*) FROM metadatos_tablas WHERE es_eliminado = 1 AND fecha_eliminacion < :limite)
+        """, {'limite': fecha_limite}).fetchone()[0]
+        c.execute('UPDATE trabajos SET total = ? WHERE id = ?', (total, id_trabajo))
+
+    procesados = 0
+    def avance(borrados):
+        nonlocal procesados
+        procesados += borrados
+        with escritura(c):
+            cancelar = _avanzar(c, id_trabajo, procesados)
+        if cancelar:
+            raise TrabajoCancelado(f'Cancelado después de purgar {procesados} de {total} elementos.')
+
+    # Con el mismo candado que la purga periódica: en este proceso no corren dos purgas a la vez
+    with estado_app().purga_lock:
+        resumen = limpiar_papelera_definitiva(c=c, fecha_limite=fecha_limite, avance=avance)
+    return f"Purgados {resumen['susceptibles']} susceptibles y {resumen['metadatos']} metadatos."
+
+def _respaldar_trabajo(c, id_trabajo):
+    # La copia lee desde `c`: el progreso que se anota con esa misma conexión no reinicia el backup
+    def progreso(copiadas, total):
+        with escritura(c):
+            c.execute('UPDATE trabajos SET total = ? WHERE id = ?', (total, id_trabajo))
+            if _avanzar(c, id_trabajo, copiadas):
+                raise TrabajoCancelado(f'Cancelado después de copiar {copiadas} de {total} páginas.')
+    resumen = crear_respaldo(c, progreso)
+    return f"Respaldo {resumen['nombre']} ({resumen['bytes_comprimido'] // 1024} KB, integridad {resumen['integridad']})."
+
+TAREAS = {
+    'eliminar_anio': lambda c, t, anio: _cambiar_estado_en_lotes(c, t, anio),
+    'recuperar_anio': lambda c, t, anio: _cambiar_estado_en_lotes(c, t, anio, eliminar=False),
+    'eliminar_periodo': lambda c, t, anio, mes: _cambiar_estado_en_lotes(c, t, anio, mes),
+    'vaciar_mes': lambda c, t, anio, mes: _cambiar_estado_en_lotes(c, t, anio, mes, metadatos=False),
+    'recuperar_periodo': lambda c, t, anio, mes: _cambiar_estado_en_lotes(c, t, anio, mes, eliminar=False),
+    'purgar_papelera': _purgar_papelera_trabajo,
+    'respaldar': _respaldar_trabajo,
+}
+
+def _tomar_trabajo(c):
+    """Marca como 'en_curso' el próximo trabajo ejecutable y lo devuelve (UPDATE atómico: seguro entre procesos)."""
+    vencido = (datetime.datetime.now() - timedelta(seconds=current_app.config['TRABAJOS_VENCIMIENTO_SEGUNDOS'])).strftime('%Y-%m-%d %H:%M:%S')
+    with escritura(c):
+        filas = c.execute("""
+            UPDATE trabajos SET estado = 'en_curso', iniciado = COALESCE(iniciado, :ahora), latido = :ahora
+            WHERE id = (
+                SELECT t.id FROM trabajos t
+                WHERE (t.estado = 'pendiente' OR (t.estado = 'en_curso' AND t.latido < :vencido))
+                  AND NOT EXISTS (SELECT 1 FROM trabajos o WHERE o.clave = t.clave AND o.id < t.id
+                                  AND o.estado IN ('pendiente', 'en_curso'))
+                ORDER BY t.id LIMIT 1
+            )
+            RETURNING id, tipo, parametros
+        """, {'ahora': _ahora(), 'vencido': vencido}).fetchall()
+    return filas[0] if filas else None
+
+def _ejecutar_trabajo(c, trabajo):
+    try:
+        mensaje = TAREAS[trabajo['tipo']](c, trabajo['id'], **json.loads(trabajo['parametros']))
+        estado = 'terminado'
+    except TrabajoCancelado as e:
+        estado, mensaje = 'cancelado', str(e)
+    except Exception as e:
+        current_app.logger.exception('Error en el trabajo %s', trabajo['id'])
+        estado, mensaje = 'error', str(e)
+    with escritura(c):
+        c.execute('UPDATE trabajos SET estado = ?, mensaje = ?, terminado = ? WHERE id = ?', (estado, mensaje, _ahora(), trabajo['id']))
+
+def ejecutar_trabajos_pendientes():
+    """Ejecuta trabajos hasta vaciar la cola; devuelve cuántos se procesaron."""
+    c = abrir_conexion()
+    try:
+        ejecutados = 0
+        while True:
+            trabajo = _tomar_trabajo(c)
+            if trabajo is None:
+                return ejecutados
+            _ejecutar_trabajo(c, trabajo)
+            ejecutados += 1
+    finally:
+        c.close()
+
+def iniciar_trabajador():
+    """Lanza (una vez por proceso y aplicación) el hilo daemon que ejecuta la cola de trabajos."""
+    app = current_app._get_current_object()
+    estado = estado_app()
+    def ciclo():
+        while True:
+            estado.trabajos_evento.clear()
+            try:
+                with app.app_context():
+                    ejecutar_trabajos_pendientes()
+            except Exception:
+                app.logger.exception('Error en el hilo de trabajos')
+            # También revisa periódicamente: otros procesos pueden haber encolado trabajos
+            estado.trabajos_evento.wait(app.config['TRABAJOS_ESPERA_SEGUNDOS'])
+
+    with estado.trabajador_lock:
+        if estado.trabajador is None or not estado.trabajador.is_alive():
+            estado.trabajador = threading.Thread(target=ciclo, name='trabajos', daemon=True)
+            estado.trabajador.start()
+    return estado.trabajador
+
+def datos_trabajo(fila):
+    parametros = json.loads(fila['parametros'])
+    return {
+        'id': fila['id'], 'tipo': fila['tipo'], 'descripcion': DESCRIPCION_TRABAJOS[fila['tipo']].format_map(defaultdict(str, parametros)),
+        'parametros': parametros, 'estado': fila['estado'], 'total': fila['total'], 'procesados': fila['procesados'],
+        'cancelar': bool(fila['cancelar']), 'mensaje': fila['mensaje'],
+        'creado': fila['creado'], 'iniciado': fila['iniciado'], 'terminado': fila['terminado'],
+    }
+
+def _destino_trabajo(trabajo):
+    if trabajo['tipo'].startswith('recuperar') or trabajo['tipo'] == 'purgar_papelera':
+        return url_for('sgs.papelera')
+    if trabajo['tipo'] in ('eliminar_anio', 'respaldar'):
+        return url_for('sgs.seleccion_anio')
+    return url_for('sgs.gestion_mes', anio=trabajo['parametros']['anio'])
+
+@bp.route('/trabajos/<int:id>')
+@login_required
+def ver_trabajo(id):
+    fila = conexion_principal().execute('SELECT * FROM trabajos WHERE id=?', (id,)).fetchone()
+    if fila is None:
+        flash('Trabajo no encontrado', 'danger')
+        return redirect(url_for('sgs.seleccion_anio'))
+    trabajo = datos_trabajo(fila)
+    return render_template('trabajo.html', trabajo=trabajo, destino=_destino_trabajo(trabajo))
+
+@bp.cli.command('trabajos')
+def trabajos_cmd():
+    """Ejecuta los trabajos pendientes (para despliegues con TRABAJOS_EN_HILO = False)."""
+    print(f'{ejecutar_trabajos_pendientes()} trabajos ejecutados.')
+
+# --- ARCHIVO DE AÑOS CERRADOS (archive_<anio>.db) ---
+# Un año cerrado se mueve a su propia base (mismo esquema, solo lectura) para que la base principal
+# quede pequeña. Sus páginas, la exportación y el resumen la abren en lugar de la principal (get_conn);
+# la búsqueda en todos los períodos la adjunta con ATTACH. Mientras el archivo exista, el año no se modifica.
+CONFIG_POR_DEFECTO.setdefault('ARCHIVO_DIR', None)   # por defecto, junto a la base
+CONFIG_POR_DEFECTO.setdefault('ARCHIVO_LOTE', 2000)
+
+# Rutas que trabajan sobre el año activo de la sesión (las demás reciben el año en la URL o son globales)
+ENDPOINTS_ANIO_ACTIVO = {'home', 'buscar', 'crear', 'detalles', 'editar', 'eliminar', 'importar', 'editar_metadatos',
+                         'historial', 'duplicados'}
+
+def ruta_archivo(anio):
+    directorio = current_app.config['ARCHIVO_DIR'] or os.path.dirname(os.path.abspath(current_app.config['DATABASE']))
+    return os.path.join(directorio, f'archive_{anio}.db')
+
+def anio_archivado(anio):
+    return bool(re.fullmatch(r'\d{4}', str(anio or ''))) and os.path.exists(ruta_archivo(anio))
+
+def _anio_de_la_peticion():
+    if not has_request_context() or request.endpoint == 'static':
+        return None
+    anio = (request.view_args or {}).get('anio')
+    if anio is None and nombre_endpoint() in ENDPOINTS_ANIO_ACTIVO:
+        anio = session.get('tabla_actual')
+    return anio
+
+def abrir_conexion_anio(anio):
+    """Conexión nueva para leer un año: su archivo si está archivado, si no la base principal."""
+    if anio_archivado(anio):
+        return abrir_conexion(ruta_archivo(anio), solo_lectura=True)
+    return abrir_conexion()
+
+def buscar_en_todos(texto, limite=None):
+    """Búsqueda en todos los períodos: la base principal y, adjuntos uno a uno, los años archivados."""
+    limite = limite or current_app.config['BUSQUEDA_LIMITE']
+    c = conexion_principal()
+    resultados = list(buscar_susceptibles(c, texto, limite=limite))
+    for _ in adjuntar_archivos(c):
+        resultados += buscar_susceptibles(c, texto, limite=limite, esquema='archivo')
+    return sorted(resultados, key=itemgetter('rank'))[:limite]
+
+def adjuntar_archivos(c):
+    """Adjunta uno a uno los años archivados como esquema `archivo` y devuelve (yield) cada año."""
+    for fila in c.execute('SELECT anio FROM anio_archivado ORDER BY anio').fetchall():
+        if not anio_archivado(fila['anio']):
+            continue
+        c.execute('ATTACH DATABASE ? AS archivo', (uri_solo_lectura(ruta_archivo(fila['anio'])),))
+        try:
+            yield fila['anio']
+        finally:
+            c.execute('DETACH DATABASE archivo')
+
+def _columnas(tabla):
+    columnas = COLUMNAS_SEGUIDAS[tabla]
+    return ', '.join(('id',) + columnas if tabla == 'susceptible' else columnas)
+
+def _construir_archivo(anio, temporal):
+    """Crea la base del archivo con el esquema completo y copia el año (los triggers rellenan FTS y agregados)."""
+    for sufijo in ('', '-wal', '-shm'):
+        if os.path.exists(temporal + sufijo):
+            os.remove(temporal + sufijo)
+    a = abrir_conexion(temporal)
+    try:
+        aplicar_migraciones(a)
+        a.execute('ATTACH DATABASE ? AS origen', (uri_solo_lectura(current_app.config['DATABASE']),))
+        with a:
+            for tabla in ('metadatos_tablas', 'susceptible'):
+                a.execute(f'INSERT INTO main.{tabla} ({_columnas(tabla)}) SELECT {_columnas(tabla)} FROM origen.{tabla} WHERE anio=? ORDER BY rowid', (anio,))
+            a.execute('UPDATE susceptible SET clave_nino = calcular_clave_nino(nombre_nino, nombre_madre, fecha_nacimiento)')
+            actualizar_vacunas(a, '1')
+        a.execute('DETACH DATABASE origen')
+        copiados = a.execute('SELECT COUNT(*) FROM susceptible').fetchone()[0]
+        a.execute("INSERT INTO susceptible_fts(susceptible_fts) VALUES ('optimize')")
+        a.commit()
+        a.execute('ANALYZE')
+        # Sin WAL: el archivo se abre en solo lectura y no debe necesitar -wal/-shm
+        a.execute('PRAGMA journal_mode=DELETE')
+        a.execute('VACUUM')
+        return copiados
+    finally:
+        a.close()
+
+def archivar_anio(anio):
+    """Mueve un año sin elementos en la papelera a archive_<anio>.db y lo borra de la base principal.
+
+    El archivo se construye sin bloquear la base principal; si el año cambió mientras tanto se cancela.
+    Si un archivo anterior quedó a medias (el proceso se interrumpió borrando), se retoma el borrado.
+    """
+    if not re.fullmatch(r'\d{4}', anio):
+        raise ValueError(f'Año inválido: {anio}')
+    c = abrir_conexion()
+    try:
+        registrado = c.execute('SELECT 1 FROM anio_archivado WHERE anio=?', (anio,)).fetchone()
+        if anio_archivado(anio) and not registrado:
+            raise ValueError(f'Ya existe {ruta_archivo(anio)} pero el año no figura como archivado; revíselo a mano.')
+        copiados = None
+        if not registrado:
+            metadatos = c.execute("SELECT responsable, municipio FROM metadatos_tablas WHERE anio=? ORDER BY mes != 'Enero' LIMIT 1", (anio,)).fetchone()
+            if metadatos is None:
+                raise ValueError(f'El año {anio} no existe.')
+            en_papelera = c.execute("""
+                SELECT EXISTS (SELECT 1 FROM period_stats WHERE anio=? AND eliminados > 0)
+                    OR EXISTS (SELECT 1 FROM metadatos_tablas WHERE anio=? AND es_eliminado = 1)
+            """, (anio, anio)).fetchone()[0]
+            if en_papelera:
+                raise ValueError(f'El año {anio} tiene elementos en la papelera: recupérelos o espere la purga antes de archivar.')
+
+            ultimo = c.execute('SELECT COALESCE(MAX(seq), 0) FROM cambios').fetchone()[0]
+            temporal = ruta_archivo(anio) + '.tmp'
+            copiados = _construir_archivo(anio, temporal)
+
+            comenzar_escritura(c)
+            try:
+                if c.execute('SELECT 1 FROM cambios WHERE anio=? AND seq > ? LIMIT 1', (anio, ultimo)).fetchone():
+                    raise ValueError(f'El año {anio} se modificó mientras se archivaba; vuelva a intentarlo.')
+                c.execute("INSERT INTO anio_archivado (anio, responsable, municipio, susceptibles, fecha_archivo) VALUES (?, ?, ?, ?, ?)",
+                          (anio, metadatos['responsable'], metadatos['municipio'], copiados,
+                           datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                # Desde aquí las peticiones del año leen el archivo
+                os.replace(temporal, ruta_archivo(anio))
+                c.commit()
+            except BaseException:
+                c.rollback()
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+                raise
+
+        # Borrado en lotes: el archivo ya atiende el año, así que los estados intermedios no se ven
+        lote = current_app.config['ARCHIVO_LOTE']
+        borrados = 0
+        while True:
+            with escritura(c):
+                antes = c.execute('SELECT COALESCE(MAX(seq), 0) FROM cambios').fetchone()[0]
+                n = c.execute('DELETE FROM susceptible WHERE id IN (SELECT id FROM susceptible WHERE periodo_id IN (SELECT id FROM periodo WHERE anio=?) LIMIT ?)', (anio, lote)).rowcount
+                c.execute("UPDATE cambios SET operacion = 'archivar' WHERE seq > ? AND anio = ?", (antes, anio))
+            borrados += n
+            if n < lote:
+                break
+        with escritura(c):
+            antes = c.execute('SELECT COALESCE(MAX(seq), 0) FROM cambios').fetchone()[0]
+            c.execute('DELETE FROM susceptible WHERE anio=?', (anio,))
+            c.execute('DELETE FROM metadatos_tablas WHERE anio=?', (anio,))
+            c.execute("UPDATE cambios SET operacion = 'archivar' WHERE seq > ? AND anio = ?", (antes, anio))
+            c.execute('DELETE FROM period_stats WHERE anio=?', (anio,))
+            c.execute('DELETE FROM comunidad_stats WHERE anio=?', (anio,))
+            c.execute('DELETE FROM vacuna_stats WHERE anio=?', (anio,))
+            c.execute('DELETE FROM periodo WHERE anio=?', (anio,))
+        return {'archivo': ruta_archivo(anio), 'copiados': copiados, 'borrados': borrados}
+    finally:
+        c.close()
+
+def desarchivar_anio(anio):
+    """Devuelve un año archivado a la base principal (conserva los ids) y elimina su archivo."""
+    if not anio_archivado(anio):
+        raise ValueError(f'El año {anio} no está archivado.')
+    c = abrir_conexion()
+    try:
+        c.execute('ATTACH DATABASE ? AS archivo', (uri_solo_lectura(ruta_archivo(anio)),))
+        with escritura(c):
+            for tabla in ('metadatos_tablas', 'susceptible'):
+                c.execute(f'INSERT INTO main.{tabla} ({_columnas(tabla)}) SELECT {_columnas(tabla)} FROM archivo.{tabla} ORDER BY rowid')
+            c.execute('UPDATE main.susceptible SET clave_nino = calcular_clave_nino(nombre_nino, nombre_madre, fecha_nacimiento) WHERE anio=?', (anio,))
+            actualizar_vacunas(c, 'anio = ?', (anio,))
+            restaurados = c.execute('SELECT COUNT(*) FROM archivo.susceptible').fetchone()[0]
+            c.execute('DELETE FROM anio_archivado WHERE anio=?', (anio,))
+        c.execute('DETACH DATABASE archivo')
+    finally:
+        c.close()
+    # Mientras ambos existen las peticiones leen el archivo, que tiene los mismos datos
+    os.remove(ruta_archivo(anio))
+    return restaurados
+
+@bp.cli.command('archivar-anio')
+@click.argument('anio')
+@click.option('--vacuum', is_flag=True, help='Compacta la base principal al terminar (bloquea la escritura mientras dura).')
+def archivar_anio_cmd(anio, vacuum):
+    """Mueve un año cerrado a archive_<anio>.db."""
+    try:
+        resumen = archivar_anio(anio)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"Año {anio} archivado en {resumen['archivo']} ({resumen['borrados']} susceptibles quitados de la base principal).")
+    if vacuum:
+        c = abrir_conexion()
+        c.execute('VACUUM')
+        c.close()
+
+@bp.cli.command('desarchivar-anio')
+@click.argument('anio')
+def desarchivar_anio_cmd(anio):
+    """Devuelve un año archivado a la base principal."""
+    try:
+        restaurados = desarchivar_anio(anio)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f'Año {anio} restaurado ({restaurados} susceptibles).')
+
+@bp.app_errorhandler(sqlite3.OperationalError)
+def escritura_en_archivo(e):
+    if _es_bloqueo(e):
+        # comenzar_escritura agotó los reintentos: otro proceso retiene el bloqueo de escritura
+        mensaje = 'La base de datos está ocupada; vuelva a intentarlo en unos segundos.'
+        if request.path.startswith('/api/'):
+            return jsonify(error=mensaje), 503, {'Retry-After': '1'}
+        flash(mensaje, 'warning')
+        return redirect(request.referrer or url_for('sgs.home'))
+    # Las conexiones a años archivados son de solo lectura
+    if 'readonly' not in str(e):
+        raise e
+    anio = _anio_de_la_peticion()
+    mensaje = f'El año {anio} está archivado: solo se puede consultar y exportar.'
+    if request.path.startswith('/api/'):
+        return jsonify(error=mensaje), 409
+    flash(mensaje, 'warning')
+    return redirect(url_for('sgs.gestion_mes', anio=anio) if anio else url_for('sgs.seleccion_anio'))
+
+# --- COPIAS DE SEGURIDAD (respaldos/sgs-AAAAMMDD-HHMMSS.db.gz) ---
+# Copia en caliente con la API de backup de SQLite, por pasos de RESPALDO_PAGINAS y con una pausa entre
+# pasos para no acaparar la base. Cada copia se verifica (integrity_check) antes de comprimirla y se
+# conservan las RESPALDO_CONSERVAR más recientes. Los archive_<anio>.db no cambian: se respaldan una vez.
+CONFIG_POR_DEFECTO.setdefault('RESPALDO_DIR', None)   # por defecto, respaldos/ junto a la base
+CONFIG_POR_DEFECTO.setdefault('RESPALDO_PAGINAS', 1024)
+CONFIG_POR_DEFECTO.setdefault('RESPALDO_PAUSA_SEGUNDOS', 0.01)
+CONFIG_POR_DEFECTO.setdefault('RESPALDO_REINICIOS', 3)
+CONFIG_POR_DEFECTO.setdefault('RESPALDO_CONSERVAR', 14)
+
+PATRON_RESPALDO = re.compile(r'sgs-\d{8}-\d{6}(?:-\d+)?\.db\.gz')
+
+class _CopiaReiniciada(Exception):
+    pass
+
+def directorio_respaldos():
+    return current_app.config['RESPALDO_DIR'] or os.path.join(os.path.dirname(os.path.abspath(current_app.config['DATABASE'])), 'respaldos')
+
+def listar_respaldos():
+    """Respaldos existentes, del más reciente al más antiguo."""
+    directorio = directorio_respaldos()
+    if not os.path.isdir(directorio):
+        return []
+    respaldos = []
+    for nombre in os.listdir(directorio):
+        if PATRON_RESPALDO.fullmatch(nombre):
+            estado = os.stat(os.path.join(directorio, nombre))
+            respaldos.append((estado.st_mtime, nombre, estado.st_size))
+    return [{'nombre': nombre, 'bytes': tamano, 'fecha': datetime.datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')}
+            for mtime, nombre, tamano in sorted(respaldos, reverse=True)]
+
+def rotar_respaldos():
+    """Borra los respaldos que exceden RESPALDO_CONSERVAR y devuelve sus nombres."""
+    sobrantes = [r['nombre'] for r in listar_respaldos()[current_app.config['RESPALDO_CONSERVAR']:]]
+    for nombre in sobrantes:
+        os.remove(os.path.join(directorio_respaldos(), nombre))
+    return sobrantes
+
+def _copiar_en_pasos(origen, destino, progreso=None):
+    """Backup por pasos. Si otra conexión escribe entre pasos SQLite reinicia la copia; después de
+    RESPALDO_REINICIOS reinicios se copia en un solo paso (con WAL esa lectura no bloquea a los escritores)."""
+    reinicios, restantes_antes = 0, None
+
+    def paso(estado, restantes, total):
+        nonlocal reinicios, restantes_antes
+        if restantes_antes is not None and restantes > restantes_antes:
+            reinicios += 1
+            if reinicios > current_app.config['RESPALDO_REINICIOS']:
+                raise _CopiaReiniciada()
+        restantes_antes = restantes
+        if progreso:
+            progreso(total - restantes, total)
+        time.sleep(current_app.config['RESPALDO_PAUSA_SEGUNDOS'])
+
+    try:
+        origen.backup(destino, pages=current_app.config['RESPALDO_PAGINAS'], progress=paso)
+    except _CopiaReiniciada:
+        origen.backup(destino)
+    return reinicios
+
+def crear_respaldo(c=None, progreso=None):
+    """Copia la base principal sin detener la app, la verifica, la comprime y rota los respaldos.
+    `progreso(copiadas, total)` recibe las páginas copiadas después de cada paso."""
+    inicio = time.perf_counter()
+    directorio = directorio_respaldos()
+    os.makedirs(directorio, exist_ok=True)
+    base = 'sgs-' + datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    nombre, n = f'{base}.db.gz', 1
+    while os.path.exists(os.path.join(directorio, nombre)):
+        n += 1
+        nombre = f'{base}-{n}.db.gz'
+    ruta = os.path.join(directorio, nombre)
+    temporal = ruta[:-len('.gz')] + '.tmp'
+
+    propia = c is None
+    c = c or abrir_conexion()
+    try:
+        destino = sqlite3.connect(temporal)
+        try:
+            reinicios = _copiar_en_pasos(c, destino, progreso)
+            # La copia conserva el modo WAL del origen; el respaldo se deja como un archivo autocontenido
+            destino.execute('PRAGMA journal_mode=DELETE')
+            integridad = destino.execute('PRAGMA integrity_check').fetchone()[0]
+            paginas = destino.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            destino.close()
+        if integridad != 'ok':
+            raise RuntimeError(f'El respaldo no pasó integrity_check: {integridad}')
+        with open(temporal, 'rb') as entrada, gzip.open(ruta + '.tmp', 'wb', compresslevel=6) as salida:
+            shutil.copyfileobj(entrada, salida, 1024 * 1024)
+        os.replace(ruta + '.tmp', ruta)
+        bytes_copia = os.path.getsize(temporal)
+    finally:
+        if propia:
+            c.close()
+        for sobrante in (temporal, ruta + '.tmp'):
+            if os.path.exists(sobrante):
+                os.remove(sobrante)
+
+    resumen = {'nombre': nombre, 'ruta': ruta, 'paginas': paginas, 'bytes': bytes_copia,
+               'bytes_comprimido': os.path.getsize(ruta), 'integridad': integridad, 'reinicios': reinicios,
+               'rotados': rotar_respaldos(), 'segundos': round(time.perf_counter() - inicio, 3)}
+    current_app.logger.info('Respaldo %(nombre)s creado en %(segundos)ss (%(paginas)d páginas)', resumen)
+    return resumen
+
+def restaurar_respaldo(respaldo, destino):
+    """Descomprime un respaldo en `destino`, que no debe existir, y verifica su integridad.
+    No toca la base en uso: para usarla se detiene la app y se apunta SGS_DB (o DATABASE) al archivo."""
+    ruta = respaldo if os.path.exists(respaldo) else os.path.join(directorio_respaldos(), respaldo)
+    if not os.path.exists(ruta):
+        raise ValueError(f'No existe el respaldo {respaldo}.')
+    if os.path.exists(destino):
+        raise ValueError(f'{destino} ya existe: la restauración se hace siempre en un archivo nuevo.')
+    temporal = destino + '.tmp'
+    try:
+        try:
+            with gzip.open(ruta, 'rb') as entrada, open(temporal, 'wb') as salida:
+                shutil.copyfileobj(entrada, salida, 1024 * 1024)
+        except (OSError, EOFError) as e:
+            raise ValueError(f'No se pudo descomprimir {respaldo}: {e}')
+        r = sqlite3.connect(temporal)
+        try:
+            integridad = r.execute('PRAGMA integrity_check').fetchone()[0]
+            version = r.execute('PRAGMA user_version').fetchone()[0]
+            susceptibles = r.execute('SELECT COUNT(*) FROM susceptible').fetchone()[0]
+        finally:
+            r.close()
+        if integridad != 'ok':
+            raise ValueError(f'El respaldo no pasó integrity_check: {integridad}')
+        os.replace(temporal, destino)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return {'destino': destino, 'version_esquema': version, 'susceptibles': susceptibles, 'integridad': integridad}
+
+@bp.cli.command('respaldar')
+def respaldar_cmd():
+    """Crea un respaldo comprimido de la base sin detener la app."""
+    try:
+        resumen = crear_respaldo()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    print(f"Respaldo {resumen['ruta']}: {resumen['paginas']} páginas, {resumen['bytes_comprimido'] // 1024} KB comprimido en {resumen['segundos']}s.")
+    if resumen['rotados']:
+        print(f"Respaldos antiguos borrados: {', '.join(resumen['rotados'])}")
+
+@bp.cli.command('restaurar-respaldo')
+@click.argument('respaldo')
+@click.argument('destino')
+def restaurar_respaldo_cmd(respaldo, destino):
+    """Restaura RESPALDO (ruta o nombre en la carpeta de respaldos) en el archivo nuevo DESTINO."""
+    try:
+        resumen = restaurar_respaldo(respaldo, destino)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"Restaurado en {resumen['destino']} ({resumen['susceptibles']} susceptibles, esquema v{resumen['version_esquema']}).")
+
+
+# --- CACHÉ HTTP (ETag/304) Y DE FRAGMENTOS ---
+# Las vistas de listado responden 304 si los datos no cambiaron desde la última visita. La versión de los
+# datos sale de los sellos que ya mantienen los triggers: version_anio para todo el año y el último seq del
+# historial de cambios para un período. Con mensajes flash pendientes siempre se genera la página completa.
+
+CONFIG_POR_DEFECTO.setdefault('FRAGMENTOS_MAX', 256)
+
+def _version_codigo():
+    """Cambia al desplegar (app.py, plantillas o estáticos modificados), para no reutilizar HTML de la versión anterior."""
+    carpeta = os.path.join(RAIZ_APP, 'templates')
+    rutas = [os.path.abspath(__file__)] + sorted(os.path.join(carpeta, n) for n in os.listdir(carpeta))
+    rutas += sorted(os.path.join(raiz, n) for raiz, _, nombres in os.walk(os.path.join(RAIZ_APP, 'static')) for n in nombres)
+    return hashlib.blake2b(repr([(r, os.path.getmtime(r)) for r in rutas]).encode(), digest_size=6).hexdigest()
+
+VERSION_CODIGO = _version_codigo()
+
+def ultimo_cambio(c, anio=None, mes=None):
+    """(seq, fecha) del último cambio del período (o de toda la base, sin anio/mes); (0, None) si no hay.
+    El seq de un período puede bajar al recortar el historial; el de toda la base nunca baja."""
+    if anio is None:
+        # sqlite_sequence conserva el mayor seq aunque _recortar_historial borre las filas antiguas
+        fila = c.execute("""
+            SELECT seq, (SELECT fecha FROM cambios ORDER BY seq DESC LIMIT 1) AS fecha
+            FROM sqlite_sequence WHERE name = 'cambios'
+        """).fetchone()
+    else:
+        fila = c.execute('SELECT seq, fecha FROM cambios WHERE anio=? AND mes=? ORDER BY seq DESC LIMIT 1', (anio, mes)).fetchone()
+    return (fila['seq'], fila['fecha']) if fila else (0, None)
+
+def etag_vista(*versiones):
+    """ETag de la página (débil si se envía comprimida): versión de los datos + período activo en sesión + URL + versión del código.
+    Devuelve None si hay mensajes flash pendientes (esa respuesta no debe reutilizarse)."""
+    if session.get('_flashes'):
+        return None
+    clave = repr((VERSION_CODIGO, session.get('tabla_actual'), session.get('mes_activo'), request.full_path) + versiones)
+    return hashlib.blake2b(clave.encode(), digest_size=12).hexdigest()
+
+def _fecha_http(fecha):
+    # Las fechas de la base están en hora local
+    return datetime.datetime.strptime(fecha, '%Y-%m-%d %H:%M:%S').astimezone(datetime.timezone.utc) if fecha else None
+
+def no_modificado(etag, modificado=None):
+    """Respuesta 304 si el navegador ya tiene esta versión; None si hay que generar la página."""
+    if etag is None:
+        return None
+    if request.if_none_match:
+        # Comparación débil: la versión comprimida de la página lleva el mismo ETag marcado como W/
+        vigente = request.if_none_match.contains_weak(etag)
+    else:
+        ultima = _fecha_http(modificado)
+        vigente = bool(ultima and request.if_modified_since and ultima.replace(microsecond=0) <= request.if_modified_since)
+    return con_validadores(Response(status=304), etag, modificado) if vigente else None
 
+def con_validadores(respuesta, etag, modificado=None):
+    respuesta = make_response(respuesta)
+    if etag:
+        respuesta.set_etag(etag)
+        respuesta.last_modified = _fecha_http(modificado)
+        # El navegador guarda la página pero la revalida en cada visita
+        respuesta.headers['Cache-Control'] = 'private, no-cache'
+    return respuesta
+
+def fragmento_cacheado(clave, generar):
+    """Caché LRU de fragmentos renderizados; la clave debe incluir la versión de los datos."""
+    estado = estado_app()
+    with estado.fragmentos_lock:
+        if clave in estado.fragmentos:
+            estado.fragmentos.move_to_end(clave)
+            return estado.fragmentos[clave]
+    valor = generar()
+    with estado.fragmentos_lock:
+        estado.fragmentos[clave] = valor
+        while len(estado.fragmentos) > current_app.config['FRAGMENTOS_MAX']:
+            estado.fragmentos.popitem(last=False)
+    return valor
+
+# --- ESTÁTICOS Y COMPRESIÓN ---
+# url_for('static', ...) añade la huella del contenido (?v=...) y, si `flask compilar-estaticos` generó una
+# variante optimizada (<nombre>.min.png), apunta a ella. Con la huella vigente el archivo se cachea como
+# inmutable durante un año: al cambiar el contenido cambia la URL. HTML, CSV y JSON se comprimen al vuelo.
+# Las variantes y las copias .gz se eligen por static/manifiesto.json, que guarda la huella del original del
+# que salieron (las fechas de los archivos no sirven: git no las conserva al clonar o actualizar).
+CONFIG_POR_DEFECTO.setdefault('ESTATICOS_MAX_AGE', 365 * 24 * 3600)
+CONFIG_POR_DEFECTO.setdefault('COMPRESION_MINIMO_BYTES', 1024)
+CONFIG_POR_DEFECTO.setdefault('COMPRESION_NIVEL', 6)
+
+TIPOS_COMPRIMIBLES = {
+    'text/html', 'text/csv', 'text/plain', 'text/css', 'text/javascript',
+    'application/json', 'application/javascript', 'image/svg+xml',
+}
+EXTENSIONES_IMAGEN = ('.png', '.jpg', '.jpeg')
+EXTENSIONES_PRECOMPRIMIBLES = ('.css', '.js', '.svg', '.json', '.txt')
+MANIFIESTO_ESTATICOS = 'manifiesto.json'
+
+@lru_cache(maxsize=256)
+def _huella_archivo(ruta, mtime_ns, tamano):
+    with open(ruta, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=6).hexdigest()
+
+def huella_estatico(filename):
+    """Huella del contenido de static/<filename>, o None si no existe."""
+    ruta = safe_join(current_app.static_folder, filename)
+    try:
+        estado = os.stat(ruta)
+    except (OSError, TypeError):
+        return None
+    return _huella_archivo(ruta, estado.st_mtime_ns, estado.st_size)
+
+@lru_cache(maxsize=4)
+def _leer_manifiesto(ruta, mtime_ns):
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _derivado(filename, clave):
+    """Archivo derivado de static/<filename> según el manifiesto ('variante' o 'gz'), solo si se generó a
+    partir del contenido actual del original y sigue existiendo; si no, None."""
+    ruta = os.path.join(current_app.static_folder, MANIFIESTO_ESTATICOS)
+    try:
+        manifiesto = _leer_manifiesto(ruta, os.stat(ruta).st_mtime_ns)
+    except OSError:
+        return None
+    entrada = manifiesto.get(filename) or {}
+    derivado = entrada.get(clave)
+    if derivado and entrada.get('huella') == huella_estatico(filename) and huella_estatico(derivado):
+        return derivado
+    return None
+
+def _variante_vigente(filename):
+    """<nombre>.min<ext> si el manifiesto la registra para el contenido actual; si no, el propio filename."""
+    return _derivado(filename, 'variante') or filename
+
+@bp.app_url_defaults
+def huella_en_url_estatica(endpoint, valores):
+    if endpoint != 'static' or 'filename' not in valores or 'v' in valores:
+        return
+    valores['filename'] = _variante_vigente(valores['filename'])
+    huella = huella_estatico(valores['filename'])
+    if huella:
+        valores['v'] = huella
+
+def servir_estatico(filename):
+    """Vista de /static: la copia .gz precomprimida si el cliente acepta gzip, inmutable si ?v= es la huella vigente."""
+    huella = request.args.get('v')
+    vigente = bool(huella) and huella == huella_estatico(filename)
+    max_age = current_app.config['ESTATICOS_MAX_AGE'] if vigente else current_app.get_send_file_max_age(filename)
+    comprimido = _derivado(filename, 'gz') if request.accept_encodings['gzip'] else None
+    if comprimido:
+        respuesta = send_from_directory(current_app.static_folder, comprimido, max_age=max_age,
+                                        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        respuesta.headers['Content-Encoding'] = 'gzip'
+        respuesta.vary.add('Accept-Encoding')
+    else:
+        respuesta = send_from_directory(current_app.static_folder, filename, max_age=max_age)
+    if vigente:
+        respuesta.cache_control.immutable = True
+    return respuesta
+
+
+def _codificacion_aceptada():
+    for codificacion in ('gzip', 'deflate'):
+        if request.accept_encodings[codificacion]:
+            return codificacion
+    return None
+
+def _compresor(codificacion):
+    # wbits 31 produce formato gzip; 15, formato zlib, que es lo que HTTP llama "deflate"
+    return zlib.compressobj(current_app.config['COMPRESION_NIVEL'], zlib.DEFLATED, 31 if codificacion == 'gzip' else 15)
+
+def _comprimir_flujo(iterable, compresor):
+    try:
+        for trozo in iterable:
+            datos = compresor.compress(trozo.encode() if isinstance(trozo, str) else trozo)
+            if datos:
+                yield datos
+        yield compresor.flush()
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+@bp.after_app_request
+def comprimir_respuesta(respuesta):
+    if (respuesta.direct_passthrough or 'Content-Encoding' in respuesta.headers
+            or respuesta.mimetype not in TIPOS_COMPRIMIBLES
+            or respuesta.status_code < 200 or respuesta.status_code in (204, 304) or request.method == 'HEAD'):
+        return respuesta
+    respuesta.vary.add('Accept-Encoding')
+    codificacion = _codificacion_aceptada()
+    if codificacion is None:
+        return respuesta
+    if respuesta.is_streamed:
+        # La exportación CSV se genera por trozos: se comprime según se envía, sin conocer el tamaño final
+        respuesta.response = _comprimir_flujo(respuesta.response, _compresor(codificacion))
+        respuesta.headers.pop('Content-Length', None)
+    else:
+        datos = respuesta.get_data()
+        if len(datos) < current_app.config['COMPRESION_MINIMO_BYTES']:
+            return respuesta
+        compresor = _compresor(codificacion)
+        respuesta.set_data(compresor.compress(datos) + compresor.flush())
+    respuesta.headers['Content-Encoding'] = codificacion
+    # Mismo contenido, otros bytes: el ETag pasa a ser débil (no_modificado compara en modo débil)
+    etag, debil = respuesta.get_etag()
+    if etag and not debil:
+        respuesta.set_etag(etag, weak=True)
+    return respuesta
+
+def _optimizar_imagen(Image, origen, destino, alto_maximo):
+    temporal = destino + '.tmp'
+    with Image.open(origen) as imagen:
+        imagen.load()
+        if imagen.height > alto_maximo:
+            imagen = imagen.resize((round(imagen.width * alto_maximo / imagen.height), alto_maximo), Image.LANCZOS)
+        if destino.lower().endswith('.png'):
+            imagen.save(temporal, format='PNG', optimize=True)
+        else:
+            imagen.convert('RGB').save(temporal, format='JPEG', quality=85, optimize=True, progressive=True)
+    antes, despues = os.path.getsize(origen), os.path.getsize(temporal)
+    if despues >= antes:
+        os.remove(temporal)
+        if os.path.exists(destino):
+            os.remove(destino)
+        return 'sin mejora, se sirve el original'
+    os.replace(temporal, destino)
+    return f'{antes // 1024} KB -> {despues // 1024} KB'
+
+def _precomprimir(origen):
+    with open(origen, 'rb') as f:
+        datos = f.read()
+    comprimido = gzip.compress(datos, compresslevel=9, mtime=0)
+    if len(comprimido) >= len(datos):
+        if os.path.exists(origen + '.gz'):
+            os.remove(origen + '.gz')
+        return 'sin mejora, se sirve sin comprimir'
+    with open(origen + '.gz', 'wb') as f:
+        f.write(comprimido)
+    return f'{len(datos) // 1024} KB -> {len(comprimido) // 1024} KB (.gz)'
+
+@bp.cli.command('compilar-estaticos')
+@click.option('--alto-maximo', default=160, show_default=True,
+              help='Alto máximo en píxeles de las variantes de imagen (las plantillas las muestran a 40 px).')
+def compilar_estaticos_cmd(alto_maximo):
+    """Genera en static/ las variantes optimizadas de las imágenes (<nombre>.min.png), las copias .gz de CSS, JS y SVG
+    y el manifiesto que las asocia a la huella de su original."""
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+        print('Pillow no está instalado (pip install Pillow): se omiten las variantes de imagen.')
+    ruta_manifiesto = os.path.join(current_app.static_folder, MANIFIESTO_ESTATICOS)
+    manifiesto = _leer_manifiesto.__wrapped__(ruta_manifiesto, None)
+    for raiz, _, nombres in os.walk(current_app.static_folder):
+        for nombre in sorted(nombres):
+            base, ext = os.path.splitext(nombre)
+            ext = ext.lower()
+            origen = os.path.join(raiz, nombre)
+            filename = os.path.relpath(origen, current_app.static_folder).replace(os.sep, '/')
+            if ext in EXTENSIONES_IMAGEN and Image and not base.endswith('.min'):
+                destino, clave = os.path.join(raiz, f'{base}.min{ext}'), 'variante'
+                resultado = _optimizar_imagen(Image, origen, destino, alto_maximo)
+            elif ext in EXTENSIONES_PRECOMPRIMIBLES and filename != MANIFIESTO_ESTATICOS:
+                destino, clave = origen + '.gz', 'gz'
+                resultado = _precomprimir(origen)
+            else:
+                continue
+            manifiesto.pop(filename, None)
+            if os.path.exists(destino):
+                derivado = os.path.relpath(destino, current_app.static_folder).replace(os.sep, '/')
+                manifiesto[filename] = {'huella': huella_estatico(filename), clave: derivado}
+            print(f'{filename}: {resultado}')
+    manifiesto = {filename: entrada for filename, entrada in manifiesto.items() if huella_estatico(filename)}
+    with open(ruta_manifiesto, 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, indent=2, sort_keys=True)
+        f.write('\n')
 
 # --- RUTAS DE AUTENTICACIÓN Y SELECCIÓN ---
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         usuario = request.form['usuario']
@@ -116,39 +2125,50 @@ def login():
         if usuario == 'idanea' and contrasena == 'IDANEA37quej':
             session['logged_in'] = True
             session['username'] = 'admin'
-            return redirect(url_for('seleccion_anio')) 
+            return redirect(url_for('sgs.seleccion_anio')) 
         else:
             flash('Usuario o contraseña incorrectos', 'danger')
     return render_template('login.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.pop('logged_in', None)
     session.pop('username', None)
     session.pop('tabla_actual', None) 
     session.pop('mes_activo', None)
     flash('Sesión cerrada', 'info')
-    return redirect(url_for('login'))
+    return redirect(url_for('sgs.login'))
 
-@app.route('/seleccion', methods=['GET', 'POST'])
+@bp.route('/seleccion', methods=['GET', 'POST'])
 @login_required 
 def seleccion_anio():
+    etag = modificado = None
     with get_conn() as c:
+        if request.method == 'GET':
+            version, modificado = ultimo_cambio(c)
+            etag = etag_vista(version)
+            respuesta = no_modificado(etag, modificado)
+            if respuesta:
+                return respuesta
         # FILTRO: Solo años activos (es_eliminado = 0)
-        tablas = c.execute('SELECT anio, responsable, municipio FROM metadatos_tablas WHERE mes="Enero" AND es_eliminado = 0 ORDER BY anio DESC').fetchall()
+        tablas = c.execute("""
+            SELECT anio, responsable, municipio, 0 AS archivado FROM metadatos_tablas WHERE mes="Enero" AND es_eliminado = 0
+            UNION ALL
+            SELECT anio, responsable, municipio, 1 AS archivado FROM anio_archivado
+            ORDER BY anio DESC
+        """).fetchall()
     
     if request.method == 'POST':
         anio_seleccionado = request.form['anio_seleccionado']
         
-        with get_conn() as c:
+        with escritura(get_conn()) as c:
             cursor = c.cursor()
             meses_existentes = cursor.execute('SELECT mes FROM metadatos_tablas WHERE anio=? AND mes="Enero" AND es_eliminado = 0', (anio_seleccionado,)).fetchone()
             
-            if not meses_existentes:
+            if not meses_existentes and not anio_archivado(anio_seleccionado):
                 try:
                     for mes_nombre in MESES_ORDEN:
                         cursor.execute('INSERT INTO metadatos_tablas (anio, mes) VALUES (?, ?)', (anio_seleccionado, mes_nombre))
-                    c.commit()
                     flash(f'Año {anio_seleccionado} creado. Los 12 meses están listos para trabajar.', 'info')
                 except sqlite3.IntegrityError:
                     pass
@@ -159,57 +2179,45 @@ def seleccion_anio():
         session['tabla_actual'] = anio_seleccionado 
         session.pop('mes_activo', None) 
             
-        return redirect(url_for('gestion_mes', anio=anio_seleccionado))
+        return redirect(url_for('sgs.gestion_mes', anio=anio_seleccionado))
 
-    return render_template('seleccion.html', tablas=tablas)
+    return con_validadores(render_template('seleccion.html', tablas=tablas), etag, modificado)
 
 # --- RUTA DE ELIMINACIÓN COMPLETA DEL AÑO (Soft Delete) ---
-@app.route('/eliminar_anio_completo/<string:anio>', methods=['POST'])
+@bp.route('/eliminar_anio_completo/<string:anio>', methods=['POST'])
 @login_required 
 def eliminar_anio_completo(anio):
     current_anio = session.get('tabla_actual')
     
     if anio == current_anio:
         flash(f'No puedes eliminar el año {anio} mientras está seleccionado como activo. Selecciona otro año primero.', 'danger')
-        return redirect(url_for('seleccion_anio'))
+        return redirect(url_for('sgs.seleccion_anio'))
 
-    fecha_actual = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if anio_archivado(anio):
+        flash(f'El año {anio} está archivado: solo se puede consultar y exportar.', 'warning')
+        return redirect(url_for('sgs.seleccion_anio'))
 
-    with get_conn() as c:
-        cursor = c.cursor()
-        try:
-            # SOFT DELETE 1: Marcar TODOS los susceptibles de ese AÑO como eliminados
-            cursor.execute('UPDATE susceptible SET es_eliminado = 1, fecha_eliminacion = ? WHERE anio=?', (fecha_actual, anio))
-            registros_susceptibles = cursor.rowcount
-            
-            # SOFT DELETE 2: Marcar TODOS los metadatos (todos los meses) de ese AÑO como eliminados
-            cursor.execute('UPDATE metadatos_tablas SET es_eliminado = 1, fecha_eliminacion = ? WHERE anio=?', (fecha_actual, anio))
-            registros_metadatos = cursor.rowcount
-            
-            c.commit()
-            
-            flash(f'Año {anio} (y sus {registros_susceptibles} susceptibles) enviado a la papelera. Puede recuperarlo en 30 días.', 'warning')
-            
-        except Exception as e:
-            c.rollback()
-            flash(f'Error al enviar el año {anio} a la papelera: {e}', 'danger')
-            
-    return redirect(url_for('seleccion_anio'))
+    # SOFT DELETE de todos los susceptibles y meses del año, en lotes desde la cola de trabajos
+    id_trabajo = encolar_trabajo('eliminar_anio', anio=anio)
+    flash(f'El año {anio} se está enviando a la papelera. Podrá recuperarlo durante 30 días.', 'warning')
+    return redirect(url_for('sgs.ver_trabajo', id=id_trabajo))
 
 # --- RUTA DE GESTIÓN DE MESES ---
 
-@app.route('/gestion_mes/<string:anio>', methods=['GET', 'POST'])
+@bp.route('/gestion_mes/<string:anio>', methods=['GET', 'POST'])
 @login_required
 def gestion_mes(anio):
     session['tabla_actual'] = anio
-    meses_info = []
     
+    etag = None
     with get_conn() as c:
-        # FILTRO: Solo meses activos (es_eliminado = 0)
-        meses_data = c.execute('SELECT anio, mes, responsable, municipio, puesto_salud FROM metadatos_tablas WHERE anio=? AND es_eliminado = 0 ORDER BY anio, mes', (anio,)).fetchall()
-        
-        for mes_data in meses_data:
-            meses_info.append(mes_data)
+        if request.method == 'GET':
+            etag = etag_vista(version_de_anio(c, anio), anio_archivado(anio))
+            respuesta = no_modificado(etag)
+            if respuesta:
+                return respuesta
+        # FILTRO: Solo meses activos (es_eliminado = 0), ya en orden cronológico
+        meses_info_ordenada = periodos_del_anio(c, anio)
 
     if request.method == 'POST':
         mes_seleccionado = request.form.get('mes_seleccionado')
@@ -218,129 +2226,124 @@ def gestion_mes(anio):
         if mes_seleccionado:
             session['mes_activo'] = mes_seleccionado
             flash(f'Período activo: {mes_seleccionado} {anio}', 'info')
-            return redirect(url_for('home'))
+            return redirect(url_for('sgs.home'))
         
         elif mes_a_duplicar:
-            base_mes = mes_a_duplicar.split(' (')[0]
-            
-            with get_conn() as c:
-                cursor = c.cursor()
-                
-                # FILTRO: Solo buscar duplicados en meses activos
-                duplicados_data = cursor.execute('SELECT mes FROM metadatos_tablas WHERE anio=? AND mes LIKE ? AND es_eliminado = 0', (anio, f'{base_mes}%')).fetchall()
-                
-                max_num = 0
-                for row in duplicados_data:
-                    mes_nombre = row['mes']
-                    if mes_nombre.endswith(')'):
-                        try:
-                            num = int(mes_nombre.split('(')[-1].replace(')', ''))
-                            max_num = max(max_num, num)
-                        except ValueError:
-                            pass
-                    elif mes_nombre == base_mes and base_mes in MESES_ORDEN:
-                        max_num = max(max_num, 1)
-
-                mes_nuevo_duplicado = f"{base_mes} ({max_num + 1})"
-                
-                # FILTRO: Solo obtener metadatos del mes activo para copiar
-                meta_original = cursor.execute('SELECT responsable, municipio, puesto_salud FROM metadatos_tablas WHERE anio=? AND mes=? AND es_eliminado = 0', (anio, mes_a_duplicar)).fetchone()
-                
-                if meta_original:
-                    try:
-                        cursor.execute("""
-                            INSERT INTO metadatos_tablas (anio, mes, responsable, municipio, puesto_salud) 
-                            VALUES (?, ?, ?, ?, ?)
-                        """, (anio, mes_nuevo_duplicado, meta_original['responsable'], meta_original['municipio'], meta_original['puesto_salud']))
-                        c.commit()
-                        
-                        session['mes_activo'] = mes_nuevo_duplicado
-                        flash(f'Período {mes_nuevo_duplicado} {anio} creado y seleccionado con metadatos duplicados.', 'success')
-                        return redirect(url_for('home'))
-                        
-                    except sqlite3.IntegrityError:
-                        flash(f'Error de duplicado. El nombre "{mes_nuevo_duplicado}" ya está en uso. Intenta de nuevo.', 'danger')
-                        return redirect(url_for('gestion_mes', anio=anio))
-                    
+            copiar = request.form.get('copiar_registros') or None
+            try:
+                mes_nuevo_duplicado, copiados = duplicar_periodo(get_conn(), anio, mes_a_duplicar, copiar=copiar)
+            except LookupError:
+                flash('Error al encontrar metadatos del mes original.', 'danger')
+            except sqlite3.IntegrityError:
+                flash('Error de duplicado: el nombre del nuevo mes ya está en uso. Intenta de nuevo.', 'danger')
+                return redirect(url_for('sgs.gestion_mes', anio=anio))
+            else:
+                session['mes_activo'] = mes_nuevo_duplicado
+                if copiar:
+                    flash(f'Período {mes_nuevo_duplicado} {anio} creado y seleccionado con metadatos y {copiados} susceptibles copiados.', 'success')
                 else:
-                    flash('Error al encontrar metadatos del mes original.', 'danger')
+                    flash(f'Período {mes_nuevo_duplicado} {anio} creado y seleccionado con metadatos duplicados.', 'success')
+                return redirect(url_for('sgs.home'))
+
+    return con_validadores(render_template('gestion_mes.html', anio=anio, meses_info_ordenada=meses_info_ordenada, MESES_ORDEN=MESES_ORDEN), etag)
+
+SQL_VACUNA_PENDIENTE = "vacuna_pendiente IS NOT NULL AND vacuna_pendiente != '' AND vacuna_pendiente != 'NINGUNA'"
+
+def duplicar_periodo(c, anio, mes_origen, copiar=None):
+    """Crea la siguiente copia "Mes (n)" de un período en una sola transacción.
 
-    meses_info_ordenada = sorted(meses_info, key=lambda d: (MESES_ORDEN.index(d['mes'].split(' (')[0]) if d['mes'].split(' (')[0] in MESES_ORDEN else 99, d['mes']))
+    `copiar` indica qué susceptibles activos del origen se copian: None (solo metadatos),
+    'todos' o 'pendientes' (solo los que tienen vacuna pendiente). Devuelve (mes_nuevo, copiados).
+    Lanza LookupError si el período de origen no existe.
+    """
+    base_mes = mes_origen.split(' (')[0]
 
-    return render_template('gestion_mes.html', anio=anio, meses_info_ordenada=meses_info_ordenada, MESES_ORDEN=MESES_ORDEN)
+    # BEGIN IMMEDIATE: el cálculo del sufijo y las inserciones no pueden intercalarse con otra copia
+    comenzar_escritura(c)
+    try:
+        meta_original = c.execute('SELECT responsable, municipio, puesto_salud FROM metadatos_tablas WHERE anio=? AND mes=? AND es_eliminado = 0', (anio, mes_origen)).fetchone()
+        if meta_original is None:
+            raise LookupError(mes_origen)
+
+        # Mayor sufijo usado (también en la papelera, que conserva la clave): "Marzo" cuenta como 1
+        max_num = c.execute("""
+            SELECT MAX(CASE WHEN mes = ? THEN 1
+                            ELSE CAST(substr(mes, length(?) + 3, length(mes) - length(?) - 3) AS INTEGER) END)
+            FROM metadatos_tablas
+            WHERE anio = ? AND (mes = ? OR mes LIKE ? || ' (%)')
+        """, (base_mes, base_mes, base_mes, anio, base_mes, base_mes)).fetchone()[0] or 0
+        mes_nuevo = f"{base_mes} ({max_num + 1})"
+
+        c.execute("""
+            INSERT INTO metadatos_tablas (anio, mes, responsable, municipio, puesto_salud) 
+            VALUES (?, ?, ?, ?, ?)
+        """, (anio, mes_nuevo, meta_original['responsable'], meta_original['municipio'], meta_original['puesto_salud']))
+        periodo_nuevo = obtener_periodo_id(c, anio, mes_nuevo)
+
+        copiados = 0
+        if copiar in ('todos', 'pendientes'):
+            filtro = f' AND {SQL_VACUNA_PENDIENTE}' if copiar == 'pendientes' else ''
+            copiados = c.execute(f"""
+                INSERT INTO susceptible (nombre_nino, fecha_nacimiento, nombre_madre, comunidad, vacuna_pendiente, anio, mes, es_eliminado, periodo_id, clave_nino)
+                SELECT nombre_nino, fecha_nacimiento, nombre_madre, comunidad, vacuna_pendiente, anio, ?, 0, ?, clave_nino
+                FROM susceptible
+                WHERE periodo_id = (SELECT id FROM periodo WHERE anio=? AND mes=?) AND es_eliminado = 0{filtro}
+                ORDER BY id
+            """, (mes_nuevo, periodo_nuevo, anio, mes_origen)).rowcount
+            actualizar_vacunas(c, 'periodo_id = ?', (periodo_nuevo,))
+        c.commit()
+    except Exception:
+        c.rollback()
+        raise
+    return mes_nuevo, copiados
 
 # --- RUTA DE ELIMINACIÓN PERMANENTE (Soft Delete de Meses Duplicados) ---
 
-@app.route('/eliminar_periodo/<string:anio>/<string:mes>', methods=['POST'])
+@bp.route('/eliminar_periodo/<string:anio>/<string:mes>', methods=['POST'])
 @login_required 
 def eliminar_periodo(anio, mes):
     current_anio, current_mes = get_current_period()
     
     if anio == current_anio and mes == current_mes:
         flash(f'No puedes eliminar el período {anio}-{mes} mientras está activo. Selecciona otro primero.', 'danger')
-        return redirect(url_for('gestion_mes', anio=anio))
+        return redirect(url_for('sgs.gestion_mes', anio=anio))
 
-    fecha_actual = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if anio_archivado(anio):
+        flash(f'El año {anio} está archivado: solo se puede consultar y exportar.', 'warning')
+        return redirect(url_for('sgs.gestion_mes', anio=anio))
 
-    with get_conn() as c:
-        cursor = c.cursor()
-        try:
-            # SOFT DELETE 1: Marcar registros de susceptibles como eliminados
-            sql_sus = 'UPDATE susceptible SET es_eliminado = 1, fecha_eliminacion = ? WHERE anio=? AND mes=? AND es_eliminado = 0'
-            cursor.execute(sql_sus, (fecha_actual, anio, mes))
-            registros_eliminados = cursor.rowcount
-            
-            # SOFT DELETE 2: Marcar el registro de metadatos como eliminado
-            sql_meta = 'UPDATE metadatos_tablas SET es_eliminado = 1, fecha_eliminacion = ? WHERE anio=? AND mes=? AND es_eliminado = 0'
-            cursor.execute(sql_meta, (fecha_actual, anio, mes))
-            
-            c.commit()
-            
-            flash(f'Período {anio}-{mes} y sus {registros_eliminados} registros han sido enviados a la papelera. Puede recuperarlos en 30 días.', 'warning')
-            
-        except Exception as e:
-            c.rollback()
-            flash(f'Error al enviar el período {anio}-{mes} a la papelera: {e}', 'danger')
-            
-    return redirect(url_for('gestion_mes', anio=anio))
+    # SOFT DELETE de los susceptibles y del mes, en lotes desde la cola de trabajos
+    id_trabajo = encolar_trabajo('eliminar_periodo', anio=anio, mes=mes)
+    flash(f'El período {anio}-{mes} y sus registros se están enviando a la papelera. Puede recuperarlos en 30 días.', 'warning')
+    return redirect(url_for('sgs.ver_trabajo', id=id_trabajo))
 
 # --- RUTA: VACIAR REGISTROS DE UN MES (Soft Delete de Susceptibles) ---
-@app.route('/vaciar_mes/<string:anio>/<string:mes>', methods=['POST'])
+@bp.route('/vaciar_mes/<string:anio>/<string:mes>', methods=['POST'])
 @login_required 
 def vaciar_mes(anio, mes):
     current_anio, current_mes = get_current_period()
 
     if anio == current_anio and mes == current_mes:
         flash(f'No puedes vaciar los registros del mes {mes} mientras está activo. Selecciona otro período o usa el botón "Entrar" para ver los datos.', 'danger')
-        return redirect(url_for('gestion_mes', anio=anio))
-    
-    fecha_actual = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        return redirect(url_for('sgs.gestion_mes', anio=anio))
 
-    with get_conn() as c:
-        cursor = c.cursor()
-        try:
-            # SOFT DELETE: Marcar SOLAMENTE los registros de susceptibles como eliminados
-            sql = 'UPDATE susceptible SET es_eliminado = 1, fecha_eliminacion = ? WHERE anio=? AND mes=? AND es_eliminado = 0'
-            cursor.execute(sql, (fecha_actual, anio, mes))
-            registros_eliminados = cursor.rowcount
-            c.commit()
-            
-            flash(f'Se enviaron {registros_eliminados} registros a la papelera del mes {anio}-{mes}. Los metadatos se mantuvieron.', 'warning')
-            
-        except Exception as e:
-            c.rollback()
-            flash(f'Error al enviar los registros del mes {anio}-{mes} a la papelera: {e}', 'danger')
-            
-    return redirect(url_for('gestion_mes', anio=anio))
+    if anio_archivado(anio):
+        flash(f'El año {anio} está archivado: solo se puede consultar y exportar.', 'warning')
+        return redirect(url_for('sgs.gestion_mes', anio=anio))
+    
+    # SOFT DELETE: SOLAMENTE los susceptibles (los metadatos se mantienen), desde la cola de trabajos
+    id_trabajo = encolar_trabajo('vaciar_mes', anio=anio, mes=mes)
+    flash(f'Los registros del mes {anio}-{mes} se están enviando a la papelera. Los metadatos se mantienen.', 'warning')
+    return redirect(url_for('sgs.ver_trabajo', id=id_trabajo))
 
 # --- RUTA DE EDICIÓN DE METADATOS ---
 
-@app.route('/editar_metadatos', methods=['GET', 'POST'])
+@bp.route('/editar_metadatos', methods=['GET', 'POST'])
 @login_required
 def editar_metadatos():
     anio_actual, mes_actual = get_current_period()
     if not anio_actual or not mes_actual: 
-        return redirect(url_for('seleccion_anio'))
+        return redirect(url_for('sgs.seleccion_anio'))
 
     with get_conn() as c:
         metadatos = c.execute('SELECT * FROM metadatos_tablas WHERE anio=? AND mes=? AND es_eliminado = 0', (anio_actual, mes_actual)).fetchone()
@@ -350,80 +2353,170 @@ def editar_metadatos():
         municipio = request.form['municipio']
         puesto_salud = request.form['puesto_salud']
 
-        with get_conn() as c:
+        with escritura(get_conn()) as c:
             sql = 'UPDATE metadatos_tablas SET responsable=?, municipio=?, puesto_salud=? WHERE anio=? AND mes=? AND es_eliminado = 0'
             c.execute(sql, (responsable, municipio, puesto_salud, anio_actual, mes_actual))
         
         flash(f'Metadatos para el período {anio_actual}-{mes_actual} actualizados', 'info')
-        return redirect(url_for('home'))
+        return redirect(url_for('sgs.home'))
         
     return render_template('editar_metadatos.html', metadatos=metadatos, anio=anio_actual, mes=mes_actual)
 
 
 # --- RUTA PRINCIPAL DE LISTADO (home) ---
 
-@app.route('/')
+@bp.route('/')
 @login_required 
 def home():
     anio_actual, mes_actual = get_current_period()
     
     if not anio_actual: 
-        return redirect(url_for('seleccion_anio'))
+        return redirect(url_for('sgs.seleccion_anio'))
     
     if anio_actual and not mes_actual:
         flash('Selecciona un mes para trabajar.', 'warning')
-        return redirect(url_for('gestion_mes', anio=anio_actual))
+        return redirect(url_for('sgs.gestion_mes', anio=anio_actual))
     
     busqueda = request.args.get('q') 
+    antes = request.args.get('antes', type=int)
+    despues = request.args.get('despues', type=int)
+    pagina = max(request.args.get('pag', 1, type=int), 1)
     
     with get_conn() as c:
+        # La página muestra también los demás meses del año: el ETag usa la versión del año
+        version, modificado = ultimo_cambio(c, anio_actual, mes_actual)
+        version_anio = version_de_anio(c, anio_actual)
+        archivado = anio_archivado(anio_actual)
+        etag = etag_vista(version_anio, version, archivado)
+        respuesta = no_modificado(etag, modificado)
+        if respuesta:
+            return respuesta
+
         metadatos = c.execute('SELECT * FROM metadatos_tablas WHERE anio=? AND mes=? AND es_eliminado = 0', (anio_actual, mes_actual)).fetchone()
         
-        meses_data = c.execute('SELECT mes FROM metadatos_tablas WHERE anio=? AND es_eliminado = 0 GROUP BY mes', (anio_actual,)).fetchall()
-        meses_disponibles = sorted([d['mes'] for d in meses_data], key=lambda m: MESES_ORDEN.index(m.split(' (')[0]) if m.split(' (')[0] in MESES_ORDEN else 99)
-
-        if busqueda:
-            query = """
-                SELECT id, nombre_nino, fecha_nacimiento, nombre_madre, comunidad, vacuna_pendiente 
-                FROM susceptible 
-                WHERE anio=? AND mes=? AND es_eliminado = 0 AND (nombre_nino LIKE ? OR comunidad LIKE ?)
-                ORDER BY id DESC
-            """
-            param = (anio_actual, mes_actual, '%' + busqueda + '%', '%' + busqueda + '%')
-            data = c.execute(query, param).fetchall()
-        else:
-            query = 'SELECT id,nombre_nino,fecha_nacimiento,nombre_madre,comunidad,vacuna_pendiente FROM susceptible WHERE anio=? AND mes=? AND es_eliminado = 0 ORDER BY id DESC'
-            data = c.execute(query, (anio_actual, mes_actual)).fetchall()
+        meses_disponibles = [d['mes'] for d in periodos_del_anio(c, anio_actual)]
+        periodo_actual = obtener_periodo_id(c, anio_actual, mes_actual)
+        # El cuerpo de la tabla solo depende de las filas del período. El último seq del período puede bajar
+        # cuando _recortar_historial borra sus cambios antiguos: la clave lleva también version_anio, que solo sube
+        filas_html, cursor_anterior, cursor_siguiente = fragmento_cacheado(
+            (anio_actual, mes_actual, archivado, version_anio, version, busqueda, antes, despues, pagina),
+            lambda: _filas_home(c, periodo_actual, busqueda, antes, despues, pagina))
 
-        total_registros = c.execute('SELECT COUNT(id) FROM susceptible WHERE anio=? AND mes=? AND es_eliminado = 0', (anio_actual, mes_actual)).fetchone()[0]
-        
-        total_pendientes = c.execute("""
-            SELECT COUNT(id) 
-            FROM susceptible 
-            WHERE anio=? AND mes=? AND es_eliminado = 0
-              AND vacuna_pendiente IS NOT NULL 
-              AND vacuna_pendiente != '' 
-              AND vacuna_pendiente != 'NINGUNA' 
-        """, (anio_actual, mes_actual)).fetchone()[0]
+        total_registros, total_pendientes = totales_periodo(c, anio_actual, mes_actual)
             
-    return render_template('index.html', 
-        est=data, 
+    return con_validadores(render_template('index.html', 
+        filas_html=filas_html, 
         metadatos=metadatos, 
         anio=anio_actual, 
         mes=mes_actual,
         meses_disponibles=meses_disponibles,
         total_registros=total_registros, 
-        total_pendientes=total_pendientes 
-    )
+        total_pendientes=total_pendientes,
+        cursor_anterior=cursor_anterior,
+        cursor_siguiente=cursor_siguiente,
+        pagina=pagina,
+    ), etag, modificado)
+
+def _filas_home(c, periodo_actual, busqueda, antes, despues, pagina):
+    """Consulta una página del listado y la renderiza; devuelve (html, cursor_anterior, cursor_siguiente)."""
+    if consulta_fts(busqueda):
+        # Filtro por el índice FTS (sin acentos, por prefijo); el orden sigue siendo id DESC para paginar
+        query = """
+            SELECT id, nombre_nino, fecha_nacimiento, nombre_madre, comunidad, vacuna_pendiente 
+            FROM susceptible 
+            WHERE periodo_id=? AND es_eliminado = 0
+              AND id IN (SELECT rowid FROM susceptible_fts WHERE susceptible_fts MATCH ?)
+        """
+        param = (periodo_actual, consulta_fts(busqueda))
+    else:
+        query = 'SELECT id,nombre_nino,fecha_nacimiento,nombre_madre,comunidad,vacuna_pendiente FROM susceptible WHERE periodo_id=? AND es_eliminado = 0'
+        param = (periodo_actual,)
+    data, cursor_anterior, cursor_siguiente = paginar_por_id(c, query, param, antes=antes, despues=despues)
+    html = render_template('index_filas.html', est=data, desplazamiento=(pagina - 1) * current_app.config['PAGINA_TAMANO'])
+    return html, cursor_anterior, cursor_siguiente
+
+# --- RUTA DE BÚSQUEDA (por relevancia, período activo o todos los períodos) ---
+
+@bp.route('/buscar')
+@login_required
+def buscar():
+    anio_actual, mes_actual = get_current_period()
+    busqueda = request.args.get('q', '')
+    todos = request.args.get('todos') == '1'
+
+    if not todos and (not anio_actual or not mes_actual):
+        return redirect(url_for('sgs.seleccion_anio'))
+
+    with get_conn() as c:
+        if todos:
+            resultados = buscar_en_todos(busqueda)
+        else:
+            resultados = buscar_susceptibles(c, busqueda, anio=anio_actual, mes=mes_actual)
+
+    return render_template('busqueda.html', resultados=resultados, busqueda=busqueda, todos=todos, anio=anio_actual, mes=mes_actual)
+
+@bp.route('/historial/<int:id>')
+@login_required
+def historial(id):
+    """Todos los períodos en que aparece el niño del registro `id` (misma clave_nino)."""
+    with get_conn() as c:
+        registro = c.execute(f'SELECT s.id, {_sql_clave_nino(c)} AS clave FROM susceptible s WHERE s.id=?', (id,)).fetchone()
+    if registro is None:
+        flash('El registro no existe.', 'danger')
+        return redirect(url_for('sgs.home'))
+
+    registros = historial_nino(registro['clave'])
+    pendientes = [r for r in registros if r['pendiente']]
+    return render_template('historial.html', registros=registros, actual=id, pendientes=len(pendientes),
+                           desde=pendientes[0] if pendientes else None)
+
+@bp.route('/duplicados')
+@login_required
+def duplicados():
+    """Reporte de niños registrados más de una vez en un mismo período del año de trabajo."""
+    anio_actual, _ = get_current_period()
+    if not anio_actual:
+        return redirect(url_for('sgs.seleccion_anio'))
+    with get_conn() as c:
+        grupos = duplicados_del_anio(c, anio_actual)
+    return render_template('duplicados.html', grupos=grupos, anio=anio_actual)
+
+def _tiene_tabla(c, nombre):
+    return c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (nombre,)).fetchone() is not None
+
+MENSAJE_ARCHIVO_SIN_VACUNAS = 'El archivo de {anio} es anterior al catálogo de vacunas: desarchívelo y vuelva a archivarlo para ver el reporte.'
+
+@bp.route('/reportes/vacunas', defaults={'anio': None})
+@bp.route('/reportes/vacunas/<anio>')
+@login_required
+def reporte_vacunas(anio):
+    """Pendientes de una vacuna por período y comunidad (`vacuna` = código del catálogo, `mes` opcional)."""
+    if anio is None:
+        anio_actual, _ = get_current_period()
+        if not anio_actual:
+            return redirect(url_for('sgs.seleccion_anio'))
+        return redirect(url_for('sgs.reporte_vacunas', anio=anio_actual))
+
+    codigo = request.args.get('vacuna', 'SPR').upper()
+    mes = request.args.get('mes') or None
+    with get_conn() as c:
+        if not _tiene_tabla(c, 'vacuna_stats'):
+            flash(MENSAJE_ARCHIVO_SIN_VACUNAS.format(anio=anio), 'warning')
+            return redirect(url_for('sgs.gestion_mes', anio=anio))
+        vacunas = c.execute('SELECT id, codigo, nombre, catalogada FROM vacuna ORDER BY catalogada DESC, codigo').fetchall()
+        vacuna = next((v for v in vacunas if v['codigo'] == codigo), None)
+        filas = reporte_cobertura(c, anio, vacuna['id'], mes) if vacuna else []
+        meses = [f['mes'] for f in c.execute('SELECT mes FROM periodo WHERE anio=? ORDER BY mes_num, secuencia', (anio,))]
+    return render_template('reporte_vacunas.html', anio=anio, mes=mes, meses=meses, vacunas=vacunas, vacuna=vacuna, filas=filas)
 
 # --- RUTAS CRUD SECUNDARIAS (Se mantienen) ---
-@app.route('/crear', methods=['POST', 'GET'])
+@bp.route('/crear', methods=['POST', 'GET'])
 @login_required
 def crear():
     anio_actual, mes_actual = get_current_period()
     if not anio_actual or not mes_actual: 
         flash('Selecciona un período de trabajo (año y mes) antes de crear registros.', 'danger')
-        return redirect(url_for('seleccion_anio'))
+        return redirect(url_for('sgs.seleccion_anio'))
     
     if request.method == 'POST':
         nn = request.form['nombre_nino']
@@ -432,20 +2525,22 @@ def crear():
         com = request.form['comunidad']
         vp = request.form['vacuna_pendiente']
         
-        with get_conn() as c:
-            sql = 'INSERT INTO susceptible(nombre_nino,fecha_nacimiento,nombre_madre,comunidad,vacuna_pendiente, anio, mes, es_eliminado) VALUES(?,?,?,?,?,?,?, 0)'
-            c.execute(sql, (nn, fn, nm, com, vp, anio_actual, mes_actual))
+        with escritura(get_conn()) as c:
+            periodo_actual = obtener_periodo_id(c, anio_actual, mes_actual, crear=True)
+            sql = 'INSERT INTO susceptible(nombre_nino,fecha_nacimiento,nombre_madre,comunidad,vacuna_pendiente, anio, mes, es_eliminado, periodo_id, clave_nino) VALUES(?,?,?,?,?,?,?, 0, ?, ?)'
+            nuevo_id = c.execute(sql, (nn, fn, nm, com, vp, anio_actual, mes_actual, periodo_actual, clave_nino(nn, nm, fn))).lastrowid
+            actualizar_vacunas(c, 'id = ?', (nuevo_id,))
             
         flash('Susceptible registrado','success')
-        return redirect(url_for('home'))
+        return redirect(url_for('sgs.home'))
         
     return render_template('crear.html')
 
-@app.route('/detalles/<int:id>')
+@bp.route('/detalles/<int:id>')
 @login_required
 def detalles(id):
     anio_actual, mes_actual = get_current_period()
-    if not anio_actual or not mes_actual: return redirect(url_for('seleccion_anio'))
+    if not anio_actual or not mes_actual: return redirect(url_for('sgs.seleccion_anio'))
     
     with get_conn() as c:
         sql = 'SELECT id,nombre_nino,fecha_nacimiento,nombre_madre,comunidad,vacuna_pendiente FROM susceptible WHERE id=? AND anio=? AND mes=? AND es_eliminado = 0'
@@ -453,14 +2548,14 @@ def detalles(id):
     
     if est is None:
         flash('Registro no encontrado o no pertenece al período actual', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('sgs.home'))
     return render_template('detalles.html', est=est)
 
-@app.route('/editar/<int:id>', methods=['POST', 'GET'])
+@bp.route('/editar/<int:id>', methods=['POST', 'GET'])
 @login_required
 def editar(id):
     anio_actual, mes_actual = get_current_period()
-    if not anio_actual or not mes_actual: return redirect(url_for('seleccion_anio'))
+    if not anio_actual or not mes_actual: return redirect(url_for('sgs.seleccion_anio'))
     
     with get_conn() as c:
         sql = 'SELECT id,nombre_nino,fecha_nacimiento,nombre_madre,comunidad,vacuna_pendiente FROM susceptible WHERE id=? AND anio=? AND mes=? AND es_eliminado = 0'
@@ -468,7 +2563,7 @@ def editar(id):
         
     if est is None:
         flash('Registro no encontrado', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('sgs.home'))
         
     if request.method == 'POST':
         nn = request.form['nombre_nino']
@@ -477,28 +2572,29 @@ def editar(id):
         com = request.form['comunidad']
         vp = request.form['vacuna_pendiente']
         
-        with get_conn() as c:
-            sql = 'UPDATE susceptible SET nombre_nino=?, fecha_nacimiento=?, nombre_madre=?, comunidad=?, vacuna_pendiente=? WHERE id=? AND anio=? AND mes=? AND es_eliminado = 0'
-            c.execute(sql, (nn, fn, nm, com, vp, id, anio_actual, mes_actual))
+        with escritura(get_conn()) as c:
+            sql = 'UPDATE susceptible SET nombre_nino=?, fecha_nacimiento=?, nombre_madre=?, comunidad=?, vacuna_pendiente=?, clave_nino=? WHERE id=? AND anio=? AND mes=? AND es_eliminado = 0'
+            c.execute(sql, (nn, fn, nm, com, vp, clave_nino(nn, nm, fn), id, anio_actual, mes_actual))
+            actualizar_vacunas(c, 'id = ?', (id,))
         
         flash('Registro actualizado','info') 
-        return redirect(url_for('home'))
+        return redirect(url_for('sgs.home'))
         
     return render_template('editar.html', est=est)
 
-@app.route('/eliminar/<int:id>', methods=['POST', 'GET'])
+@bp.route('/eliminar/<int:id>', methods=['POST', 'GET'])
 @login_required
 def eliminar(id):
     anio_actual, mes_actual = get_current_period()
-    if not anio_actual or not mes_actual: return redirect(url_for('seleccion_anio'))
+    if not anio_actual or not mes_actual: return redirect(url_for('sgs.seleccion_anio'))
     
     if request.method == 'POST':
         fecha_actual = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        with get_conn() as c:
+        with escritura(get_conn()) as c:
             sql = 'UPDATE susceptible SET es_eliminado = 1, fecha_eliminacion = ? WHERE id=? AND anio=? AND mes=? AND es_eliminado = 0'
             c.execute(sql, (fecha_actual, id, anio_actual, mes_actual))
         flash('Registro enviado a la papelera. Puede recuperarlo en 30 días.', 'warning') 
-        return redirect(url_for('home'))
+        return redirect(url_for('sgs.home'))
         
     with get_conn() as c:
         sql = 'SELECT id,nombre_nino,nombre_madre FROM susceptible WHERE id=? AND anio=? AND mes=? AND es_eliminado = 0'
@@ -506,139 +2602,789 @@ def eliminar(id):
     
     if est is None:
         flash('Registro no encontrado', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('sgs.home'))
         
     return render_template('eliminar.html', est=est)
 
+# --- IMPORTACIÓN MASIVA CSV (período activo) ---
+# El archivo se lee en streaming y las filas válidas se insertan con executemany en lotes de
+# IMPORTACION_LOTE filas, una transacción por lote, para no retener el bloqueo de escritura.
+
+CONFIG_POR_DEFECTO.setdefault('IMPORTACION_LOTE', 1000)
+CONFIG_POR_DEFECTO.setdefault('IMPORTACION_MAX_ERRORES', 200)
+
+# Encabezados aceptados (en minúsculas): los nombres de columna internos y los del CSV exportado
+COLUMNAS_IMPORTACION = {
+    'nombre_nino': 'nombre_nino', 'nombre del niño': 'nombre_nino', 'nombre del nino': 'nombre_nino',
+    'fecha_nacimiento': 'fecha_nacimiento', 'fecha nac.': 'fecha_nacimiento', 'fecha de nacimiento': 'fecha_nacimiento',
+    'nombre_madre': 'nombre_madre', 'nombre de la madre': 'nombre_madre',
+    'comunidad': 'comunidad',
+    'vacuna_pendiente': 'vacuna_pendiente', 'vacuna pendiente': 'vacuna_pendiente',
+}
+
+FORMATOS_FECHA_RAPIDOS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y')
+
+@lru_cache(maxsize=4096)
+def normalizar_fecha(valor):
+    """Devuelve la fecha en formato AAAA-MM-DD. Acepta AAAA-MM-DD y fechas con el día primero (05/01/2024)."""
+    valor = (valor or '').strip()
+    if not valor:
+        raise ValueError('fecha de nacimiento vacía')
+    # Los formatos habituales se resuelven con strptime; dateutil queda para los demás
+    for formato in FORMATOS_FECHA_RAPIDOS:
+        try:
+            return datetime.datetime.strptime(valor, formato).strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    try:
+        fecha = parser.parse(valor, dayfirst=not re.match(r'^\d{4}', valor))
+    except (ValueError, OverflowError):
+        raise ValueError(f'fecha de nacimiento inválida: "{valor}"')
+    return fecha.strftime('%Y-%m-%d')
+
+def _validar_fila_importacion(fila):
+    """Normaliza una fila del CSV. Devuelve la tupla de valores o lanza ValueError con el motivo."""
+    datos = {campo: (fila.get(campo) or '').strip() for campo in set(COLUMNAS_IMPORTACION.values())}
+    if not datos['nombre_nino']:
+        raise ValueError('falta el nombre del niño')
+    datos['fecha_nacimiento'] = normalizar_fecha(datos['fecha_nacimiento'])
+    return (datos['nombre_nino'], datos['fecha_nacimiento'], datos['nombre_madre'], datos['comunidad'], datos['vacuna_pendiente'])
+
+def importar_csv(archivo, anio, mes, simulacion=False):
+    """Importa un CSV (objeto binario) al período indicado y devuelve el reporte de la importación."""
+    inicio = time.perf_counter()
+    reporte = {'leidas': 0, 'validas': 0, 'insertadas': 0, 'errores': [], 'total_errores': 0, 'simulacion': simulacion}
+    lector = csv.DictReader(io.TextIOWrapper(archivo, encoding='utf-8-sig', newline=''))
+    lector.fieldnames = [COLUMNAS_IMPORTACION.get((campo or '').strip().lower(), campo) for campo in (lector.fieldnames or [])]
+    if 'nombre_nino' not in lector.fieldnames:
+        raise ValueError('El archivo no tiene la columna "nombre_nino" (o "Nombre del niño").')
+
+    sql = 'INSERT INTO susceptible(nombre_nino,fecha_nacimiento,nombre_madre,comunidad,vacuna_pendiente, anio, mes, es_eliminado, periodo_id, clave_nino) VALUES(?,?,?,?,?,?,?, 0, ?, ?)'
+    c = get_conn()
+    periodo = None
+    if not simulacion:
+        # En su propia transacción: un INSERT fuera de escritura() dejaría abierta una transacción implícita
+        # y los lotes se unirían a ella sin confirmarse nunca
+        with escritura(c):
+            periodo = obtener_periodo_id(c, anio, mes, crear=True)
+    lote = []
+
+    def insertar_lote():
+        if lote and not simulacion:
+            with escritura(c):
+                ultimo_id = c.execute('SELECT COALESCE(MAX(id), 0) FROM susceptible').fetchone()[0]
+                c.executemany(sql, lote)
+                actualizar_vacunas(c, 'id > ?', (ultimo_id,))
+            reporte['insertadas'] += len(lote)
+        lote.clear()
+
+    # La fila 1 es el encabezado
+    for numero, fila in enumerate(lector, start=2):
+        reporte['leidas'] += 1
+        try:
+            valores = _validar_fila_importacion(fila)
+        except ValueError as e:
+            reporte['total_errores'] += 1
+            if len(reporte['errores']) < current_app.config['IMPORTACION_MAX_ERRORES']:
+                reporte['errores'].append((numero, str(e)))
+            continue
+        reporte['validas'] += 1
+        nombre_nino, fecha_nacimiento, nombre_madre = valores[:3]
+        lote.append((*valores, anio, mes, periodo, clave_nino(nombre_nino, nombre_madre, fecha_nacimiento)))
+        if len(lote) >= current_app.config['IMPORTACION_LOTE']:
+            insertar_lote()
+    insertar_lote()
+
+    reporte['segundos'] = round(time.perf_counter() - inicio, 3)
+    return reporte
+
+@bp.route('/importar', methods=['GET', 'POST'])
+@login_required
+def importar():
+    anio_actual, mes_actual = get_current_period()
+    if not anio_actual or not mes_actual: 
+        flash('Selecciona un período de trabajo (año y mes) antes de importar registros.', 'danger')
+        return redirect(url_for('sgs.seleccion_anio'))
+
+    reporte = None
+    if request.method == 'POST':
+        archivo = request.files.get('archivo')
+        if not archivo or not archivo.filename:
+            flash('Selecciona un archivo CSV para importar.', 'warning')
+            return redirect(url_for('sgs.importar'))
+        try:
+            reporte = importar_csv(archivo.stream, anio_actual, mes_actual, simulacion=request.form.get('simulacion') == '1')
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            flash(f'No se pudo leer el archivo: {e}', 'danger')
+            return redirect(url_for('sgs.importar'))
+
+        if reporte['simulacion']:
+            flash(f"Simulación: {reporte['validas']} filas válidas y {reporte['total_errores']} con errores. No se guardó nada.", 'info')
+        else:
+            flash(f"Se importaron {reporte['insertadas']} susceptibles en {reporte['segundos']}s ({reporte['total_errores']} filas con errores).", 'success')
+
+    return render_template('importar.html', reporte=reporte, anio=anio_actual, mes=mes_actual)
+
 # --- RUTA DE LA PAPELERA (CON AGRUPACIÓN JERÁRQUICA) ---
 
-@app.route('/papelera')
+@bp.route('/papelera')
 @login_required
 def papelera():
+    # Un solo resumen agrupado por año/mes: conteos y fecha de caducidad se calculan en SQL.
+    # Los registros individuales de cada mes se cargan al desplegarlo (papelera_registros).
     with get_conn() as c:
-        # 1. Obtener todos los elementos de metadatos eliminados (años y meses)
-        elementos_meta = c.execute("""
-            SELECT anio, mes, fecha_eliminacion, responsable, 'periodo' as tipo 
-            FROM metadatos_tablas 
-            WHERE es_eliminado = 1 
-            ORDER BY fecha_eliminacion DESC
-        """).fetchall()
-
-        # 2. Obtener todos los susceptibles eliminados
-        elementos_susceptible = c.execute("""
-            SELECT id, nombre_nino, anio, mes, fecha_eliminacion, 'susceptible' as tipo 
-            FROM susceptible 
-            WHERE es_eliminado = 1 
-            ORDER BY fecha_eliminacion DESC
-        """).fetchall()
+        grupos = c.execute("""
+            SELECT g.anio, g.mes,
+                   SUM(g.registros) AS registros,
+                   MAX(g.periodo_eliminado) AS periodo_eliminado,
+                   date(COALESCE(MAX(g.fecha_periodo), MAX(g.fecha_registros)), '+' || ? || ' days') AS fecha_caducidad
+            FROM (
+                SELECT anio, mes, COUNT(*) AS registros, 0 AS periodo_eliminado,
+                       NULL AS fecha_periodo, MAX(fecha_eliminacion) AS fecha_registros
+                FROM susceptible
+                WHERE es_eliminado = 1
+                GROUP BY anio, mes
+                UNION ALL
+                SELECT anio, mes, 0, 1, fecha_eliminacion, NULL
+                FROM metadatos_tablas
+                WHERE es_eliminado = 1
+            ) g
+            LEFT JOIN periodo p ON p.anio = g.anio AND p.mes = g.mes
+            GROUP BY g.anio, g.mes
+            ORDER BY MAX(p.anio_num) DESC, g.anio DESC, MAX(p.mes_num), MAX(p.secuencia), g.mes
+        """, (current_app.config['PAPELERA_DIAS'],)).fetchall()
 
-    # 3. Procesamiento y Creación de Jerarquía
     papelera_jerarquica = {}
     fecha_actual_str = datetime.datetime.now().strftime('%Y-%m-%d')
 
-    # Procesar Metadatos (Estructura base Año y Mes)
-    for elem in elementos_meta:
-        anio = elem['anio']
-        mes = elem['mes']
-        
-        # Inicializar la estructura del año si no existe
+    for grupo in grupos:
+        anio = grupo['anio']
         if anio not in papelera_jerarquica:
             papelera_jerarquica[anio] = {'Meses': {}, 'Total_Eliminados': 0}
 
-        # Inicializar el mes si no existe
-        if mes not in papelera_jerarquica[anio]['Meses']:
-            papelera_jerarquica[anio]['Meses'][mes] = {'Registros': []}
-
-        # Almacenar el metadato del mes (para recuperación masiva del mes)
-        papelera_jerarquica[anio]['Meses'][mes]['Metadato'] = {
-            'id_clave': anio + mes,
-            'nombre': f"{mes} ({anio})",
-            'tipo': 'periodo',
-            'fecha_eliminacion': elem['fecha_eliminacion'],
-            'fecha_caducidad': (parser.parse(elem['fecha_eliminacion']) + timedelta(days=30)).strftime('%Y-%m-%d')
+        papelera_jerarquica[anio]['Meses'][grupo['mes']] = {
+            'total_registros': grupo['registros'],
+            'periodo_eliminado': bool(grupo['periodo_eliminado']),
+            'fecha_caducidad': grupo['fecha_caducidad'],
         }
-        papelera_jerarquica[anio]['Total_Eliminados'] += 1
-        
-    # Procesar Registros Susceptibles (Dentro de la estructura Mes)
-    for elem in elementos_susceptible:
-        anio = elem['anio']
-        mes = elem['mes']
-        
-        # Asegurarse de que el año y mes existan en la estructura
-        if anio not in papelera_jerarquica:
-             papelera_jerarquica[anio] = {'Meses': {}, 'Total_Eliminados': 0}
-        if mes not in papelera_jerarquica[anio]['Meses']:
-             papelera_jerarquica[anio]['Meses'][mes] = {'Registros': []} # Registros sin metadatos de mes (solo si se usó /vaciar_mes)
-
-        # Almacenar el registro susceptible
-        papelera_jerarquica[anio]['Meses'][mes]['Registros'].append({
-            'id_clave': str(elem['id']),
-            'nombre': elem['nombre_nino'],
-            'tipo': 'susceptible',
-            'fecha_eliminacion': elem['fecha_eliminacion'],
-            'fecha_caducidad': (parser.parse(elem['fecha_eliminacion']) + timedelta(days=30)).strftime('%Y-%m-%d')
-        })
-        papelera_jerarquica[anio]['Total_Eliminados'] += 1
-        
-    # Ordenar los meses dentro de cada año
-    for anio in papelera_jerarquica:
-        meses_ordenados = sorted(papelera_jerarquica[anio]['Meses'].items(), 
-                                key=lambda item: (MESES_ORDEN.index(item[0].split(' (')[0]) if item[0].split(' (')[0] in MESES_ORDEN else 99, item[0]))
-        papelera_jerarquica[anio]['Meses'] = dict(meses_ordenados)
+        papelera_jerarquica[anio]['Total_Eliminados'] += grupo['registros'] + grupo['periodo_eliminado']
 
     return render_template('papelera.html', papelera_jerarquica=papelera_jerarquica, fecha_actual_str=fecha_actual_str)
 
+@bp.route('/papelera/purgar', methods=['POST'])
+@login_required
+def purgar_papelera():
+    """Encola la purga de lo que lleva más de PAPELERA_DIAS días en la papelera."""
+    id_trabajo = encolar_trabajo('purgar_papelera')
+    flash(f"Se está purgando lo que lleva más de {current_app.config['PAPELERA_DIAS']} días en la papelera.", 'warning')
+    return redirect(url_for('sgs.ver_trabajo', id=id_trabajo))
+
+@bp.route('/papelera/registros/<string:anio>/<path:mes>')
+@login_required
+def papelera_registros(anio, mes):
+    """Fragmento HTML con una página de registros eliminados de un mes (paginación por cursor)."""
+    with get_conn() as c:
+        registros, _, cursor_siguiente = paginar_por_id(
+            c,
+            'SELECT id, nombre_nino, fecha_eliminacion FROM susceptible WHERE periodo_id = (SELECT id FROM periodo WHERE anio=? AND mes=?) AND es_eliminado = 1',
+            (anio, mes),
+            antes=request.args.get('antes', type=int),
+        )
+    return render_template('papelera_registros.html', registros=registros, anio=anio, mes=mes, cursor_siguiente=cursor_siguiente)
+
+# --- OPERACIONES POR LOTE (selección múltiple) ---
+# Eliminar o recuperar varios registros de un período con un solo UPDATE, en una transacción.
+# Los ids viajan como un arreglo JSON (json_each), así que no hay límite de parámetros.
+
+def cambiar_estado_lote(c, accion, anio, mes, ids=None, comunidad=None):
+    """Envía a la papelera (accion='eliminar') o recupera los registros del período indicados por
+    `ids` y/o `comunidad`. Devuelve la cantidad de filas afectadas."""
+    if ids is None and not comunidad:
+        raise ValueError('Se necesita una lista de registros o una comunidad.')
+    if accion == 'eliminar':
+        asignacion, estado_origen = 'es_eliminado = 1, fecha_eliminacion = :fecha', 0
+    else:
+        asignacion, estado_origen = 'es_eliminado = 0, fecha_eliminacion = NULL', 1
+    sql = f"""UPDATE susceptible SET {asignacion}
+              WHERE periodo_id = (SELECT id FROM periodo WHERE anio = :anio AND mes = :mes) AND es_eliminado = :origen"""
+    params = {'anio': anio, 'mes': mes, 'origen': estado_origen,
+              'fecha': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    if ids is not None:
+        # Una cadena también es iterable: "12" actuaría sobre los registros 1 y 2
+        if not isinstance(ids, (list, tuple)):
+            raise ValueError('Los registros deben indicarse como una lista de ids.')
+        sql += ' AND id IN (SELECT value FROM json_each(:ids))'
+        params['ids'] = json.dumps([int(i) for i in ids])
+    if comunidad:
+        sql += ' AND comunidad = :comunidad'
+        params['comunidad'] = comunidad
+    with escritura(c):
+        return c.execute(sql, params).rowcount
+
+@bp.route('/lote/<string:accion>', methods=['POST'])
+@login_required
+def lote(accion):
+    """Acepta un formulario (ids[], comunidad, anio, mes) o JSON con las mismas claves.
+    Sin anio/mes se usa el período activo."""
+    if accion not in ('eliminar', 'recuperar'):
+        return ('Acción desconocida', 404)
+    datos = request.get_json(silent=True) if request.is_json else None
+    if datos is None:
+        datos = {'anio': request.form.get('anio'), 'mes': request.form.get('mes'), 'comunidad': request.form.get('comunidad'),
+                 'ids': request.form.getlist('ids') or None}
+    anio_actual, mes_actual = get_current_period()
+    anio, mes = datos.get('anio') or anio_actual, datos.get('mes') or mes_actual
+    destino = url_for('sgs.home') if accion == 'eliminar' else url_for('sgs.papelera')
+
+    try:
+        if not anio or not mes:
+            raise ValueError('No hay un período seleccionado.')
+        ids = datos.get('ids')
+        # El formulario envía los ids como texto; en JSON tienen que ser números enteros
+        if request.is_json and ids is not None and not (isinstance(ids, list) and all(type(i) is int for i in ids)):
+            raise ValueError('"ids" debe ser una lista de números enteros.')
+        with get_conn() as c:
+            afectados = cambiar_estado_lote(c, accion, anio, mes, datos.get('ids'), datos.get('comunidad'))
+            stats = c.execute('SELECT activos, eliminados FROM period_stats WHERE anio=? AND mes=?', (anio, mes)).fetchone()
+    except (ValueError, TypeError) as e:
+        if request.is_json:
+            return jsonify(error=str(e)), 400
+        flash(f'No se pudo aplicar la operación: {e}', 'danger')
+        return redirect(destino)
+
+    activos, en_papelera = (stats['activos'], stats['eliminados']) if stats else (0, 0)
+    if request.is_json:
+        return jsonify(accion=accion, anio=anio, mes=mes, afectados=afectados, activos=activos, en_papelera=en_papelera)
+    if accion == 'eliminar':
+        flash(f'{afectados} registro(s) enviados a la papelera. Puede recuperarlos en 30 días.', 'warning')
+    else:
+        flash(f'{afectados} registro(s) de {mes} {anio} recuperados. Quedan {en_papelera} en la papelera.', 'success')
+    return redirect(destino)
+
 # --- RUTA DE RECUPERACIÓN (MASIVA E INDIVIDUAL) ---
 
-@app.route('/recuperar/<string:tipo>/<path:clave>', methods=['POST'])
+@bp.route('/recuperar/<string:tipo>/<path:clave>', methods=['POST'])
 @login_required
 def recuperar(tipo, clave):
-    with get_conn() as c:
-        if tipo == 'susceptible':
-            # CLAVE es el ID del susceptible
+    if tipo == 'susceptible':
+        # CLAVE es el ID del susceptible
+        with escritura(get_conn()) as c:
             sql = 'UPDATE susceptible SET es_eliminado = 0, fecha_eliminacion = NULL WHERE id=?'
             c.execute(sql, (clave,))
-            flash('Registro individual recuperado con éxito.', 'success')
-            
-        elif tipo == 'periodo':
-            # CLAVE es ANIO + MES
-            if len(clave) >= 4: 
-                anio = clave[:4]
-                mes = clave[4:]
-                
-                # Recuperar Metadato del mes
-                sql_meta = 'UPDATE metadatos_tablas SET es_eliminado = 0, fecha_eliminacion = NULL WHERE anio=? AND mes=?'
-                c.execute(sql_meta, (anio, mes))
-                
-                # Recuperar todos los Susceptibles de ese mes
-                sql_sus = 'UPDATE susceptible SET es_eliminado = 0, fecha_eliminacion = NULL WHERE anio=? AND mes=?'
-                c.execute(sql_sus, (anio, mes))
-                
-                flash(f'Período completo {mes} {anio} y sus registros han sido recuperados con éxito.', 'success')
-
-        elif tipo == 'anio':
-            # CLAVE es solo el ANIO
-            anio = clave
-            
-            # Recuperar todos los metadatos (meses) de ese año
-            sql_meta = 'UPDATE metadatos_tablas SET es_eliminado = 0, fecha_eliminacion = NULL WHERE anio=?'
-            c.execute(sql_meta, (anio,))
-            
-            # Recuperar todos los susceptibles de ese año
-            sql_sus = 'UPDATE susceptible SET es_eliminado = 0, fecha_eliminacion = NULL WHERE anio=?'
-            c.execute(sql_sus, (anio,))
-            
-            flash(f'Año completo {anio} y todos sus contenidos han sido recuperados.', 'success')
+        flash('Registro individual recuperado con éxito.', 'success')
+        
+    elif tipo == 'periodo':
+        # CLAVE es ANIO + MES: el mes y sus susceptibles se recuperan en lotes desde la cola de trabajos
+        if len(clave) >= 4: 
+            anio = clave[:4]
+            mes = clave[4:]
+            id_trabajo = encolar_trabajo('recuperar_periodo', anio=anio, mes=mes)
+            flash(f'Recuperando el período completo {mes} {anio} y sus registros.', 'info')
+            return redirect(url_for('sgs.ver_trabajo', id=id_trabajo))
+
+    elif tipo == 'anio':
+        # CLAVE es solo el ANIO: meses y susceptibles, en lotes desde la cola de trabajos
+        id_trabajo = encolar_trabajo('recuperar_anio', anio=clave)
+        flash(f'Recuperando el año completo {clave} y todos sus contenidos.', 'info')
+        return redirect(url_for('sgs.ver_trabajo', id=id_trabajo))
 
+    else:
+        flash('Error al recuperar el elemento: tipo desconocido.', 'danger')
+        return redirect(url_for('sgs.papelera'))
+        
+    return redirect(url_for('sgs.papelera'))
+
+
+# --- API JSON v1 (sincronización de dispositivos de campo) ---
+# Un lote de operaciones sobre un período se aplica en una sola transacción: cada tipo de operación
+# va en un executemany y la respuesta trae un resultado por elemento, en el mismo orden del lote.
+
+CONFIG_POR_DEFECTO.setdefault('API_TOKEN', os.environ.get('SGS_API_TOKEN'))
+CONFIG_POR_DEFECTO.setdefault('API_MAX_OPERACIONES', 500)
+
+CAMPOS_SUSCEPTIBLE = ('nombre_nino', 'fecha_nacimiento', 'nombre_madre', 'comunidad', 'vacuna_pendiente')
+
+def api_login_required(f):
+    """Como login_required, pero acepta también `Authorization: Bearer <API_TOKEN>` y responde 401 en JSON."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get('logged_in'):
+            return f(*args, **kwargs)
+        token = current_app.config['API_TOKEN']
+        cabecera = request.headers.get('Authorization', '')
+        if token and cabecera.startswith('Bearer ') and hmac.compare_digest(cabecera[7:], token):
+            return f(*args, **kwargs)
+        return jsonify(error='No autorizado'), 401
+    return decorated_function
+
+def _datos_api(datos, parcial):
+    """Valida los campos de un susceptible recibidos por la API. En `parcial` los ausentes quedan en None."""
+    if not isinstance(datos, dict):
+        raise ValueError('"datos" debe ser un objeto')
+    valores = {}
+    for campo in CAMPOS_SUSCEPTIBLE:
+        valor = datos.get(campo)
+        if valor is None:
+            valores[campo] = None if parcial else ''
         else:
-            flash('Error al recuperar el elemento: tipo desconocido.', 'danger')
-            return redirect(url_for('papelera'))
-            
+            valores[campo] = str(valor).strip()
+    if not parcial and not valores['nombre_nino']:
+        raise ValueError('falta el nombre del niño')
+    if parcial and valores['nombre_nino'] == '':
+        raise ValueError('el nombre del niño no puede quedar vacío')
+    if valores['fecha_nacimiento']:
+        valores['fecha_nacimiento'] = normalizar_fecha(valores['fecha_nacimiento'])
+    return tuple(valores[campo] for campo in CAMPOS_SUSCEPTIBLE)
+
+def aplicar_operaciones(c, anio, mes, operaciones, todo_o_nada=False):
+    """Aplica un lote de operaciones crear/actualizar/eliminar sobre un período en una transacción.
+
+    Devuelve la lista de resultados ({'indice', 'ok', 'id'} o {'indice', 'ok': False, 'error'}).
+    Con `todo_o_nada`, si algún elemento es inválido no se aplica ninguno.
+    """
+    resultados = [None] * len(operaciones)
+    crear, actualizar, eliminar = [], [], []
+
+    for indice, op in enumerate(operaciones):
+        try:
+            if not isinstance(op, dict):
+                raise ValueError('la operación debe ser un objeto')
+            tipo = op.get('op')
+            if tipo == 'crear':
+                crear.append((indice, _datos_api(op.get('datos'), parcial=False)))
+            elif tipo in ('actualizar', 'eliminar'):
+                if not isinstance(op.get('id'), int):
+                    raise ValueError('falta el "id" entero del registro')
+                if tipo == 'actualizar':
+                    actualizar.append((indice, op['id'], _datos_api(op.get('datos'), parcial=True)))
+                else:
+                    eliminar.append((indice, op['id']))
+            else:
+                raise ValueError(f'operación desconocida: {tipo!r}')
+        except ValueError as e:
+            resultados[indice] = {'indice': indice, 'ok': False, 'error': str(e)}
+
+    comenzar_escritura(c)
+    try:
+        periodo = obtener_periodo_id(c, anio, mes)
+
+        # Los ids a actualizar o eliminar deben existir, estar activos y pertenecer al período
+        ids_pedidos = [item[1] for item in actualizar + eliminar]
+        existentes = set()
+        for inicio in range(0, len(ids_pedidos), 500):
+            trozo = ids_pedidos[inicio:inicio + 500]
+            existentes.update(fila['id'] for fila in c.execute(
+                f"SELECT id FROM susceptible WHERE periodo_id=? AND es_eliminado = 0 AND id IN ({','.join('?' * len(trozo))})",
+                (periodo, *trozo)))
+        vistos = set()
+        for lista in (actualizar, eliminar):
+            for item in list(lista):
+                indice, id_ = item[0], item[1]
+                if id_ not in existentes or id_ in vistos:
+                    motivo = 'registro no encontrado en el período' if id_ not in existentes else 'registro repetido en el lote'
+                    resultados[indice] = {'indice': indice, 'ok': False, 'error': motivo}
+                    lista.remove(item)
+                else:
+                    vistos.add(id_)
+
+        if todo_o_nada and any(r is not None for r in resultados):
+            c.rollback()
+            return [r or {'indice': i, 'ok': False, 'error': 'no aplicado: el lote tiene elementos inválidos'}
+                    for i, r in enumerate(resultados)]
+
+        if crear:
+            # En la transacción (BEGIN IMMEDIATE) los ids AUTOINCREMENT del lote son consecutivos
+            fila = c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'susceptible'").fetchone()
+            ultimo_id = fila['seq'] if fila else 0
+            c.executemany(
+                'INSERT INTO susceptible(nombre_nino,fecha_nacimiento,nombre_madre,comunidad,vacuna_pendiente, anio, mes, es_eliminado, periodo_id, clave_nino) VALUES(?,?,?,?,?,?,?, 0, ?, ?)',
+                [(*valores, anio, mes, periodo, clave_nino(valores[0], valores[2], valores[1])) for _, valores in crear])
+            actualizar_vacunas(c, 'id > ?', (ultimo_id,))
+            for desplazamiento, (indice, _) in enumerate(crear, start=1):
+                resultados[indice] = {'indice': indice, 'ok': True, 'id': ultimo_id + desplazamiento}
+
+        if actualizar:
+            c.executemany("""
+                UPDATE susceptible SET nombre_nino = COALESCE(?, nombre_nino), fecha_nacimiento = COALESCE(?, fecha_nacimiento),
+                       nombre_madre = COALESCE(?, nombre_madre), comunidad = COALESCE(?, comunidad),
+                       vacuna_pendiente = COALESCE(?, vacuna_pendiente)
+                WHERE id=?
+            """, [(*valores, id_) for _, id_, valores in actualizar])
+            # La clave se recalcula con los valores ya combinados (la operación puede traer solo algunos campos)
+            c.executemany('UPDATE susceptible SET clave_nino = calcular_clave_nino(nombre_nino, nombre_madre, fecha_nacimiento) WHERE id=?',
+                          [(id_,) for _, id_, _ in actualizar])
+            actualizar_vacunas(c, 'id IN (SELECT value FROM json_each(?))', (json.dumps([id_ for _, id_, _ in actualizar]),))
+            for indice, id_, _ in actualizar:
+                resultados[indice] = {'indice': indice, 'ok': True, 'id': id_}
+
+        if eliminar:
+            fecha_actual = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            c.executemany('UPDATE susceptible SET es_eliminado = 1, fecha_eliminacion = ? WHERE id=?',
+                          [(fecha_actual, id_) for _, id_ in eliminar])
+            for indice, id_ in eliminar:
+                resultados[indice] = {'indice': indice, 'ok': True, 'id': id_}
+
         c.commit()
-        
-    return redirect(url_for('papelera'))
+    except Exception:
+        c.rollback()
+        raise
+    return resultados
+
+@bp.route('/api/v1/periodos/<string:anio>/<string:mes>/operaciones', methods=['POST'])
+@api_login_required
+def api_operaciones(anio, mes):
+    cuerpo = request.get_json(silent=True)
+    if not isinstance(cuerpo, dict) or not isinstance(cuerpo.get('operaciones'), list):
+        return jsonify(error='Se espera un objeto JSON con la lista "operaciones"'), 400
+    operaciones = cuerpo['operaciones']
+    if len(operaciones) > current_app.config['API_MAX_OPERACIONES']:
+        return jsonify(error=f"Máximo {current_app.config['API_MAX_OPERACIONES']} operaciones por lote"), 413
+
+    c = get_conn()
+    if c.execute('SELECT 1 FROM metadatos_tablas WHERE anio=? AND mes=? AND es_eliminado = 0', (anio, mes)).fetchone() is None:
+        return jsonify(error=f'El período {anio}-{mes} no existe'), 404
+
+    todo_o_nada = bool(cuerpo.get('todo_o_nada'))
+    resultados = aplicar_operaciones(c, anio, mes, operaciones, todo_o_nada=todo_o_nada)
+    aplicadas = sum(1 for r in resultados if r['ok'])
+    estado = 409 if todo_o_nada and aplicadas < len(resultados) else 200
+    return jsonify(aplicadas=aplicadas, resultados=resultados), estado
+
+@bp.route('/api/v1/reportes/vacunas/<anio>')
+@api_login_required
+def api_reporte_vacunas(anio):
+    """Pendientes de la vacuna `vacuna` (código del catálogo) por período y comunidad; `mes` opcional."""
+    c = get_conn()
+    if not _tiene_tabla(c, 'vacuna_stats'):
+        return jsonify(error=MENSAJE_ARCHIVO_SIN_VACUNAS.format(anio=anio)), 409
+    vacuna = c.execute('SELECT id, codigo, nombre, catalogada FROM vacuna WHERE codigo = ?', (request.args.get('vacuna', '').upper(),)).fetchone()
+    if vacuna is None:
+        return jsonify(error='Vacuna desconocida', vacunas=[f['codigo'] for f in c.execute('SELECT codigo FROM vacuna ORDER BY codigo')]), 404
+    mes = request.args.get('mes') or None
+    filas = reporte_cobertura(c, anio, vacuna['id'], mes)
+    return jsonify(anio=anio, mes=mes, vacuna={k: vacuna[k] for k in ('codigo', 'nombre', 'catalogada')},
+                   filas=[{k: f[k] for k in ('mes', 'comunidad', 'activos', 'pendientes')} for f in filas])
+
+CONFIG_POR_DEFECTO.setdefault('CAMBIOS_PAGINA', 500)
+
+@bp.route('/api/v1/cambios')
+@api_login_required
+def api_cambios():
+    """Cambios posteriores al cursor `desde` (seq), en páginas, con el estado actual de cada fila.
+
+    Filtros opcionales: `anio` y `mes`. Si el cursor es anterior al historial conservado (también con
+    desde=0 una vez recortado), responde `reiniciar: true` y el cliente debe descargar el período completo
+    con /api/v1/periodos/<anio>/<mes>/registros y seguir desde el cursor de esa respuesta.
+    """
+    desde = max(request.args.get('desde', 0, type=int), 0)
+    limite = min(max(request.args.get('limite', current_app.config['CAMBIOS_PAGINA'], type=int), 1), 5000)
+    anio = request.args.get('anio')
+    mes = request.args.get('mes')
+
+    c = get_conn()
+    # Si el recorte vació el historial, el primer seq disponible es el siguiente al último emitido
+    primero = c.execute("""
+        SELECT COALESCE((SELECT MIN(seq) FROM cambios), (SELECT seq + 1 FROM sqlite_sequence WHERE name = 'cambios'))
+    """).fetchone()[0]
+    reiniciar = primero is not None and desde < primero - 1
+
+    filtro, params = '', [desde]
+    if anio:
+        filtro += ' AND ca.anio = ?'
+        params.append(anio)
+        if mes:
+            filtro += ' AND ca.mes = ?'
+            params.append(mes)
+    params.append(limite + 1)
+
+    filas = c.execute(f"""
+        SELECT ca.seq, ca.tabla, ca.registro_id, ca.anio, ca.mes, ca.operacion, ca.fecha,
+               s.id IS NOT NULL AS hay_susceptible, s.nombre_nino, s.fecha_nacimiento, s.nombre_madre, s.comunidad,
+               s.vacuna_pendiente, s.es_eliminado AS s_eliminado, s.row_version AS s_version,
+               m.anio IS NOT NULL AS hay_metadatos, m.responsable, m.municipio, m.puesto_salud,
+               m.es_eliminado AS m_eliminado, m.row_version AS m_version
+        FROM cambios ca
+        LEFT JOIN susceptible s ON ca.tabla = 'susceptible' AND s.id = ca.registro_id
+        LEFT JOIN metadatos_tablas m ON ca.tabla = 'metadatos_tablas' AND m.anio = ca.anio AND m.mes = ca.mes
+        WHERE ca.seq > ?{filtro}
+        ORDER BY ca.seq
+        LIMIT ?
+    """, params).fetchall()
+
+    hay_mas = len(filas) > limite
+    cambios = []
+    for f in filas[:limite]:
+        cambio = {'seq': f['seq'], 'tabla': f['tabla'], 'id': f['registro_id'], 'anio': f['anio'], 'mes': f['mes'],
+                  'operacion': f['operacion'], 'fecha': f['fecha'], 'registro': None}
+        if f['tabla'] == 'susceptible' and f['hay_susceptible']:
+            cambio['registro'] = {campo: f[campo] for campo in CAMPOS_SUSCEPTIBLE}
+            cambio['registro'].update(es_eliminado=f['s_eliminado'], row_version=f['s_version'])
+        elif f['tabla'] == 'metadatos_tablas' and f['hay_metadatos']:
+            cambio['registro'] = {'responsable': f['responsable'], 'municipio': f['municipio'], 'puesto_salud': f['puesto_salud'],
+                                  'es_eliminado': f['m_eliminado'], 'row_version': f['m_version']}
+        cambios.append(cambio)
+
+    cursor = cambios[-1]['seq'] if cambios else desde
+    return jsonify(cambios=cambios, cursor=cursor, hay_mas=hay_mas, reiniciar=reiniciar)
+
+@bp.route('/api/v1/periodos/<string:anio>/<string:mes>/registros')
+@api_login_required
+def api_registros_periodo(anio, mes):
+    """Estado completo del período, papelera incluida, con `id` y `row_version` de cada fila y el cursor
+    desde el que seguir con /api/v1/cambios. Es la descarga que pide `reiniciar: true`."""
+    # El cursor se lee antes que las filas: un cambio que llegue entre medias aparece en las filas y otra vez
+    # en /api/v1/cambios, y volver a aplicarlo no altera el resultado
+    cursor = ultimo_cambio(conexion_principal())[0]
+    c = get_conn()
+    metadatos = c.execute('SELECT responsable, municipio, puesto_salud, es_eliminado, row_version FROM metadatos_tablas WHERE anio=? AND mes=?',
+                          (anio, mes)).fetchone()
+    if metadatos is None:
+        return jsonify(error=f'El período {anio}-{mes} no existe'), 404
+    filas = c.execute(f"""
+        SELECT id, {', '.join(CAMPOS_SUSCEPTIBLE)}, es_eliminado, row_version
+        FROM susceptible
+        WHERE periodo_id = (SELECT id FROM periodo WHERE anio = ? AND mes = ?)
+        ORDER BY id
+    """, (anio, mes)).fetchall()
+    return jsonify(anio=anio, mes=mes, cursor=cursor, metadatos=dict(metadatos), registros=[dict(f) for f in filas])
+
+@bp.route('/api/v1/trabajos/<int:id>')
+@api_login_required
+def api_trabajo(id):
+    """Estado y progreso de un trabajo de la cola."""
+    fila = conexion_principal().execute('SELECT * FROM trabajos WHERE id=?', (id,)).fetchone()
+    if fila is None:
+        return jsonify(error='Trabajo no encontrado'), 404
+    return jsonify(datos_trabajo(fila))
+
+@bp.route('/api/v1/trabajos/<int:id>/cancelar', methods=['POST'])
+@api_login_required
+def api_cancelar_trabajo(id):
+    """Un trabajo pendiente se cancela de inmediato; uno en curso se detiene al terminar el lote actual."""
+    with escritura(conexion_principal()) as c:
+        c.execute("UPDATE trabajos SET estado = 'cancelado', cancelar = 1, terminado = ? WHERE id = ? AND estado = 'pendiente'", (_ahora(), id))
+        c.execute("UPDATE trabajos SET cancelar = 1 WHERE id = ? AND estado = 'en_curso'", (id,))
+        fila = c.execute('SELECT * FROM trabajos WHERE id=?', (id,)).fetchone()
+    if fila is None:
+        return jsonify(error='Trabajo no encontrado'), 404
+    return jsonify(datos_trabajo(fila))
+
+@bp.route('/api/v1/respaldos', methods=['GET', 'POST'])
+@api_login_required
+def api_respaldos():
+    """GET lista los respaldos; POST encola uno nuevo y responde 202 con el trabajo que lo crea."""
+    if request.method == 'POST':
+        id_trabajo = encolar_trabajo('respaldar')
+        return jsonify(trabajo=id_trabajo, estado=url_for('sgs.api_trabajo', id=id_trabajo)), 202
+    return jsonify(respaldos=listar_respaldos(), conservar=current_app.config['RESPALDO_CONSERVAR'])
+
+@bp.route('/api/v1/respaldos/<nombre>')
+@api_login_required
+def api_descargar_respaldo(nombre):
+    if not PATRON_RESPALDO.fullmatch(nombre):
+        return jsonify(error='Nombre de respaldo inválido'), 404
+    return send_from_directory(directorio_respaldos(), nombre, as_attachment=True, mimetype='application/gzip')
+
+@bp.route('/metrics')
+@api_login_required
+def metricas():
+    """Métricas del proceso en formato Prometheus (con el mismo token Bearer que la API)."""
+    return Response(texto_metricas(), mimetype='text/plain; version=0.0.4')
+
+# --- RESUMEN ANUAL (tablero por mes y comunidad) ---
+# Una sola consulta agrupada por mes y comunidad. El resultado se guarda en memoria por año junto con
+# su sello de version_anio y se recalcula solo cuando alguna escritura sobre ese año cambió el sello.
+
+def version_de_anio(c, anio):
+    fila = c.execute('SELECT version FROM version_anio WHERE anio=?', (anio,)).fetchone()
+    return fila['version'] if fila else 0
+
+def _calcular_resumen_anio(c, anio):
+    filas = c.execute("""
+        SELECT p.mes, s.comunidad,
+               COUNT(s.id) AS total,
+               COALESCE(SUM(s.vacuna_pendiente IS NOT NULL AND s.vacuna_pendiente != '' AND s.vacuna_pendiente != 'NINGUNA'), 0) AS pendientes
+        FROM periodo p
+        JOIN metadatos_tablas m ON m.anio = p.anio AND m.mes = p.mes AND m.es_eliminado = 0
+        LEFT JOIN susceptible s ON s.periodo_id = p.id AND s.es_eliminado = 0
+        WHERE p.anio = ?
+        GROUP BY p.id, s.comunidad
+        ORDER BY p.mes_num, p.secuencia, p.mes, s.comunidad
+    """, (anio,)).fetchall()
+
+    meses = {}
+    comunidades = {}
+    for fila in filas:
+        mes = meses.setdefault(fila['mes'], {'total': 0, 'pendientes': 0, 'comunidades': {}})
+        if fila['total'] == 0:
+            continue  # Mes sin registros (fila del LEFT JOIN)
+        comunidad = fila['comunidad'] or 'SIN COMUNIDAD'
+        mes['total'] += fila['total']
+        mes['pendientes'] += fila['pendientes']
+        mes['comunidades'][comunidad] = {'total': fila['total'], 'pendientes': fila['pendientes']}
+        acumulado = comunidades.setdefault(comunidad, {'total': 0, 'pendientes': 0})
+        acumulado['total'] += fila['total']
+        acumulado['pendientes'] += fila['pendientes']
+
+    return {
+        'meses': meses,
+        'comunidades': dict(sorted(comunidades.items())),
+        'total': sum(m['total'] for m in meses.values()),
+        'pendientes': sum(m['pendientes'] for m in meses.values()),
+    }
+
+def resumen_anio(c, anio):
+    """Totales y pendientes del año por mes y por comunidad, desde la caché si el año no cambió."""
+    version = version_de_anio(c, anio)
+    estado = estado_app()
+    with estado.resumen_lock:
+        guardado = estado.resumen_cache.get(anio)
+    if guardado and guardado[0] == version:
+        return guardado[1]
+
+    datos = _calcular_resumen_anio(c, anio)
+    with estado.resumen_lock:
+        estado.resumen_cache[anio] = (version, datos)
+    return datos
+
+@bp.route('/resumen/<string:anio>')
+@login_required
+def resumen(anio):
+    with get_conn() as c:
+        datos = resumen_anio(c, anio)
+    return render_template('resumen_anio.html', anio=anio, resumen=datos)
+
+# --- EXPORTACIÓN CSV (streaming) ---
+# Las filas se leen por lotes desde un cursor y se envían en bloques: la memoria no crece con el
+# tamaño del período o del año y la descarga empieza de inmediato.
+
+CONFIG_POR_DEFECTO.setdefault('EXPORTACION_LOTE', 500)
+CONFIG_POR_DEFECTO.setdefault('EXPORTACION_BLOQUE_BYTES', 64 * 1024)
+
+COLUMNAS_EXPORTACION = ['Año', 'Mes', 'Responsable', 'Municipio', 'Puesto de Salud', 'No. Orden',
+                        'Nombre del niño', 'Fecha Nac.', 'Nombre de la madre', 'Comunidad', 'Vacuna pendiente']
+
+def _filas_exportacion(anio, mes=None, mes_desde=1, mes_hasta=12):
+    """Genera las filas del CSV mes por mes con una conexión propia (vive lo que dure la descarga)."""
+    c = abrir_conexion_anio(anio)
+    try:
+        if mes is None:
+            periodos = periodos_del_anio(c, anio, mes_desde, mes_hasta)
+        else:
+            periodos = c.execute("""
+                SELECT p.id, m.anio, m.mes, m.responsable, m.municipio, m.puesto_salud
+                FROM periodo p JOIN metadatos_tablas m ON m.anio = p.anio AND m.mes = p.mes
+                WHERE p.anio=? AND p.mes=?
+            """, (anio, mes)).fetchall()
+        for periodo in periodos:
+            encabezado = (periodo['anio'], periodo['mes'], periodo['responsable'], periodo['municipio'], periodo['puesto_salud'])
+            cursor = c.execute("""
+                SELECT nombre_nino, fecha_nacimiento, nombre_madre, comunidad, vacuna_pendiente
+                FROM susceptible WHERE periodo_id=? AND es_eliminado = 0 ORDER BY id
+            """, (periodo['id'],))
+            orden = 0
+            while True:
+                lote = cursor.fetchmany(current_app.config['EXPORTACION_LOTE'])
+                if not lote:
+                    break
+                for fila in lote:
+                    orden += 1
+                    yield (*encabezado, orden, *fila)
+    finally:
+        c.close()
+
+def _generar_csv(filas, comprimir=False):
+    """Convierte las filas en bloques de bytes CSV (UTF-8 con BOM para Excel), opcionalmente en gzip."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None
+
+    def vaciar():
+        datos = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+        return compresor.compress(datos) if compresor else datos
+
+    buffer.write('\ufeff')
+    writer.writerow(COLUMNAS_EXPORTACION)
+    for fila in filas:
+        writer.writerow(fila)
+        if buffer.tell() >= current_app.config['EXPORTACION_BLOQUE_BYTES']:
+            bloque = vaciar()
+            if bloque:
+                yield bloque
+    yield vaciar() + (compresor.flush() if compresor else b'')
+
+def _respuesta_csv(filas, nombre):
+    comprimir = request.args.get('gzip') == '1'
+    if comprimir:
+        nombre += '.gz'
+    return Response(_generar_csv(filas, comprimir),
+                    mimetype='application/gzip' if comprimir else 'text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{nombre}"'})
+
+@bp.route('/exportar/<string:anio>/<string:mes>')
+@login_required
+def exportar_periodo(anio, mes):
+    return _respuesta_csv(_filas_exportacion(anio, mes), f'susceptibles_{anio}_{mes}.csv')
+
+@bp.route('/exportar/<string:anio>')
+@login_required
+def exportar_anio(anio):
+    # ?desde=1&hasta=3 exporta solo un rango de meses (primer trimestre)
+    desde = request.args.get('desde', 1, type=int)
+    hasta = request.args.get('hasta', 12, type=int)
+    nombre = f'susceptibles_{anio}.csv' if (desde, hasta) == (1, 12) else f'susceptibles_{anio}_{desde:02d}-{hasta:02d}.csv'
+    return _respuesta_csv(_filas_exportacion(anio, mes_desde=desde, mes_hasta=hasta), nombre)
+
+
+# --- FÁBRICA DE LA APLICACIÓN ---
+
+def create_app(config=None):
+    """Crea una aplicación nueva: valores por defecto, SGS_DB del entorno y luego `config`, con las rutas
+    del blueprint y su propio estado en memoria. Cada llamada devuelve una instancia independiente.
+
+    No abre la base ni arranca hilos: las migraciones se aplican con la primera conexión de cada proceso
+    (seguro con workers pre-fork) y el hilo de trabajos arranca con el primer trabajo encolado.
+    """
+    app = Flask(__name__)
+    app.config.update(CONFIG_POR_DEFECTO)
+    if os.environ.get('SGS_DB'):
+        app.config['DATABASE'] = os.environ['SGS_DB']
+    app.config.update(config or {})
+    app.extensions['sgs'] = SimpleNamespace(
+        purga_lock=threading.Lock(),
+        ultima_purga=None,  # None: todavía no se purgó en este proceso
+        trabajos_evento=threading.Event(),
+        trabajador=None,
+        trabajador_lock=threading.Lock(),
+        fragmentos=OrderedDict(),
+        fragmentos_lock=threading.Lock(),
+        resumen_cache={},
+        resumen_lock=threading.Lock(),
+    )
+    app.register_blueprint(bp)
+    app.view_functions['static'] = servir_estatico
+    app.teardown_appcontext(cerrar_conexion)
+    before_render_template.connect(_inicio_render, app)
+    template_rendered.connect(_fin_render, app)
+    return app
+
+_app_por_defecto = None
 
+def __getattr__(nombre):
+    """`from app import app` (WSGI de PythonAnywhere, `flask --app app`) sigue funcionando: crea la
+    aplicación por defecto la primera vez que se pide."""
+    global _app_por_defecto
+    if nombre != 'app':
+        raise AttributeError(f'module {__name__!r} has no attribute {nombre!r}')
+    if _app_por_defecto is None:
+        _app_por_defecto = create_app()
+    return _app_por_defecto
 
-# --- EJECUCIÓN ---
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app = create_app()
+    if app.config['PURGA_EN_SEGUNDO_PLANO']:
+        with app.app_context():
+            iniciar_purga_en_segundo_plano()
+    app.run(debug=True)
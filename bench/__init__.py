@@ -0,0 +1,4 @@
+"""Pruebas de rendimiento del SGS sobre una base de datos sintética desechable.
+
+Uso: python -m bench [--anios 4] [--filas-por-mes 5000] [--salida resultado.json]
+"""
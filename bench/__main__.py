@@ -0,0 +1,166 @@
+"""Ejecuta los escenarios contra la app real (cliente de pruebas de Flask) e imprime el resultado en JSON.
+
+Los resultados de dos commits se comparan con cualquier diff de JSON; las latencias están en milisegundos.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.generador import generar
+
+
+def percentil(valores, p):
+    """Percentil por rango más cercano (p entre 0 y 100)."""
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[indice]
+
+
+def resumir(muestras):
+    tiempos = [t for t, _ in muestras]
+    consultas = [q for _, q in muestras]
+    return {
+        'n': len(muestras),
+        'p50_ms': round(percentil(tiempos, 50) * 1000, 2),
+        'p95_ms': round(percentil(tiempos, 95) * 1000, 2),
+        'p99_ms': round(percentil(tiempos, 99) * 1000, 2),
+        'consultas_p50': percentil(consultas, 50),
+        'consultas_max': max(consultas),
+    }
+
+
+def commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__)
+    parser.add_argument('--anios', type=int, default=4, help='cantidad de años a generar (terminando en el actual)')
+    parser.add_argument('--filas-por-mes', type=int, default=5000)
+    parser.add_argument('--copias', type=int, default=2, help='meses duplicados por año, tipo "Marzo (2)"')
+    parser.add_argument('--fraccion-papelera', type=float, default=0.05)
+    parser.add_argument('--repeticiones', type=int, default=50, help='peticiones por escenario de lectura')
+    parser.add_argument('--repeticiones-anio', type=int, default=3, help='ciclos eliminar/recuperar año completo')
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--db', help='reutiliza (o crea) esta base en vez de una temporal')
+    parser.add_argument('--salida', help='archivo JSON de salida (por defecto, la salida estándar)')
+    args = parser.parse_args(argv)
+
+    directorio = None
+    if args.db:
+        ruta_db = os.path.abspath(args.db)
+    else:
+        directorio = tempfile.mkdtemp(prefix='sgs-bench-')
+        ruta_db = os.path.join(directorio, 'bench.db')
+    reutilizada = os.path.exists(ruta_db)
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app as sgs
+    from flask import g
+    app = sgs.create_app({'DATABASE': ruta_db, 'TESTING': True, 'TRABAJOS_EN_HILO': False})
+
+    anio_final = time.localtime().tm_year
+    anios = list(range(anio_final - args.anios + 1, anio_final + 1))
+    try:
+        with app.app_context():
+            sgs.init_db()
+            datos = {'reutilizada': reutilizada}
+            if not reutilizada:
+                inicio = time.perf_counter()
+                datos.update(generar(sgs.get_conn(), anios, args.filas_por_mes, args.fraccion_papelera, args.copias, args.semilla))
+                # El generador inserta con SQL directo; las vacunas se relacionan como en las rutas de escritura
+                with sgs.escritura(sgs.get_conn()) as c:
+                    sgs.actualizar_vacunas(c, '1')
+                datos['segundos_generacion'] = round(time.perf_counter() - inicio, 2)
+
+        consultas_por_peticion = []
+
+        @app.after_request
+        def anotar_consultas(respuesta):
+            # Se registra después de registrar_medicion, así que corre antes y todavía ve el acumulado
+            consultas_por_peticion.append(g.metricas_sql['consultas'] if 'metricas_sql' in g else 0)
+            return respuesta
+
+        cliente = app.test_client()
+        anio, mes = str(anios[-1]), 'Marzo'
+        with cliente.session_transaction() as sesion:
+            sesion.update(logged_in=True, username='bench', tabla_actual=anio, mes_activo=mes)
+
+        def medir(metodo, url, repeticiones, **kwargs):
+            muestras = []
+            for _ in range(repeticiones):
+                del consultas_por_peticion[:]
+                inicio = time.perf_counter()
+                respuesta = cliente.open(url, method=metodo, **kwargs)
+                transcurrido = time.perf_counter() - inicio
+                if respuesta.status_code >= 400:
+                    raise SystemExit(f'{metodo} {url} respondió {respuesta.status_code}')
+                muestras.append((transcurrido, sum(consultas_por_peticion)))
+            return muestras
+
+        with app.app_context():
+            id_historial = sgs.get_conn().execute('SELECT MAX(id) FROM susceptible WHERE es_eliminado = 0').fetchone()[0]
+        escenarios = {
+            'home': medir('GET', '/', args.repeticiones),
+            'home_q_nombre': medir('GET', '/?q=José López', args.repeticiones),
+            'home_q_prefijo': medir('GET', '/?q=ma', args.repeticiones),
+            'gestion_mes': medir('GET', f'/gestion_mes/{anio}', args.repeticiones),
+            'papelera': medir('GET', '/papelera', args.repeticiones),
+            'historial_nino': medir('GET', f'/historial/{id_historial}', args.repeticiones),
+            'duplicados': medir('GET', '/duplicados', args.repeticiones),
+            'reporte_vacunas': medir('GET', f'/reportes/vacunas/{anio}?vacuna=SPR', args.repeticiones),
+        }
+        # Página siguiente del listado (paginación por cursor)
+        cursor = re.search(r'[?&]antes=(\d+)', cliente.get('/').get_data(as_text=True))
+        if cursor:
+            escenarios['home_pagina_2'] = medir('GET', f'/?antes={cursor.group(1)}&pag=2', args.repeticiones)
+
+        # La petición solo encola el trabajo; el trabajo en lotes se mide aparte (sin consultas por petición)
+        def ejecutar_trabajos():
+            inicio = time.perf_counter()
+            with app.app_context():
+                sgs.ejecutar_trabajos_pendientes()
+            return [(time.perf_counter() - inicio, 0)]
+
+        eliminar, recuperar, trabajo_eliminar, trabajo_recuperar = [], [], [], []
+        anio_ciclo = str(anios[0])
+        for _ in range(args.repeticiones_anio):
+            eliminar += medir('POST', f'/eliminar_anio_completo/{anio_ciclo}', 1)
+            trabajo_eliminar += ejecutar_trabajos()
+            recuperar += medir('POST', f'/recuperar/anio/{anio_ciclo}', 1)
+            trabajo_recuperar += ejecutar_trabajos()
+        escenarios['eliminar_anio_completo'] = eliminar
+        escenarios['trabajo_eliminar_anio'] = trabajo_eliminar
+        escenarios['recuperar_anio'] = recuperar
+        escenarios['trabajo_recuperar_anio'] = trabajo_recuperar
+
+        resultado = {
+            'commit': commit_actual(),
+            'parametros': {k: v for k, v in vars(args).items() if k not in ('db', 'salida')},
+            'datos': datos,
+            'escenarios': {nombre: resumir(muestras) for nombre, muestras in escenarios.items()},
+        }
+    finally:
+        if directorio:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+    else:
+        print(texto)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Prueba de concurrencia: N procesos escriben a la vez en la misma base por la ruta /crear de la app.
+
+Comprueba que no se pierde ninguna escritura (filas, period_stats y cambios cuadran con lo enviado)
+e imprime el rendimiento en JSON. Termina con código 1 si falta alguna escritura.
+
+Uso: python -m bench.concurrencia [--procesos 4] [--escrituras 250] [--db ruta.db]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANIO, MES = '2030', 'Marzo'
+
+
+def importar_app(ruta_db):
+    if RAIZ not in sys.path:
+        sys.path.insert(0, RAIZ)
+    import app as sgs
+    return sgs, sgs.create_app({'DATABASE': ruta_db, 'TESTING': True, 'TRABAJOS_EN_HILO': False})
+
+
+def escritor(ruta_db, indice, escrituras, barrera, resultados):
+    """Proceso hijo: su propia app y conexión, como un worker de un servidor pre-fork."""
+    sgs, app = importar_app(ruta_db)
+    cliente = app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion.update(logged_in=True, username=f'escritor{indice}', tabla_actual=ANIO, mes_activo=MES)
+
+    fallidas = 0
+    barrera.wait()
+    inicio = time.perf_counter()
+    for n in range(escrituras):
+        respuesta = cliente.post('/crear', data={
+            'nombre_nino': f'Niño {indice}-{n}', 'fecha_nacimiento': '2029-01-01', 'nombre_madre': f'Madre {indice}',
+            'comunidad': f'Comunidad {indice % 3}', 'vacuna_pendiente': 'SRP',
+        })
+        # /crear redirige al listado si guardó; cualquier otra respuesta es una escritura fallida
+        if respuesta.status_code != 302 or '/crear' in respuesta.headers.get('Location', ''):
+            fallidas += 1
+    segundos = time.perf_counter() - inicio
+    reintentos = sgs._contadores.get(('sgs_escritura_reintentos_total', ()), 0)
+    resultados.put({'indice': indice, 'segundos': segundos, 'fallidas': fallidas, 'reintentos': int(reintentos)})
+
+
+def ejecutar(ruta_db, procesos, escrituras):
+    """Lanza `procesos` escritores sobre `ruta_db` (nueva) y devuelve los conteos y tiempos en un dict."""
+    # La base y el año se preparan antes de lanzar los procesos
+    sgs, app = importar_app(ruta_db)
+    cliente = app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion.update(logged_in=True, username='bench')
+    cliente.post('/seleccion', data={'anio_seleccionado': ANIO})
+
+    contexto = multiprocessing.get_context('spawn')
+    barrera = contexto.Barrier(procesos)
+    resultados = contexto.Queue()
+    hijos = [contexto.Process(target=escritor, args=(ruta_db, i, escrituras, barrera, resultados))
+             for i in range(procesos)]
+    inicio = time.perf_counter()
+    for p in hijos:
+        p.start()
+    por_proceso = sorted((resultados.get() for _ in hijos), key=lambda r: r['indice'])
+    for p in hijos:
+        p.join()
+    segundos = time.perf_counter() - inicio
+
+    esperadas = procesos * escrituras
+    with app.app_context():
+        c = sgs.abrir_conexion(ruta_db)
+        filas = c.execute('SELECT COUNT(*) FROM susceptible').fetchone()[0]
+        distintas = c.execute('SELECT COUNT(DISTINCT nombre_nino) FROM susceptible').fetchone()[0]
+        activos = c.execute('SELECT COALESCE(SUM(activos), 0) FROM period_stats WHERE anio=?', (ANIO,)).fetchone()[0]
+        cambios = c.execute("SELECT COUNT(*) FROM cambios WHERE tabla='susceptible' AND operacion='insertar'").fetchone()[0]
+        c.close()
+
+    # Tiempo de escritura: desde que arranca el primero hasta que termina el último (sin el arranque de procesos)
+    escritura = max(r['segundos'] for r in por_proceso)
+    return {
+        'procesos': procesos,
+        'escrituras_esperadas': esperadas,
+        'filas': filas,
+        'filas_distintas': distintas,
+        'period_stats_activos': activos,
+        'cambios_registrados': cambios,
+        'escrituras_fallidas': sum(r['fallidas'] for r in por_proceso),
+        'reintentos_begin': sum(r['reintentos'] for r in por_proceso),
+        'perdidas': esperadas - filas,
+        'escrituras_por_segundo': round(filas / escritura, 1) if escritura else None,
+        'segundos_total': round(segundos, 2),
+        'por_proceso': por_proceso,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench.concurrencia', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--procesos', type=int, default=4)
+    parser.add_argument('--escrituras', type=int, default=250, help='altas por proceso')
+    parser.add_argument('--db', help='base a usar (se borra si existe); por defecto, una temporal')
+    args = parser.parse_args(argv)
+
+    directorio = None
+    if args.db:
+        ruta_db = os.path.abspath(args.db)
+        for sufijo in ('', '-wal', '-shm'):
+            if os.path.exists(ruta_db + sufijo):
+                os.remove(ruta_db + sufijo)
+    else:
+        directorio = tempfile.mkdtemp(prefix='sgs-concurrencia-')
+        ruta_db = os.path.join(directorio, 'concurrencia.db')
+
+    try:
+        resultado = ejecutar(ruta_db, args.procesos, args.escrituras)
+    finally:
+        if directorio:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+    esperadas = resultado['escrituras_esperadas']
+    if not (resultado['filas'] == resultado['filas_distintas'] == resultado['period_stats_activos']
+            == resultado['cambios_registrados'] == esperadas):
+        raise SystemExit('Se perdieron escrituras: los conteos no coinciden con las altas enviadas.')
+
+
+if __name__ == '__main__':
+    main()
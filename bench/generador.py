@@ -0,0 +1,58 @@
+"""Generador de datos sintéticos con el volumen y la forma de producción."""
+import datetime
+import random
+
+NOMBRES = ['José', 'María', 'Óscar', 'Andrés', 'Lucía', 'Sofía', 'Martín', 'Ángel', 'Inés', 'Julián',
+           'Verónica', 'Héctor', 'Raúl', 'Mónica', 'Jesús', 'Ramón', 'Belén', 'Tomás', 'Noé', 'Dalia',
+           'Sebastián', 'Valeria', 'Matías', 'Camila', 'Nicolás', 'Ximena', 'Adrián', 'Rocío', 'Iván', 'Zoé']
+APELLIDOS = ['Pérez', 'López', 'García', 'Hernández', 'Gómez', 'Martínez', 'Rodríguez', 'Méndez', 'Xol', 'Caal',
+             'Pop', 'Choc', 'Tiul', 'Coc', 'Maquín', 'Ical', 'Quej', 'Cucul', 'Sánchez', 'Jiménez']
+COMUNIDADES = ['Cobán', 'San Pedro Carchá', 'San Juan Chamelco', 'Chisec', 'Fray Bartolomé de las Casas',
+               'Santa Cruz Verapaz', 'Tactic', 'Tamahú', 'Tucurú', 'Panzós', 'Senahú', 'Lanquín', 'Cahabón',
+               'Chahal', 'Raxruhá', 'Santa Catalina La Tinta', 'San Cristóbal Verapaz']
+VACUNAS = ['NINGUNA', 'Rotavirus - 1ra Dosis', 'Neumococo Conjugada - 1ra Dosis', 'Hepatitis A',
+           'SRP - 2da Dosis', 'Pentavalente', 'DPT']
+MESES = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio', 'Agosto', 'Septiembre', 'Octubre',
+         'Noviembre', 'Diciembre']
+
+
+def periodos(anios, copias, rnd):
+    """Los 12 meses de cada año más `copias` duplicados tipo "Marzo (2)"."""
+    for anio in anios:
+        for mes in MESES:
+            yield str(anio), mes
+        for mes in rnd.sample(MESES, copias):
+            yield str(anio), f'{mes} (2)'
+
+
+def _persona(rnd):
+    return f'{rnd.choice(NOMBRES)} {rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}'
+
+
+def generar(c, anios, filas_por_mes, fraccion_papelera=0.05, copias=2, semilla=1):
+    """Llena la base (ya migrada) y devuelve un resumen de lo generado.
+
+    Los eliminados quedan con fecha reciente para que la purga automática no los borre durante la prueba.
+    """
+    rnd = random.Random(semilla)
+    ahora = datetime.datetime.now()
+    total = en_papelera = n_periodos = 0
+    for anio, mes in periodos(anios, copias, rnd):
+        n_periodos += 1
+        filas = []
+        for _ in range(filas_por_mes):
+            eliminado = rnd.random() < fraccion_papelera
+            nacimiento = datetime.date(int(anio) - rnd.randint(0, 4), rnd.randint(1, 12), rnd.randint(1, 28))
+            fecha_eliminacion = (ahora - datetime.timedelta(days=rnd.randint(0, 20))).strftime('%Y-%m-%d %H:%M:%S')
+            filas.append((_persona(rnd), nacimiento.isoformat(), _persona(rnd), rnd.choice(COMUNIDADES),
+                          rnd.choice(VACUNAS), anio, mes, int(eliminado), fecha_eliminacion if eliminado else None))
+            en_papelera += eliminado
+        with c:
+            c.execute("""INSERT OR IGNORE INTO metadatos_tablas (anio, mes, responsable, municipio, puesto_salud, es_eliminado)
+                         VALUES (?, ?, ?, 'Cobán', 'Puesto de Salud Chirrequim', 0)""", (anio, mes, _persona(rnd)))
+            c.executemany("""INSERT INTO susceptible (nombre_nino, fecha_nacimiento, nombre_madre, comunidad, vacuna_pendiente,
+                                                      anio, mes, es_eliminado, fecha_eliminacion, clave_nino)
+                             VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, calcular_clave_nino(?1, ?3, ?2))""", filas)
+        total += len(filas)
+    c.execute('ANALYZE')
+    return {'periodos': n_periodos, 'susceptibles': total, 'en_papelera': en_papelera}
@@ -0,0 +1,22 @@
+"""Escrituras concurrentes: varios procesos escribiendo a la vez en la misma base no pierden ninguna alta."""
+import os
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+from bench import concurrencia  # noqa: E402
+
+PROCESOS = 4
+ESCRITURAS = 50  # por proceso
+
+
+def test_sin_escrituras_perdidas(tmp_path):
+    resultado = concurrencia.ejecutar(str(tmp_path / 'concurrencia.db'), PROCESOS, ESCRITURAS)
+    esperadas = PROCESOS * ESCRITURAS
+    assert resultado['escrituras_fallidas'] == 0
+    assert resultado['perdidas'] == 0
+    assert resultado['filas'] == resultado['filas_distintas'] == esperadas
+    assert resultado['period_stats_activos'] == esperadas
+    assert resultado['cambios_registrados'] == esperadas
@@ -0,0 +1,59 @@
+"""Importación CSV: las filas importadas deben quedar guardadas en la base, no solo en el reporte."""
+import io
+import os
+import sqlite3
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANIO, MES = '2030', 'Marzo'
+FILAS = 2500  # más de dos lotes de IMPORTACION_LOTE
+
+
+@pytest.fixture
+def cliente(tmp_path, monkeypatch):
+    ruta_db = str(tmp_path / 'sgs.db')
+    monkeypatch.setenv('SGS_DB', ruta_db)
+    if RAIZ not in sys.path:
+        sys.path.insert(0, RAIZ)
+    import app as sgs
+    app = sgs.create_app({'DATABASE': ruta_db, 'TESTING': True, 'TRABAJOS_EN_HILO': False})
+    cliente = app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion.update(logged_in=True, username='prueba')
+    cliente.post('/seleccion', data={'anio_seleccionado': ANIO})
+    with cliente.session_transaction() as sesion:
+        sesion.update(tabla_actual=ANIO, mes_activo=MES)
+    return cliente, ruta_db
+
+
+def _csv(filas):
+    lineas = ['nombre_nino,fecha_nacimiento,nombre_madre,comunidad,vacuna_pendiente']
+    lineas += [f'Niño {n},2029-01-01,Madre {n},Comunidad {n % 3},SRP' for n in range(filas)]
+    return io.BytesIO('\n'.join(lineas).encode('utf-8'))
+
+
+def _contar(ruta_db):
+    # Conexión nueva: solo ve lo que se confirmó
+    c = sqlite3.connect(ruta_db)
+    try:
+        return c.execute('SELECT COUNT(*) FROM susceptible WHERE anio=? AND mes=? AND es_eliminado=0', (ANIO, MES)).fetchone()[0]
+    finally:
+        c.close()
+
+
+def test_importacion_guarda_las_filas(cliente):
+    cliente, ruta_db = cliente
+    respuesta = cliente.post('/importar', data={'archivo': (_csv(FILAS), 'susceptibles.csv')},
+                             content_type='multipart/form-data')
+    assert respuesta.status_code == 200
+    assert _contar(ruta_db) == FILAS
+
+
+def test_simulacion_no_guarda(cliente):
+    cliente, ruta_db = cliente
+    respuesta = cliente.post('/importar', data={'archivo': (_csv(10), 'susceptibles.csv'), 'simulacion': '1'},
+                             content_type='multipart/form-data')
+    assert respuesta.status_code == 200
+    assert _contar(ruta_db) == 0